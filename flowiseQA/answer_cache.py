@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import math
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from cache import TTLCache
+from config import (
+    ANSWER_CACHE_ENABLED, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_KB_CHECK_INTERVAL,
+    ANSWER_CACHE_EMBEDDING_ENABLED, ANSWER_CACHE_SIMILARITY
+)
+from executors import run_qa
+from intent_resolver import normalize_question
+import kb_cache
+from ollama_client import aembed
+
+logger = logging.getLogger(__name__)
+
+# 答案缓存（按chatflow分区）：
+#   1) 原始问题精确匹配  2) 归一化问题匹配  3) 可选：问题向量余弦相似度匹配
+# 缓存内容为标注后的答案（不含意图说明）、原始答案与来源文档；
+# 每个条目记录写入时该chatflow所用知识库的版本（updatedDate），版本变化后条目失效
+
+@dataclass
+class CachedAnswer:
+    answer_raw: str
+    answer_annotated: str
+    source_documents: List[Dict[str, Any]]
+    mermaid_replaced: bool
+    kb_version: str = ""
+
+@dataclass
+class CacheProbe:
+    """
+    一次查找的上下文，未命中时原样传给 store，避免重复计算向量
+    """
+    chatflow_id: str
+    exact_key: Tuple[str, str, str]
+    normalized_key: Tuple[str, str, str]
+    embedding: Optional[List[float]] = None
+
+# 向量索引：chatflow -> {归一化键: 单位向量}，随缓存条目淘汰/删除同步清理
+_embedding_index: Dict[str, "OrderedDict[Tuple[str, str, str], List[float]]"] = {}
+
+def _on_evict(key: Hashable) -> None:
+    if key[1] == "norm":
+        index = _embedding_index.get(key[0])
+        if index is not None:
+            index.pop(key, None)
+
+_answers = TTLCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, name="answer", on_evict=_on_evict)
+_kb_versions: Dict[str, str] = {}
+_kb_versions_loaded = False
+_tier_hits: Dict[str, int] = defaultdict(int)
+
+def _unit(vector: List[float]) -> Optional[List[float]]:
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else None
+
+def _best_match(query: List[float], entries: List[Tuple[Tuple[str, str, str], List[float]]]) -> Tuple[Optional[Tuple[str, str, str]], float]:
+    """
+    在单位向量中找余弦相似度最高的条目（点积即余弦），在线程池中执行
+    """
+    best_key, best_score = None, 0.0
+    for key, vector in entries:
+        score = sum(x * y for x, y in zip(query, vector))
+        if score > best_score:
+            best_key, best_score = key, score
+    return best_key, best_score
+
+def _current_version(chatflow_id: str) -> str:
+    return _kb_versions.get(chatflow_id, "")
+
+def _valid(entry: Optional[CachedAnswer], chatflow_id: str) -> bool:
+    return entry is not None and entry.kb_version == _current_version(chatflow_id)
+
+async def lookup(chatflow_id: str, question: str) -> Tuple[Optional[CachedAnswer], CacheProbe]:
+    """
+    查找缓存答案，返回 (命中的答案或None, 查找上下文)
+    """
+    probe = CacheProbe(
+        chatflow_id=chatflow_id,
+        exact_key=(chatflow_id, "exact", question),
+        normalized_key=(chatflow_id, "norm", normalize_question(question)),
+    )
+    if not ANSWER_CACHE_ENABLED:
+        return None, probe
+
+    for tier, key in (("exact", probe.exact_key), ("normalized", probe.normalized_key)):
+        entry = _answers.get(key)
+        if _valid(entry, chatflow_id):
+            _tier_hits[tier] += 1
+            return entry, probe
+        if entry is not None:
+            _answers.pop(key)
+
+    if ANSWER_CACHE_EMBEDDING_ENABLED:
+        try:
+            probe.embedding = _unit(await aembed(question) or [])
+        except Exception as e:
+            logger.warning("问题向量生成失败: %s", e)
+        index = _embedding_index.get(chatflow_id)
+        if probe.embedding and index:
+            # 在事件循环中取快照，相似度计算放到线程池，避免阻塞其他请求
+            best_key, best_score = await run_qa(_best_match, probe.embedding, list(index.items()))
+            if best_key is not None and best_score >= ANSWER_CACHE_SIMILARITY:
+                entry = _answers.get(best_key)
+                if _valid(entry, chatflow_id):
+                    _tier_hits["semantic"] += 1
+                    return entry, probe
+                if entry is not None:
+                    _answers.pop(best_key)
+
+    return None, probe
+
+def store(probe: CacheProbe, entry: CachedAnswer) -> None:
+    """
+    写入缓存（精确与归一化两个键指向同一条目）
+    """
+    if not ANSWER_CACHE_ENABLED or not entry.answer_raw:
+        return
+    entry.kb_version = _current_version(probe.chatflow_id)
+    _answers.set(probe.exact_key, entry)
+    _answers.set(probe.normalized_key, entry)
+    if probe.embedding:
+        index = _embedding_index.setdefault(probe.chatflow_id, OrderedDict())
+        index[probe.normalized_key] = probe.embedding
+        index.move_to_end(probe.normalized_key)
+        while len(index) > ANSWER_CACHE_SIZE:
+            index.popitem(last=False)
+
+def _versions_from_knowledge_bases(knowledge_bases: List[Dict[str, Any]]) -> Dict[str, str]:
+    """
+    由知识库列表计算每个chatflow的知识库版本：其引用的所有知识库 (id, updatedDate) 拼接
+    """
+    per_chatflow: Dict[str, List[str]] = defaultdict(list)
+    for kb in knowledge_bases:
+        where_used = kb.get("whereUsed") or []
+        if isinstance(where_used, str):
+            where_used = [where_used]
+        for used in where_used:
+            chatflow_id = used.get("id") if isinstance(used, dict) else used
+            if chatflow_id:
+                per_chatflow[chatflow_id].append(f"{kb.get('id', '')}@{kb.get('updatedDate', '')}")
+    return {cf: "|".join(sorted(parts)) for cf, parts in per_chatflow.items()}
+
+def apply_kb_versions(knowledge_bases: List[Dict[str, Any]]) -> List[str]:
+    """
+    更新知识库版本，返回版本发生变化的chatflow列表（这些chatflow的缓存随之失效）
+    """
+    global _kb_versions, _kb_versions_loaded
+    new_versions = _versions_from_knowledge_bases(knowledge_bases)
+    changed = []
+    if _kb_versions_loaded:
+        changed = [cf for cf in set(_kb_versions) | set(new_versions) if _kb_versions.get(cf) != new_versions.get(cf)]
+    _kb_versions = new_versions
+    _kb_versions_loaded = True
+    for chatflow_id in changed:
+        _embedding_index.pop(chatflow_id, None)
+        logger.info("知识库已更新，失效chatflow缓存: %s", chatflow_id)
+    return changed
+
+async def watch_knowledge_bases() -> None:
+    """
+    后台任务：定期检查知识库 updatedDate，变化时使对应chatflow的缓存失效
+    """
+    while True:
+        try:
+            # 与知识库接口共用元数据缓存，不单独请求Flowise
+            apply_kb_versions((await kb_cache.get_snapshot()).raw)
+        except Exception as e:
+            logger.warning("检查知识库版本失败: %s", e)
+        await asyncio.sleep(ANSWER_CACHE_KB_CHECK_INTERVAL)
+
+def answer_cache_stats() -> Dict[str, Any]:
+    return {
+        **_answers.stats(),
+        "tier_hits": dict(_tier_hits),
+        "semantic_index": {cf: len(index) for cf, index in _embedding_index.items()},
+    }
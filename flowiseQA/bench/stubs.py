@@ -0,0 +1,274 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import zlib
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, List, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 本地上游桩服务：在一个进程内模拟 Flowise（预测、文档库）、Ollama（意图识别、向量）、gStore /query 和 mermaid 接口。
+# 各上游的延迟、答案长度、来源文档数量、图查询返回行数均按对数正态分布随机生成（中位数 + 99分位），
+# 同一个问题总是得到相同的意图与答案，保证多次运行的负载可比
+#
+# 单独启动：python -m bench.stubs --port 18900 --latency flowise=1.0:4.0,gstore=0.05:0.4
+
+BENCH_URI_PREFIX = "http://bench.local/entity/"
+
+# 答案与图数据使用的实体词表（实体抽取桩只会标注这些词）
+VOCABULARY = [
+    "坦克", "步兵", "装甲车", "火炮", "雷达", "无人机", "直升机", "导弹", "驱逐舰", "护卫舰",
+    "潜艇", "战斗机", "运输机", "指挥所", "补给线", "侦察连", "工兵营", "防空营", "通信站", "弹药库",
+    "机场", "港口", "桥梁", "高地", "渡口", "阵地", "前沿", "纵深", "侧翼", "预备队",
+    "北部战区", "东部战区", "联合指挥部", "后勤保障部", "电子战", "火力支援", "机动作战", "协同作战", "夜间行军", "野战医院",
+]
+
+_FILLER = ["在当前态势下", "根据条令要求", "结合现有情报", "按照作战计划", "从整体部署看", "综合各方面因素"]
+
+@dataclass
+class Dist:
+    """
+    对数正态分布，由中位数与99分位确定；中位数为0时恒为0
+    """
+    median: float
+    p99: float
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median <= 0:
+            return 0.0
+        sigma = math.log(max(self.p99, self.median) / self.median) / 2.3263
+        return rng.lognormvariate(math.log(self.median), sigma)
+
+    @classmethod
+    def parse(cls, spec: str) -> "Dist":
+        median, _, p99 = spec.partition(":")
+        return cls(float(median), float(p99 or median))
+
+@dataclass
+class StubProfile:
+    """
+    桩服务的延迟（秒）与返回大小分布
+    """
+    flowise: Dist = field(default_factory=lambda: Dist(1.0, 4.0))
+    flowise_kb: Dist = field(default_factory=lambda: Dist(0.02, 0.1))
+    ollama: Dist = field(default_factory=lambda: Dist(0.2, 0.8))
+    embed: Dist = field(default_factory=lambda: Dist(0.02, 0.08))
+    gstore: Dist = field(default_factory=lambda: Dist(0.05, 0.4))
+    mermaid: Dist = field(default_factory=lambda: Dist(0.02, 0.1))
+    answer_chars: Dist = field(default_factory=lambda: Dist(600, 3000))
+    source_docs: Dist = field(default_factory=lambda: Dist(4, 8))
+    doc_chars: Dist = field(default_factory=lambda: Dist(500, 1500))
+    graph_rows: Dist = field(default_factory=lambda: Dist(30, 100))
+    latency_scale: float = 1.0
+    mermaid_ratio: float = 0.1
+
+    def update(self, spec: str) -> "StubProfile":
+        """
+        按 "name=median:p99,name=median:p99" 覆盖分布，name 为本类中的字段名
+        """
+        names = {f.name for f in fields(self) if f.type in (Dist, "Dist")}
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            name, _, value = item.partition("=")
+            if name not in names:
+                raise ValueError(f"未知的分布名称: {name}（可选: {', '.join(sorted(names))}）")
+            setattr(self, name, Dist.parse(value))
+        return self
+
+def _seed_of(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+def _sentences(rng: random.Random, chars: int) -> str:
+    parts: List[str] = []
+    size = 0
+    while size < chars:
+        a, b = rng.sample(VOCABULARY, 2)
+        sentence = f"{rng.choice(_FILLER)}，{a}与{b}需要保持协同，{a}负责前出警戒。"
+        parts.append(sentence)
+        size += len(sentence)
+    return "".join(parts)
+
+def _literal(value: str) -> Dict[str, str]:
+    return {"type": "literal", "value": value}
+
+def _uri(value: str) -> Dict[str, str]:
+    return {"type": "uri", "value": value}
+
+def _entity_uri(term: str) -> str:
+    return f"{BENCH_URI_PREFIX}{VOCABULARY.index(term)}"
+
+_TERM_PATTERN = re.compile("|".join(sorted(map(re.escape, VOCABULARY), key=len, reverse=True)))
+_URI_PATTERN = re.compile(r"<(" + re.escape(BENCH_URI_PREFIX) + r"\d+)>")
+_NEEDLE_PATTERN = re.compile(r"VALUES \?needle \{([^}]*)\}")
+_LIMIT_PATTERN = re.compile(r"LIMIT (\d+)(?: OFFSET (\d+))?")
+
+def build_app(profile: Optional[StubProfile] = None, seed: int = 7) -> FastAPI:
+    profile = profile or StubProfile()
+    rng = random.Random(seed)
+    app = FastAPI(title="flowiseQA upstream stubs")
+    calls: Dict[str, int] = {}
+
+    async def delay(name: str) -> None:
+        calls[name] = calls.get(name, 0) + 1
+        seconds = getattr(profile, name).sample(rng) * profile.latency_scale
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    def answer_for(question: str) -> Dict[str, Any]:
+        local = random.Random(_seed_of(question))
+        text = _sentences(local, int(profile.answer_chars.sample(local)))
+        if local.random() < profile.mermaid_ratio:
+            text += "\n```mermaid\ngraph TD\n  A[坦克] --> B[步兵]\n```\n"
+        docs = [
+            {
+                "pageContent": _sentences(local, int(profile.doc_chars.sample(local))),
+                "metadata": {"source": f"bench-{i}.pdf", "loc": {"lines": {"from": i * 10, "to": i * 10 + 9}}},
+            }
+            for i in range(max(0, round(profile.source_docs.sample(local))))
+        ]
+        return {"text": text, "sourceDocuments": docs}
+
+    def graph_rows(term: str, count: int) -> List[Dict[str, Any]]:
+        local = random.Random(_seed_of(term))
+        rows = []
+        for i in range(count):
+            other = local.choice(VOCABULARY)
+            rows.append({
+                "subject": _uri(_entity_uri(term)),
+                "predicate": _uri(f"http://bench.local/relation/{i % 7}"),
+                "object": _uri(_entity_uri(other)) if i % 3 else _literal(f"{term}属性{i}"),
+                "subjectLabel": _literal(term),
+                "objectLabel": _literal(other),
+                "subjectType": _literal("装备"),
+                "objectType": _literal("装备"),
+            })
+        return rows
+
+    @app.get("/stats")
+    async def stats():
+        return calls
+
+    @app.post("/api/v1/prediction/{chatflow_id}")
+    async def prediction(chatflow_id: str, request: Request):
+        body = await request.json()
+        question = body.get("question", "")
+        await delay("flowise")
+        if "命名实体抽取" in question:
+            # 实体抽取：取出待处理文本，为词表中的词加上 <class> 标签
+            text = question.split("待处理文本：\n", 1)[-1].rsplit("\n\n标注结果：", 1)[0]
+            return {"text": _TERM_PATTERN.sub(lambda m: f"<class>{m.group(0)}</class>", text)}
+        result = answer_for(question)
+        if not body.get("streaming"):
+            return result
+
+        async def events():
+            text = result["text"]
+            for i in range(0, len(text), 16):
+                yield f"message:\ndata: {json.dumps({'event': 'token', 'data': text[i:i + 16]}, ensure_ascii=False)}\n\n"
+            yield f"message:\ndata: {json.dumps({'event': 'sourceDocuments', 'data': result['sourceDocuments']}, ensure_ascii=False)}\n\n"
+            yield 'message:\ndata: {"event":"end","data":"[DONE]"}\n\n'
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    def knowledge_base(kb_id: str) -> Dict[str, Any]:
+        return {
+            "id": kb_id, "name": f"知识库{kb_id}", "description": "", "status": "SYNC",
+            "loaders": [{"id": f"{kb_id}-loader", "files": [{"id": f"{kb_id}-f{i}", "name": f"doc{i}.pdf", "status": "SYNC", "size": 1024 * (i + 1)} for i in range(5)]}],
+            "whereUsed": [], "createdDate": "2024-01-01T00:00:00.000Z", "updatedDate": "2024-01-01T00:00:00.000Z",
+            "workspaceId": "", "totalChars": 0, "totalChunks": 0,
+        }
+
+    @app.get("/api/v1/document-store/store")
+    async def stores():
+        await delay("flowise_kb")
+        return [knowledge_base(f"kb{i}") for i in range(3)]
+
+    @app.get("/api/v1/document-store/store/{kb_id}")
+    async def store(kb_id: str):
+        await delay("flowise_kb")
+        return knowledge_base(kb_id)
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        await delay("ollama")
+        question = body.get("prompt", "").rsplit("用户问题：", 1)[-1]
+        return {"model": body.get("model"), "response": json.dumps({"intent_id": _seed_of(question) % 4 + 1}), "done": True}
+
+    @app.post("/api/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        await delay("embed")
+        local = random.Random(_seed_of(body.get("prompt", "")))
+        return {"embedding": [local.uniform(-1, 1) for _ in range(64)]}
+
+    @app.post("/api/mermaid/replace-with-images")
+    async def mermaid(request: Request):
+        body = await request.json()
+        await delay("mermaid")
+        content = body.get("content", "")
+        if "```mermaid" not in content:
+            return {"success": False, "message": "未发现mermaid代码块"}
+        replaced = re.sub(r"```mermaid.*?```", "![diagram](http://bench.local/diagram.png)", content, flags=re.S)
+        return {"success": True, "message": "ok", "result": replaced}
+
+    @app.post("/query")
+    async def query(request: Request):
+        body = await request.json()
+        sparql = body.get("sparql", "")
+        await delay("gstore")
+        limit_match = _LIMIT_PATTERN.search(sparql)
+        limit = int(limit_match.group(1)) if limit_match else 100
+        offset = int(limit_match.group(2) or 0) if limit_match else 0
+
+        if "SELECT ?s ?o" in sparql:
+            # 标签索引构建：分页返回词表中每个实体的标签
+            rows = [{"s": _uri(_entity_uri(term)), "o": _literal(term)} for term in VOCABULARY]
+            bindings = rows[offset:offset + limit]
+        elif "SELECT DISTINCT ?label" in sparql:
+            bindings = [{"label": _literal(term)} for term in VOCABULARY][offset:offset + limit]
+        elif "?needle" in sparql:
+            needles = re.findall(r'"((?:[^"\\]|\\.)*)"', (_NEEDLE_PATTERN.search(sparql) or [None, ""])[1])
+            bindings = []
+            for needle in needles:
+                for row in graph_rows(needle, min(100, int(profile.graph_rows.sample(rng)))):
+                    bindings.append({"needle": _literal(needle), **row})
+        else:
+            uris = _URI_PATTERN.findall(sparql)
+            terms = [VOCABULARY[int(uri.rsplit("/", 1)[-1])] for uri in uris if int(uri.rsplit("/", 1)[-1]) < len(VOCABULARY)]
+            if not terms:
+                # CONTAINS 单实体查询：从 FILTER 中取出查询文本
+                literal = re.search(r'LCASE\("((?:[^"\\]|\\.)*)"\)', sparql)
+                terms = [literal.group(1)] if literal else [rng.choice(VOCABULARY)]
+            bindings = []
+            for term in terms:
+                bindings += graph_rows(term, int(profile.graph_rows.sample(rng)))
+            bindings = bindings[:limit]
+        return JSONResponse({"head": {"vars": []}, "results": {"bindings": bindings}})
+
+    return app
+
+def add_profile_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency", default="", help="覆盖延迟/大小分布，如 flowise=1.0:4.0,gstore=0.05:0.4（中位数:99分位）")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="所有上游延迟的缩放倍数，0 表示不加延迟")
+    parser.add_argument("--mermaid-ratio", type=float, default=0.1, help="答案中包含mermaid代码块的比例")
+    parser.add_argument("--seed", type=int, default=7)
+
+def profile_from_args(args: argparse.Namespace) -> StubProfile:
+    profile = StubProfile(latency_scale=args.latency_scale, mermaid_ratio=args.mermaid_ratio)
+    return profile.update(args.latency)
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="flowiseQA 上游桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18900)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(build_app(profile_from_args(args), args.seed), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+# 进程内通用缓存：容量上限 + LRU淘汰 + TTL过期，线程安全，带命中统计
+
+_MISSING = object()
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: Optional[float], name: Optional[str] = None,
+                 on_evict: Optional[Callable[[Hashable], None]] = None):
+        """
+        Args:
+            maxsize: 最大条目数，超出时淘汰最久未使用的条目
+            ttl: 默认过期时间（秒），None 表示不过期
+            name: 缓存名称，设置后会登记到全局统计中
+            on_evict: 条目被淘汰、过期、删除或清空时的回调（参数为键，在锁外调用）
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        if name:
+            _registry[name] = self
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at is None or expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+            self.misses += 1
+        self._evicted([key])
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        evicted = []
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False)[0])
+        self._evicted(evicted)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+        if item is _MISSING:
+            return default
+        self._evicted([key])
+        return item[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            keys = list(self._data)
+            self._data.clear()
+        self._evicted(keys)
+
+    def _evicted(self, keys: List[Hashable]) -> None:
+        if self.on_evict is not None:
+            for key in keys:
+                self.on_evict(key)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+_registry: Dict[str, TTLCache] = {}
+
+def all_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    返回所有具名缓存的统计信息
+    """
+    return {name: cache.stats() for name, cache in _registry.items()}
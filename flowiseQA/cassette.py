@@ -0,0 +1,347 @@
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import httpx
+from config import (
+    UPSTREAM_CASSETTE_MODE, UPSTREAM_CASSETTE_PATH, UPSTREAM_CASSETTE_LATENCY_SCALE, UPSTREAM_CASSETTE_MATCH
+)
+
+logger = logging.getLogger(__name__)
+
+# 上游流量录制/回放：record 模式在异步传输层旁路记录每次上游交互（请求、状态码、响应体、首字节与完整耗时），
+# 逐行写入 gzip 压缩的 JSON Lines 磁带文件，流式响应原样透传给调用方；
+# replay 模式不访问网络，按请求内容匹配录制的响应，按录制耗时（乘以缩放系数）返回，流式响应按原节奏分段输出
+
+# 不参与匹配的请求字段（会话ID等每次不同），password 同时在录制时脱敏
+_VOLATILE_FIELDS = ("overrideConfig", "sessionId", "chatId", "password")
+_REDACTED_FIELDS = ("password",)
+# 请求体中代表"请求内容"的字段，用于未精确命中时按同类请求匹配
+_TEXT_FIELDS = ("question", "prompt", "sparql", "content")
+_KEPT_HEADERS = ("content-type", "content-encoding")
+
+def _parse_body(content: bytes) -> Any:
+    if not content:
+        return None
+    try:
+        return json.loads(content)
+    except ValueError:
+        return content.decode("utf-8", errors="replace")
+
+def _redact(body: Any) -> Any:
+    if isinstance(body, dict):
+        return {k: ("***" if k in _REDACTED_FIELDS else v) for k, v in body.items()}
+    return body
+
+def _exact_key(upstream: str, method: str, url: str, body: Any) -> str:
+    if isinstance(body, dict):
+        body = {k: v for k, v in body.items() if k not in _VOLATILE_FIELDS}
+    raw = json.dumps([upstream, method, url, body], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def _similar_key(upstream: str, method: str, url: str, body: Any) -> str:
+    """
+    同类请求的键：接口 + 提示词模板的首行（多行提示词如实体抽取、意图识别），单行内容（用户问题）归为一类
+    """
+    path = url.split("?", 1)[0]
+    text = ""
+    if isinstance(body, dict):
+        text = next((str(body[f]) for f in _TEXT_FIELDS if f in body), "")
+    elif isinstance(body, str):
+        text = body
+    lines = text.strip().splitlines()
+    template = lines[0][:40] if len(lines) > 1 else ""
+    return f"{upstream} {method} {path} {template}"
+
+def _url_of(request: httpx.Request) -> str:
+    # 只取路径与查询串：录制与回放时的上游地址可以不同
+    return request.url.raw_path.decode("ascii")
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    def incr(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "recorded": self.recorded,
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+            }
+
+_stats = _Stats()
+
+class _Writer:
+    """
+    磁带写入：所有上游共用一个文件，每条记录写入后同步刷新，进程异常退出时已写入的记录仍可读取
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = gzip.open(self.path, "at", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+        _stats.incr("recorded")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+def read_records(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    逐条读取磁带记录；文件末尾不完整（录制进程未正常关闭）时读到最后一条完整记录为止
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    logger.warning("跳过无法解析的磁带记录: %.100s", line)
+        except (EOFError, gzip.BadGzipFile, zlib.error):
+            logger.warning("磁带文件末尾不完整，已读取到最后一条完整记录: %s", path)
+
+class _RecordingStream(httpx.AsyncByteStream):
+    """
+    透传响应体的同时累积内容，响应关闭时写入一条磁带记录
+    （调用方提前结束读取时，如流式响应收到 end 事件后，记录已读取的部分）
+    """
+    def __init__(self, stream: httpx.AsyncByteStream, on_complete):
+        self._stream = stream
+        self._on_complete = on_complete
+        self._chunks: List[bytes] = []
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._chunks.append(chunk)
+            yield chunk
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+        if not self._closed:
+            self._closed = True
+            self._on_complete(b"".join(self._chunks))
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """
+    包装真实的传输层：请求照常发出，交互内容写入磁带
+    """
+    def __init__(self, upstream: str, inner: httpx.AsyncBaseTransport, writer: "_Writer"):
+        self.upstream = upstream
+        self.inner = inner
+        self.writer = writer
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.monotonic()
+        request_body = _parse_body(await request.aread())
+        response = await self.inner.handle_async_request(request)
+        ttfb = time.monotonic() - started
+
+        def on_complete(content: bytes) -> None:
+            headers = {name: response.headers[name] for name in _KEPT_HEADERS if name in response.headers}
+            record = {
+                "upstream": self.upstream,
+                "method": request.method,
+                "url": _url_of(request),
+                "request": _redact(request_body),
+                "status": response.status_code,
+                "headers": headers,
+                "ttfb": round(ttfb, 4),
+                "total": round(time.monotonic() - started, 4),
+                "recorded_at": datetime.utcnow().isoformat(timespec="seconds"),
+            }
+            if "content-encoding" in headers:
+                record["body_b64"] = base64.b64encode(content).decode("ascii")
+            else:
+                try:
+                    record["body"] = content.decode("utf-8")
+                except UnicodeDecodeError:
+                    record["body_b64"] = base64.b64encode(content).decode("ascii")
+            try:
+                self.writer.write(record)
+            except Exception as e:
+                logger.warning("写入磁带失败: %s", e)
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response.stream, on_complete),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+class _ReplayStream(httpx.AsyncByteStream):
+    """
+    按录制时首字节之后的耗时均匀输出各段响应体（流式响应按SSE事件分段）
+    """
+    def __init__(self, chunks: List[bytes], duration: float):
+        self._chunks = chunks
+        self._duration = duration
+
+    async def __aiter__(self):
+        pause = self._duration / len(self._chunks) if self._chunks else 0
+        for chunk in self._chunks:
+            if pause > 0:
+                await asyncio.sleep(pause)
+            yield chunk
+
+class _Cassette:
+    """
+    加载后的磁带：精确键与同类键各自对应一组录制响应，命中多条时轮流返回
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._exact: Dict[str, List[Dict[str, Any]]] = {}
+        self._similar: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursor: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+        count = 0
+        if os.path.exists(path):
+            for record in read_records(path):
+                args = (record["upstream"], record["method"], record["url"], record.get("request"))
+                self._exact.setdefault(_exact_key(*args), []).append(record)
+                self._similar.setdefault(_similar_key(*args), []).append(record)
+                count += 1
+        else:
+            logger.warning("磁带文件不存在，回放时所有请求都会失败: %s", path)
+        logger.info("已加载上游磁带 %s：%d 条记录", path, count)
+
+    def _next(self, table: str, entries: List[Dict[str, Any]], key: str) -> Dict[str, Any]:
+        with self._lock:
+            index = self._cursor.get((table, key), 0)
+            self._cursor[(table, key)] = index + 1
+        return entries[index % len(entries)]
+
+    def match(self, upstream: str, method: str, url: str, body: Any) -> Optional[Dict[str, Any]]:
+        key = _exact_key(upstream, method, url, body)
+        entries = self._exact.get(key)
+        if entries:
+            _stats.incr("exact_hits")
+            return self._next("exact", entries, key)
+        if UPSTREAM_CASSETTE_MATCH == "similar":
+            key = _similar_key(upstream, method, url, body)
+            entries = self._similar.get(key)
+            if entries:
+                _stats.incr("similar_hits")
+                return self._next("similar", entries, key)
+        _stats.incr("misses")
+        return None
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    回放传输层：不访问网络，从磁带返回录制的响应；没有匹配的录制时按连接错误处理
+    """
+    def __init__(self, upstream: str, cassette: "_Cassette", stats=None):
+        self.upstream = upstream
+        self.cassette = cassette
+        self.stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.stats is not None:
+            self.stats.started()
+        try:
+            response = await self._replay(request)
+        except BaseException as e:
+            if self.stats is not None:
+                self.stats.finished(e)
+            raise
+        if self.stats is not None:
+            self.stats.finished(status_code=response.status_code)
+        return response
+
+    async def _replay(self, request: httpx.Request) -> httpx.Response:
+        body = _parse_body(await request.aread())
+        record = self.cassette.match(self.upstream, request.method, _url_of(request), body)
+        if record is None:
+            raise httpx.ConnectError(f"磁带中没有匹配的录制: {request.method} {request.url}", request=request)
+
+        scale = UPSTREAM_CASSETTE_LATENCY_SCALE
+        ttfb = float(record.get("ttfb", 0)) * scale
+        rest = max(0.0, float(record.get("total", 0)) * scale - ttfb)
+        if ttfb > 0:
+            await asyncio.sleep(ttfb)
+
+        headers = record.get("headers") or {}
+        if "body_b64" in record:
+            content = base64.b64decode(record["body_b64"])
+        else:
+            content = record.get("body", "").encode("utf-8")
+        if "text/event-stream" in headers.get("content-type", ""):
+            chunks = [part + b"\n\n" for part in content.split(b"\n\n") if part]
+        else:
+            chunks = [content]
+        return httpx.Response(
+            status_code=record["status"],
+            headers=headers,
+            stream=_ReplayStream(chunks, rest),
+            request=request,
+        )
+
+_writer: Optional[_Writer] = None
+_cassette: Optional[_Cassette] = None
+_init_lock = threading.Lock()
+
+def wrap_transport(upstream: str, transport: httpx.AsyncBaseTransport, stats=None) -> httpx.AsyncBaseTransport:
+    """
+    按 UPSTREAM_CASSETTE_MODE 包装上游的异步传输层：record 时录制，replay 时替换为回放，off 时原样返回
+    """
+    global _writer, _cassette
+    if UPSTREAM_CASSETTE_MODE == "record":
+        with _init_lock:
+            if _writer is None:
+                _writer = _Writer(UPSTREAM_CASSETTE_PATH)
+                logger.warning("上游流量录制已开启，写入: %s", UPSTREAM_CASSETTE_PATH)
+        return RecordingTransport(upstream, transport, _writer)
+    if UPSTREAM_CASSETTE_MODE == "replay":
+        with _init_lock:
+            if _cassette is None:
+                _cassette = _Cassette(UPSTREAM_CASSETTE_PATH)
+        return ReplayTransport(upstream, _cassette, stats)
+    return transport
+
+def close() -> None:
+    if _writer is not None:
+        _writer.close()
+
+def cassette_stats() -> Dict[str, Any]:
+    return {
+        "mode": UPSTREAM_CASSETTE_MODE,
+        "path": UPSTREAM_CASSETTE_PATH if UPSTREAM_CASSETTE_MODE in ("record", "replay") else None,
+        "latency_scale": UPSTREAM_CASSETTE_LATENCY_SCALE,
+        "match": UPSTREAM_CASSETTE_MATCH,
+        **_stats.snapshot(),
+    }
@@ -36,9 +36,146 @@ DB_USER = os.getenv("DB_USER", "root")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "123456")
 DB_NAME = os.getenv("DB_NAME", "modeldev") # mysql数据库的名称
 DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"
+# 完整的数据库连接串，设置后优先于上面的 DB_* 配置（如测试使用 sqlite:///test.db）
+DB_URL = os.getenv("DB_URL", "")
 
 def mysql_url() -> str:
+    if DB_URL:
+        return DB_URL
     return (
         f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}"
         f"@{DB_HOST}:{DB_PORT}/{DB_NAME}?charset=utf8mb4"
-    )
\ No newline at end of file
+    )
+
+# 上游HTTP连接池：每个上游一个连接池，可单独配置池大小与超时（秒）
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "50"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60"))
+FLOWISE_POOL_SIZE = int(os.getenv("FLOWISE_POOL_SIZE", str(UPSTREAM_POOL_SIZE)))
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", str(UPSTREAM_POOL_SIZE)))
+MERMAID_POOL_SIZE = int(os.getenv("MERMAID_POOL_SIZE", str(UPSTREAM_POOL_SIZE)))
+GSTORE_POOL_SIZE = int(os.getenv("GSTORE_POOL_SIZE", str(UPSTREAM_POOL_SIZE)))
+FLOWISE_TIMEOUT = float(os.getenv("FLOWISE_TIMEOUT", "60"))
+FLOWISE_KB_TIMEOUT = float(os.getenv("FLOWISE_KB_TIMEOUT", "30"))
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "10"))
+MERMAID_TIMEOUT = float(os.getenv("MERMAID_TIMEOUT", "5"))
+GSTORE_TIMEOUT = float(os.getenv("GSTORE_TIMEOUT", "30"))
+
+# 上游流量录制/回放（压测用）：off | record | replay。record 把异步上游请求与响应写入 gzip 压缩的磁带文件（会包含用户问题与答案，注意存放位置）；
+# replay 不访问上游，从磁带返回响应，延迟按录制耗时乘以 LATENCY_SCALE；MATCH=similar 时未精确命中的请求取同类录制响应，exact 时视为上游错误
+UPSTREAM_CASSETTE_MODE = os.getenv("UPSTREAM_CASSETTE_MODE", "off").lower()
+UPSTREAM_CASSETTE_PATH = os.getenv("UPSTREAM_CASSETTE_PATH", "cassettes/upstream.jsonl.gz")
+UPSTREAM_CASSETTE_LATENCY_SCALE = float(os.getenv("UPSTREAM_CASSETTE_LATENCY_SCALE", "1.0"))
+UPSTREAM_CASSETTE_MATCH = os.getenv("UPSTREAM_CASSETTE_MATCH", "similar").lower()
+
+# 意图识别：归一化问题缓存 + 本地快速分类器，置信度不足时才调用Ollama
+INTENT_LOCAL_ENABLED = os.getenv("INTENT_LOCAL_ENABLED", "true").lower() == "true"
+INTENT_CACHE_SIZE = int(os.getenv("INTENT_CACHE_SIZE", "10000"))
+INTENT_CACHE_TTL = float(os.getenv("INTENT_CACHE_TTL", "86400"))
+INTENT_LOCAL_MIN_SIMILARITY = float(os.getenv("INTENT_LOCAL_MIN_SIMILARITY", "0.35"))
+INTENT_LOCAL_MIN_MARGIN = float(os.getenv("INTENT_LOCAL_MIN_MARGIN", "0.1"))
+INTENT_TRAIN_LIMIT = int(os.getenv("INTENT_TRAIN_LIMIT", "20000"))
+INTENT_RETRAIN_INTERVAL = float(os.getenv("INTENT_RETRAIN_INTERVAL", "3600"))
+
+# 实体标注：local=本地词典(Aho-Corasick)，llm=调用Flowise重新生成，auto=词典可用时本地否则LLM
+ENTITY_ANNOTATOR_MODE = os.getenv("ENTITY_ANNOTATOR_MODE", "auto").lower()
+ENTITY_DICT_REFRESH_INTERVAL = float(os.getenv("ENTITY_DICT_REFRESH_INTERVAL", "3600"))
+ENTITY_DICT_MAX_TERMS = int(os.getenv("ENTITY_DICT_MAX_TERMS", "200000"))
+ENTITY_DICT_MIN_LENGTH = int(os.getenv("ENTITY_DICT_MIN_LENGTH", "2"))
+
+# 后台实体抽取：/qa 入库后立即返回，标注与实体入库由有界工作池异步完成
+ENTITY_BACKGROUND_DEFAULT = os.getenv("ENTITY_BACKGROUND_DEFAULT", "false").lower() == "true"
+ENTITY_WORKERS = int(os.getenv("ENTITY_WORKERS", "4"))
+ENTITY_QUEUE_SIZE = int(os.getenv("ENTITY_QUEUE_SIZE", "1000"))
+ENTITY_SUBSCRIBE_TIMEOUT = float(os.getenv("ENTITY_SUBSCRIBE_TIMEOUT", "60"))
+# 工作池队列只在内存中，重启会丢失未完成的任务。pending 记录带有 ENTITY_RECOVER_AFTER 秒的租约（updated_at），
+# 持有记录的进程每 ENTITY_RECOVER_INTERVAL 秒续约一次（须小于 ENTITY_RECOVER_AFTER），同时把租约已过期的记录
+# 认领后重新入队（每次最多 ENTITY_RECOVER_BATCH 条）
+ENTITY_RECOVER_AFTER = float(os.getenv("ENTITY_RECOVER_AFTER", "600"))
+ENTITY_RECOVER_INTERVAL = float(os.getenv("ENTITY_RECOVER_INTERVAL", "300"))
+ENTITY_RECOVER_BATCH = int(os.getenv("ENTITY_RECOVER_BATCH", "100"))
+
+# 答案缓存：按chatflow分区，精确/归一化匹配 + 可选向量相似度匹配，知识库更新后自动失效
+# 注意：命中缓存时不会调用Flowise，本轮问答不会写入Flowise会话记忆，因此默认关闭
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "5000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_KB_CHECK_INTERVAL = float(os.getenv("ANSWER_CACHE_KB_CHECK_INTERVAL", "60"))
+ANSWER_CACHE_EMBEDDING_ENABLED = os.getenv("ANSWER_CACHE_EMBEDDING_ENABLED", "false").lower() == "true"
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+OLLAMA_EMBED_URL = os.getenv("OLLAMA_EMBED_URL", OLLAMA_URL.replace("/api/generate", "/api/embeddings"))
+OLLAMA_EMBED_MODEL = os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+
+# gStore实体邻域缓存：进程内LRU + 数据库持久层，图数据库重新导入后调用 /entity/cache/invalidate 整体失效
+# 当前图版本记录在 graph_state 表中，各进程每 GRAPH_VERSION_CHECK_INTERVAL 秒重新读取；未切换过版本时使用 GSTORE_GRAPH_VERSION
+GSTORE_GRAPH_VERSION = os.getenv("GSTORE_GRAPH_VERSION", "1")
+GRAPH_VERSION_CHECK_INTERVAL = float(os.getenv("GRAPH_VERSION_CHECK_INTERVAL", "5"))
+GRAPH_CACHE_SIZE = int(os.getenv("GRAPH_CACHE_SIZE", "20000"))
+GRAPH_CACHE_TTL = float(os.getenv("GRAPH_CACHE_TTL", "600"))
+GRAPH_CACHE_DB_TTL = float(os.getenv("GRAPH_CACHE_DB_TTL", "604800"))
+
+# 标签索引：定期从gStore同步标签与字面量，本地二元组倒排索引把实体文本解析为URI，gStore只执行绑定URI的邻域查询
+LABEL_INDEX_ENABLED = os.getenv("LABEL_INDEX_ENABLED", "true").lower() == "true"
+LABEL_INDEX_REFRESH_INTERVAL = float(os.getenv("LABEL_INDEX_REFRESH_INTERVAL", "3600"))
+LABEL_INDEX_PAGE_SIZE = int(os.getenv("LABEL_INDEX_PAGE_SIZE", "5000"))
+LABEL_INDEX_MAX_ROWS = int(os.getenv("LABEL_INDEX_MAX_ROWS", "500000"))
+LABEL_INDEX_MAX_URIS = int(os.getenv("LABEL_INDEX_MAX_URIS", "20"))
+
+# 批量实体查询：每条SPARQL最多绑定的实体数
+GSTORE_BATCH_SIZE = int(os.getenv("GSTORE_BATCH_SIZE", "10"))
+
+# 计数器写回：点击数与点赞/点踩先在内存中累加，定期批量 UPDATE ... SET x = x + n 写回数据库
+COUNTER_FLUSH_INTERVAL = float(os.getenv("COUNTER_FLUSH_INTERVAL", "2"))
+
+# 软删除清理：软删除超过保留期的记录（及其实体）与对话页面由后台任务分批物理删除
+PURGE_ENABLED = os.getenv("PURGE_ENABLED", "true").lower() == "true"
+PURGE_RETENTION_DAYS = float(os.getenv("PURGE_RETENTION_DAYS", "30"))
+PURGE_INTERVAL = float(os.getenv("PURGE_INTERVAL", "3600"))
+PURGE_CHUNK_SIZE = int(os.getenv("PURGE_CHUNK_SIZE", "500"))
+PURGE_CHUNK_PAUSE = float(os.getenv("PURGE_CHUNK_PAUSE", "0.2"))
+
+# 来源片段清理：只删除没有任何记录引用、且超过宽限期未被新记录引用的片段。
+# 写入记录时若片段的 last_referenced_at 早于 TOUCH_INTERVAL 才更新它，
+# 因此 GRACE 必须大于 TOUCH_INTERVAL 加上最长的写入事务时间
+SOURCE_CHUNK_TOUCH_INTERVAL = float(os.getenv("SOURCE_CHUNK_TOUCH_INTERVAL", "600"))
+PURGE_SOURCE_GRACE = float(os.getenv("PURGE_SOURCE_GRACE", "3600"))
+
+# 知识库元数据缓存：TTL 内直接使用；超过 TTL 但未超过 STALE_TTL 时先返回旧数据并在后台刷新
+KB_CACHE_TTL = float(os.getenv("KB_CACHE_TTL", "60"))
+KB_CACHE_STALE_TTL = float(os.getenv("KB_CACHE_STALE_TTL", "600"))
+
+# 对话状态缓存：对话归属、固定的意图/chatflow、问答轮数，/qa 路由命中时不再查询数据库。
+# 缓存只在本进程内失效，多进程部署时其他进程的写入（删除对话、删除记录）最多延迟 TTL 秒可见；
+# 首轮及未固定意图的对话不使用缓存
+CONVERSATION_STATE_SIZE = int(os.getenv("CONVERSATION_STATE_SIZE", "10000"))
+CONVERSATION_STATE_TTL = float(os.getenv("CONVERSATION_STATE_TTL", "60"))
+
+# 请求级时间预算：/qa 整体预算（秒），各上游调用的超时不超过剩余预算；
+# 剩余预算低于阈值时跳过可选阶段（mermaid 替换、模型实体标注）
+QA_DEADLINE = float(os.getenv("QA_DEADLINE", "90"))
+DEADLINE_MIN_MERMAID = float(os.getenv("DEADLINE_MIN_MERMAID", "2"))
+DEADLINE_MIN_ANNOTATE = float(os.getenv("DEADLINE_MIN_ANNOTATE", "10"))
+
+# 对冲请求：幂等读请求（意图识别、gStore查询）超过近期 p95 未返回时再发一次，取先成功的结果
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+
+# 日志与追踪：生产环境使用 INFO；请求头 X-Debug-Trace 等于 TRACE_DEBUG_TOKEN 时仅对该请求输出DEBUG日志（令牌为空时关闭）
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "%(asctime)s %(levelname)s %(name)s [%(trace_id)s] %(message)s")
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "5"))
+TRACE_DEBUG_TOKEN = os.getenv("TRACE_DEBUG_TOKEN", "")
+
+# 执行隔离：LLM问答流水线（/qa、/qa/stream）最多同时占用 LLM_SLOTS 个槽位，超出时最多排队 LLM_QUEUE_SIZE 个请求、
+# 每个最多等待 LLM_QUEUE_TIMEOUT 秒，队列已满或等待超时立即返回503（Retry-After: LLM_RETRY_AFTER）；
+# 问答流水线的数据库操作使用独立的 QA_THREADS 线程池，只读数据库的接口（/history、/conversations、实体查询等）使用独立的 DB_THREADS 线程池，
+# 后台任务（清理、计数写回、词典/索引重建、意图分类器训练等）使用 BACKGROUND_THREADS 个线程；
+# 其余同步接口仍使用 AnyIO 默认线程池（默认40个线程）
+LLM_SLOTS = int(os.getenv("LLM_SLOTS", "32"))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "64"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+LLM_RETRY_AFTER = int(os.getenv("LLM_RETRY_AFTER", "5"))
+QA_THREADS = int(os.getenv("QA_THREADS", "16"))
+DB_THREADS = int(os.getenv("DB_THREADS", "40"))
+BACKGROUND_THREADS = int(os.getenv("BACKGROUND_THREADS", "2"))
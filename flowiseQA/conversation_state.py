@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Optional
+from sqlalchemy.orm import Session
+from cache import TTLCache
+from config import CONVERSATION_STATE_SIZE, CONVERSATION_STATE_TTL
+from crud import get_conversation_state, backfill_turn_counts
+from executors import run_background, run_qa
+from models import Conversation
+
+logger = logging.getLogger(__name__)
+
+# 对话状态缓存：/qa 每轮只需要对话归属、固定的意图/chatflow 和是否首轮，
+# 这些信息缓存在进程内，由 /qa 写入路径（固定路由、入库一轮问答）同步更新，命中时路由不再查询数据库。
+# 缓存只在本进程内失效：多进程部署时其他进程的写入最多在 TTL 内不可见。
+# 因此只信任“已定型”的状态（已有问答且已固定意图，之后不会再变化）；首轮或尚未固定路由的对话每次从数据库重新读取，
+# 避免两个进程各自为同一对话识别并固定不同的意图。已被其他进程删除的对话在入库时由数据库拒绝（404）
+
+@dataclass(frozen=True)
+class ConversationState:
+    conversation_id: str
+    username: str
+    intent_id: Optional[int]
+    chatflow_id: Optional[str]
+    turn_count: int
+    last_qa_at: Optional[datetime]
+
+    @property
+    def first_turn(self) -> bool:
+        return self.turn_count == 0
+
+    @property
+    def settled(self) -> bool:
+        return not self.first_turn and bool(self.intent_id) and bool(self.chatflow_id)
+
+def _from_row(conversation: Conversation) -> ConversationState:
+    extra = conversation.extra if isinstance(conversation.extra, dict) else {}
+    return ConversationState(
+        conversation_id=conversation.conversation_id,
+        username=conversation.username,
+        intent_id=extra.get("intent_id"),
+        chatflow_id=extra.get("chatflow_id"),
+        turn_count=conversation.turn_count or 0,
+        last_qa_at=conversation.last_qa_at,
+    )
+
+_states = TTLCache(CONVERSATION_STATE_SIZE, CONVERSATION_STATE_TTL, name="conversation_state")
+
+async def get_state(db: Session, conversation_id: str) -> Optional[ConversationState]:
+    """
+    获取对话状态：已定型的状态直接使用进程内缓存，其余情况从数据库加载；对话不存在或已删除时返回None
+    """
+    state = _states.get(conversation_id)
+    if state is not None and state.settled:
+        return state
+    conversation = await run_qa(get_conversation_state, db, conversation_id)
+    if conversation is None:
+        _states.pop(conversation_id)
+        return None
+    state = _from_row(conversation)
+    _states.set(conversation_id, state)
+    return state
+
+def pin_route(state: ConversationState, intent_id: int, chatflow_id: str) -> ConversationState:
+    """
+    记录首次识别出的意图与chatflow（数据库写入由调用方完成）
+    """
+    state = replace(state, intent_id=intent_id, chatflow_id=chatflow_id)
+    _states.set(state.conversation_id, state)
+    return state
+
+def record_turn(conversation_id: str, at: Optional[datetime] = None) -> None:
+    """
+    一轮问答入库后更新缓存中的轮数；未缓存时不做处理（下次加载时从数据库读取）
+    """
+    state = _states.get(conversation_id)
+    if state is not None:
+        _states.set(conversation_id, replace(state, turn_count=state.turn_count + 1, last_qa_at=at or datetime.utcnow()))
+
+def invalidate(conversation_id: str) -> None:
+    _states.pop(conversation_id)
+
+async def backfill(session_factory, chunk_size: int = 500) -> int:
+    """
+    后台任务：分批回填升级前对话的 turn_count / last_qa_at，返回回填的行数
+    """
+    def run_chunk() -> int:
+        db = session_factory()
+        try:
+            return backfill_turn_counts(db, chunk_size)
+        finally:
+            db.close()
+
+    total = 0
+    try:
+        while True:
+            count = await run_background(run_chunk)
+            if not count:
+                break
+            total += count
+            await asyncio.sleep(0)
+    except Exception as e:
+        logger.warning("对话轮数回填失败: %s", e)
+    if total:
+        logger.info("已回填 %d 个对话的问答轮数", total)
+    return total
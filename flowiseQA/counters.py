@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import update
+from config import COUNTER_FLUSH_INTERVAL
+from executors import run_background
+from models import QAEntity, QARecord
+
+logger = logging.getLogger(__name__)
+
+# 计数器写回缓冲：点击与点赞/点踩只在内存中累加，由后台任务定期合并写回。
+# 写回使用 UPDATE ... SET x = x + n（按增量分组，WHERE id IN (...)），不读取行、不会丢失并发增量，
+# 同一热点实体在一个周期内的多次点击只产生一次行更新
+
+# 计数类型 -> (表模型, 列名)
+COUNTERS = {
+    "entity_click": (QAEntity, "click_count"),
+    "like": (QARecord, "likes"),
+    "dislike": (QARecord, "dislikes"),
+}
+
+class CounterBuffer:
+    def __init__(self):
+        self._pending: Dict[Tuple[str, int], int] = defaultdict(int)
+        self._oldest: Optional[float] = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.flushed_increments = 0
+        self.flushed_rows = 0
+        self.failed_flushes = 0
+        self.last_flush_at: Optional[float] = None
+        self.last_flush_seconds = 0.0
+
+    def add(self, kind: str, row_id: int, n: int = 1) -> None:
+        if kind not in COUNTERS:
+            raise ValueError(f"未知计数类型: {kind}")
+        with self._lock:
+            self._pending[(kind, row_id)] += n
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def _take(self) -> Tuple[Dict[Tuple[str, int], int], Optional[float]]:
+        with self._lock:
+            pending, oldest = self._pending, self._oldest
+            self._pending, self._oldest = defaultdict(int), None
+            return pending, oldest
+
+    def _restore(self, pending: Dict[Tuple[str, int], int], oldest: Optional[float]) -> None:
+        with self._lock:
+            for key, n in pending.items():
+                self._pending[key] += n
+            if oldest is not None and (self._oldest is None or oldest < self._oldest):
+                self._oldest = oldest
+
+    def flush(self, session_factory) -> int:
+        """
+        把缓冲中的增量写回数据库（同步，一个事务），返回更新的行数；失败时增量放回缓冲等待下次写回
+        """
+        with self._flush_lock:
+            pending, oldest = self._take()
+            if not pending:
+                return 0
+
+            # (类型, 增量) -> [id, ...]：相同增量的行合并为一条 UPDATE
+            groups: Dict[Tuple[str, int], List[int]] = defaultdict(list)
+            for (kind, row_id), n in pending.items():
+                groups[(kind, n)].append(row_id)
+
+            started = time.monotonic()
+            db = session_factory()
+            try:
+                for (kind, n), ids in groups.items():
+                    model, column = COUNTERS[kind]
+                    col = getattr(model, column)
+                    db.execute(
+                        update(model)
+                        .where(model.id.in_(ids))
+                        .values({column: col + n})
+                        .execution_options(synchronize_session=False)
+                    )
+                db.commit()
+            except Exception:
+                db.rollback()
+                self.failed_flushes += 1
+                self._restore(pending, oldest)
+                raise
+            finally:
+                db.close()
+
+            self.flushed_increments += sum(pending.values())
+            self.flushed_rows += len(pending)
+            self.last_flush_at = time.time()
+            self.last_flush_seconds = time.monotonic() - started
+            return len(pending)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            pending_rows = len(self._pending)
+            pending_increments = sum(self._pending.values())
+            lag = time.monotonic() - self._oldest if self._oldest is not None else 0.0
+        return {
+            "pending_rows": pending_rows,
+            "pending_increments": pending_increments,
+            "flush_lag_seconds": round(lag, 3),  # 最早一条未写回增量已等待的时间
+            "flushed_rows": self.flushed_rows,
+            "flushed_increments": self.flushed_increments,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_at": self.last_flush_at,
+            "last_flush_seconds": round(self.last_flush_seconds, 4),
+        }
+
+_buffer = CounterBuffer()
+
+def incr(kind: str, row_id: int, n: int = 1) -> None:
+    _buffer.add(kind, row_id, n)
+
+async def flush(session_factory) -> int:
+    return await run_background(_buffer.flush, session_factory)
+
+async def flush_periodically(session_factory) -> None:
+    """
+    后台任务：定期写回计数增量
+    """
+    while True:
+        await asyncio.sleep(COUNTER_FLUSH_INTERVAL)
+        try:
+            await flush(session_factory)
+        except Exception as e:
+            logger.warning("计数器写回失败: %s", e)
+
+def counter_stats() -> Dict[str, object]:
+    return _buffer.stats()
@@ -1,9 +1,17 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import select, func
-from models import QARecord, QAEntity, Conversation
-from typing import Tuple, List, Dict, Any
+from sqlalchemy.orm import Session, aliased, selectinload
+from sqlalchemy import select, func, delete, insert, update
+from models import QARecord, QAEntity, Conversation, GStoreEntityCache, GraphState, SourceChunk, QASourceRef
+from config import SOURCE_CHUNK_TOUCH_INTERVAL
+from pagination import keyset_page
+from typing import Tuple, List, Dict, Any, Optional
 import re
+import json
+import hashlib
 import uuid
+from datetime import datetime, timedelta
+import logging
+
+logger = logging.getLogger(__name__)
 
 # 对话页面相关CRUD操作
 def create_conversation(
@@ -41,27 +49,34 @@ def get_conversation_by_id(db: Session, conversation_id: str) -> Conversation |
     )
     return db.scalar(stmt)
 
-def get_conversations_by_username(db: Session, username: str, page: int = 1, size: int = 10) -> Tuple[int, List[Conversation]]:
+def get_conversations_by_username(
+    db: Session,
+    username: str,
+    page: int = 1,
+    size: int = 10,
+    *,
+    cursor: Optional[str] = None,
+    with_total: bool = True
+) -> Tuple[Optional[int], List[Conversation], Optional[str]]:
     """
-    获取用户的对话页面列表
+    获取用户的对话页面列表（按更新时间倒序），返回 (总数或None, 本页记录, 下一页游标)
     """
-    stmt_total = select(func.count(Conversation.id)).where(
-        Conversation.username == username,
-        Conversation.is_deleted == 0
-    )
-    total = db.scalar(stmt_total) or 0
+    total = None
+    if with_total:
+        stmt_total = select(func.count(Conversation.id)).where(
+            Conversation.username == username,
+            Conversation.is_deleted == 0
+        )
+        total = db.scalar(stmt_total) or 0
 
-    stmt_items = (
-        select(Conversation)
-        .where(Conversation.username == username, Conversation.is_deleted == 0)
-        .order_by(Conversation.updated_at.desc())
-        .offset((page - 1) * size)
-        .limit(size)
+    stmt_items = select(Conversation).where(Conversation.username == username, Conversation.is_deleted == 0)
+    items, next_cursor = keyset_page(
+        db, stmt_items, Conversation.updated_at, Conversation.id,
+        size=size, page=page, cursor=cursor, descending=True
     )
-    items = list(db.scalars(stmt_items))
-    return total, items
+    return total, items, next_cursor
 
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 
 def update_conversation(
         db: Session,
@@ -102,53 +117,190 @@ def update_conversation(
 
     except SQLAlchemyError as e:
         db.rollback()
-        print(f"❌ 数据库更新失败: {e}")
+        logger.error("数据库更新失败: %s", e)
         return False
 
 
-def delete_conversation(db: Session, conversation_id: str) -> bool:
+def _touch_conversation(db: Session, conversation_id: str, at: datetime) -> None:
+    """
+    在当前事务中累加对话的问答轮数并记录最近问答时间（不改变 updated_at，列表排序保持原语义）。
+    turn_count 为 NULL（尚未回填）时保持 NULL，由回填统一计算。
+
+    对话不存在或已被删除（可能由其他进程删除，本进程的对话状态缓存尚未失效）时抛出 LookupError，调用方应回滚
+    """
+    result = db.execute(
+        update(Conversation)
+        .where(Conversation.conversation_id == conversation_id, Conversation.is_deleted == 0)
+        .values(turn_count=Conversation.turn_count + 1, last_qa_at=at, updated_at=Conversation.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        raise LookupError(f"对话页面不存在或已删除: {conversation_id}")
+
+def _turn_stats_values(conversation_id_col):
     """
-    逻辑删除对话页面及其所有相关的QA记录
+    按对话统计有效问答记录数与最近问答时间的关联子查询，用于回填 turn_count / last_qa_at
+    """
+    live = (QARecord.conversation_id == conversation_id_col, QARecord.is_deleted == 0)
+    return {
+        "turn_count": select(func.count(QARecord.id)).where(*live).scalar_subquery(),
+        "last_qa_at": select(func.max(QARecord.created_at)).where(*live).scalar_subquery(),
+        "updated_at": Conversation.updated_at,
+    }
+
+def get_conversation_state(db: Session, conversation_id: str) -> Conversation | None:
+    """
+    加载对话的路由状态；升级前的对话（turn_count 为 NULL）在这里就地回填一次
     """
     conversation = get_conversation_by_id(db, conversation_id)
-    if not conversation:
-        return False
-    
+    if conversation is None or conversation.turn_count is not None:
+        return conversation
+    db.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation.id)
+        .values(**_turn_stats_values(Conversation.conversation_id))
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    db.refresh(conversation)
+    return conversation
+
+def backfill_turn_counts(db: Session, limit: int) -> int:
+    """
+    为升级前的对话分批回填 turn_count / last_qa_at，返回本批处理的行数
+    """
+    ids = list(db.scalars(select(Conversation.id).where(Conversation.turn_count.is_(None)).limit(limit)))
+    if not ids:
+        return 0
+    db.execute(
+        update(Conversation)
+        .where(Conversation.id.in_(ids))
+        .values(**_turn_stats_values(Conversation.conversation_id))
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return len(ids)
+
+def delete_conversation(db: Session, conversation_id: str) -> bool:
+    """
+    逻辑删除对话页面及其所有相关的QA记录（两条集合式 UPDATE，一次提交）
+    """
+    now = datetime.utcnow()
     # 1. 软删除对话页面
-    conversation.is_deleted = 1
-    
+    result = db.execute(
+        update(Conversation)
+        .where(Conversation.conversation_id == conversation_id, Conversation.is_deleted == 0)
+        .values(is_deleted=1, deleted_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.rollback()
+        return False
+
     # 2. 软删除属于该对话页面的所有QA记录
-    stmt = select(QARecord).where(
-        QARecord.conversation_id == conversation_id,
-        QARecord.is_deleted == 0
+    db.execute(
+        update(QARecord)
+        .where(QARecord.conversation_id == conversation_id, QARecord.is_deleted == 0)
+        .values(is_deleted=1, deleted_at=now)
+        .execution_options(synchronize_session=False)
     )
-    qa_records = list(db.scalars(stmt))
-    
-    for qa_record in qa_records:
-        qa_record.is_deleted = 1
-    
     db.commit()
     return True
 
-def get_qa_records_by_conversation(db: Session, conversation_id: str, page: int = 1, size: int = 10) -> Tuple[int, List[QARecord]]:
+def get_qa_records_by_conversation(
+    db: Session,
+    conversation_id: str,
+    page: int = 1,
+    size: int = 10,
+    *,
+    cursor: Optional[str] = None,
+    with_total: bool = True
+) -> Tuple[Optional[int], List[QARecord], Optional[str]]:
     """
-    获取指定对话页面的QA记录
+    获取指定对话页面的QA记录（按时间正序），返回 (总数或None, 本页记录, 下一页游标)
     """
-    stmt_total = select(func.count(QARecord.id)).where(
-        QARecord.conversation_id == conversation_id,
-        QARecord.is_deleted == 0
-    )
-    total = db.scalar(stmt_total) or 0
+    total = None
+    if with_total:
+        stmt_total = select(func.count(QARecord.id)).where(
+            QARecord.conversation_id == conversation_id,
+            QARecord.is_deleted == 0
+        )
+        total = db.scalar(stmt_total) or 0
 
     stmt_items = (
         select(QARecord)
         .where(QARecord.conversation_id == conversation_id, QARecord.is_deleted == 0)
-        .order_by(QARecord.created_at.asc())  # 对话记录按时间正序排列
-        .offset((page - 1) * size)
-        .limit(size)
+        .options(selectinload(QARecord.entities))  # 一次 IN 查询加载本页全部实体
+    )
+    # 对话记录按时间正序排列
+    items, next_cursor = keyset_page(
+        db, stmt_items, QARecord.created_at, QARecord.id,
+        size=size, page=page, cursor=cursor, descending=False
     )
-    items = list(db.scalars(stmt_items))
-    return total, items
+    return total, items, next_cursor
+
+def source_hash(document: Dict[str, Any]) -> str:
+    canonical = json.dumps(document, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def save_source_chunks(db: Session, source_documents: List[Dict[str, Any]]) -> List[str]:
+    """
+    按内容哈希写入来源片段（不提交），返回与输入顺序一致的哈希列表。
+    已存在且最近被引用过的片段不再写入；不存在或超过 SOURCE_CHUNK_TOUCH_INTERVAL 未被引用的片段
+    先刷新 last_referenced_at 再 INSERT IGNORE，片段恰好被清理任务删除时随本事务重新写入
+    """
+    hashes = [source_hash(doc) for doc in source_documents]
+    if not hashes:
+        return hashes
+    documents = dict(zip(hashes, source_documents))
+    touched_after = datetime.utcnow() - timedelta(seconds=SOURCE_CHUNK_TOUCH_INTERVAL)
+    fresh = set(db.scalars(
+        select(SourceChunk.hash).where(SourceChunk.hash.in_(documents), SourceChunk.last_referenced_at >= touched_after)
+    ))
+    stale = {h: doc for h, doc in documents.items() if h not in fresh}
+    if stale:
+        now = datetime.utcnow()
+        db.execute(
+            update(SourceChunk).where(SourceChunk.hash.in_(stale)).values(last_referenced_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        # 并发写入同一片段时忽略主键冲突
+        stmt = insert(SourceChunk).values([{"hash": h, "document": doc, "last_referenced_at": now} for h, doc in stale.items()])
+        db.execute(_ignore_duplicates(db, stmt))
+    return hashes
+
+def _save_source_refs(db: Session, qa_record_id: int, extra: Optional[Dict[str, Any]]) -> None:
+    """
+    写入记录对来源片段的引用（不提交）
+    """
+    hashes = (extra or {}).get("source_hashes")
+    if hashes:
+        db.execute(insert(QASourceRef).values([{"qa_record_id": qa_record_id, "hash": h} for h in dict.fromkeys(hashes)]))
+
+def load_source_chunks(db: Session, records: List[QARecord]) -> Dict[str, Dict[str, Any]]:
+    """
+    一次查询取回一批记录引用的全部来源片段：{hash: document}
+    """
+    hashes = {h for r in records for h in ((r.extra or {}).get("source_hashes") or [])}
+    if not hashes:
+        return {}
+    return {chunk.hash: chunk.document for chunk in db.scalars(select(SourceChunk).where(SourceChunk.hash.in_(hashes)))}
+
+def _record_extra(
+    db: Session,
+    source_documents: List[Dict[str, Any]] = None,
+    entity_status: str = None,
+    entity_owner: str = None
+) -> Dict[str, Any] | None:
+    extra_data = {}
+    if source_documents:
+        # 片段内容存入 source_chunks，记录中只保存哈希引用
+        extra_data["source_hashes"] = save_source_chunks(db, source_documents)
+    if entity_status:
+        extra_data["entity_status"] = entity_status
+    if entity_owner:
+        extra_data["entity_owner"] = entity_owner
+    return extra_data if extra_data else None
 
 # 修改原有的create_record函数，支持对话页面
 def create_record(
@@ -160,12 +312,10 @@ def create_record(
     answer_annotated: str,
     chatflow_id: str,
     conversation_id: str = None,
-    source_documents: List[Dict[str, Any]] = None
+    source_documents: List[Dict[str, Any]] = None,
+    entity_status: str = None,
+    entity_owner: str = None
 ) -> QARecord:
-    extra_data = {}
-    if source_documents:
-        extra_data["source_documents"] = source_documents
-    
     rec = QARecord(
         username=username,
         conversation_id=conversation_id,
@@ -173,50 +323,214 @@ def create_record(
         answer_raw=answer_raw,
         answer_annotated=answer_annotated,
         chatflow_id=chatflow_id,
-        extra=extra_data if extra_data else None
+        extra=_record_extra(db, source_documents, entity_status, entity_owner)
     )
-    db.add(rec)
-    db.commit()
+    try:
+        if conversation_id:
+            _touch_conversation(db, conversation_id, datetime.utcnow())
+        db.add(rec)
+        db.flush()
+        _save_source_refs(db, rec.id, rec.extra)
+        db.commit()
+    except LookupError:
+        db.rollback()
+        raise
     db.refresh(rec)
     return rec
 
+ENTITY_PATTERN = re.compile(r'<class>(.*?)</class>')
+
+def parse_entities(answer_annotated: str) -> List[Dict[str, Any]]:
+    """
+    解析 <class>实体</class> 标签，按实体文本去重（保留第一次出现的位置）
+    """
+    parsed: Dict[str, Dict[str, Any]] = {}
+    for match in ENTITY_PATTERN.finditer(answer_annotated or ""):
+        entity_text = match.group(1).strip()[:255]
+        if entity_text and entity_text not in parsed:
+            parsed[entity_text] = {
+                "entity_text": entity_text,
+                "start_position": match.start(),
+                "end_position": match.end(),
+            }
+    return list(parsed.values())
+
+def _ignore_duplicates(db: Session, stmt):
+    """
+    INSERT 遇到唯一键冲突时跳过该行（MySQL: INSERT IGNORE，SQLite: INSERT OR IGNORE）
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        return stmt.prefix_with("IGNORE")
+    if dialect == "sqlite":
+        return stmt.prefix_with("OR IGNORE")
+    return stmt
+
+def _insert_entities(db: Session, qa_record_id: int, parsed: List[Dict[str, Any]], ignore_duplicates: bool = False) -> None:
+    """
+    一条多行 INSERT 写入实体（不提交）；ignore_duplicates 时跳过同一记录下已存在的同名实体
+    """
+    if parsed:
+        stmt = insert(QAEntity).values([{"qa_record_id": qa_record_id, **row} for row in parsed])
+        db.execute(_ignore_duplicates(db, stmt) if ignore_duplicates else stmt)
+
+def _load_entities(db: Session, qa_record_id: int, entity_texts: List[str]) -> List[QAEntity]:
+    """
+    一次查询取回刚写入的实体（含ID），按文本在答案中的顺序返回
+    """
+    if not entity_texts:
+        return []
+    rows = db.scalars(
+        select(QAEntity).where(QAEntity.qa_record_id == qa_record_id, QAEntity.entity_text.in_(entity_texts))
+    )
+    by_text = {row.entity_text: row for row in rows}
+    return [by_text[text] for text in entity_texts if text in by_text]
+
 def extract_and_save_entities(db: Session, qa_record_id: int, answer_annotated: str) -> List[QAEntity]:
     """
-    从标注答案中提取实体并保存到数据库
+    从标注答案中提取实体并保存到数据库，返回答案中的全部实体。
+    已存在的同名实体不重复写入：由 (qa_record_id, entity_text) 唯一索引保证，同一记录被并发抽取时也不会重复
     """
-    # 使用正则表达式提取 <class>实体</class> 标签中的内容
-    entity_pattern = r'<class>(.*?)</class>'
-    entities = []
-    
-    for match in re.finditer(entity_pattern, answer_annotated):
-        entity_text = match.group(1).strip()
-        start_pos = match.start()
-        end_pos = match.end()
-        
-        # 检查是否已存在相同的实体（避免重复）
-        existing = db.scalar(
-            select(QAEntity).where(
-                QAEntity.qa_record_id == qa_record_id,
-                QAEntity.entity_text == entity_text
-            )
+    parsed = parse_entities(answer_annotated)
+    if not parsed:
+        return []
+    _insert_entities(db, qa_record_id, parsed, ignore_duplicates=True)
+    db.commit()
+    return _load_entities(db, qa_record_id, [row["entity_text"] for row in parsed])
+
+def persist_qa_turn(
+    db: Session,
+    *,
+    username: str,
+    question: str,
+    answer_raw: str,
+    answer_annotated: str,
+    chatflow_id: str,
+    conversation_id: str = None,
+    source_documents: List[Dict[str, Any]] = None,
+    entity_status: str = None,
+    entity_owner: str = None,
+    save_entities: bool = True
+) -> Tuple[int, List[QAEntity]]:
+    """
+    一个事务内写入问答记录及其全部实体，只提交一次，返回 (记录ID, 实体列表)
+
+    实体写入失败时回滚并退回只写入问答记录（与逐条写入时"实体失败不影响记录"的行为一致）；
+    对话已被删除时回滚并抛出 LookupError，不写入任何数据
+    """
+    parsed = parse_entities(answer_annotated) if save_entities else []
+    now = datetime.utcnow()
+    try:
+        # 先在同一事务中更新对话（同时确认对话未被删除），再写入记录
+        if conversation_id:
+            _touch_conversation(db, conversation_id, now)
+        rec = QARecord(
+            username=username,
+            conversation_id=conversation_id,
+            question=question,
+            answer_raw=answer_raw,
+            answer_annotated=answer_annotated,
+            chatflow_id=chatflow_id,
+            extra=_record_extra(db, source_documents, entity_status, entity_owner),
+            created_at=now,
         )
-        
-        if not existing:
-            entity = QAEntity(
-                qa_record_id=qa_record_id,
-                entity_text=entity_text,
-                start_position=start_pos,
-                end_position=end_pos
-            )
-            db.add(entity)
-            entities.append(entity)
-    
-    if entities:
+        db.add(rec)
+        db.flush()
+        rec_id = rec.id
+        _save_source_refs(db, rec_id, rec.extra)
+        _insert_entities(db, rec_id, parsed)
         db.commit()
-        for entity in entities:
-            db.refresh(entity)
-    
-    return entities
+    except LookupError:
+        db.rollback()
+        raise
+    except SQLAlchemyError as e:
+        db.rollback()
+        if not parsed:
+            raise
+        logger.warning("实体保存失败，仅保存问答记录: %s", e)
+        rec = create_record(
+            db,
+            username=username,
+            conversation_id=conversation_id,
+            question=question,
+            answer_raw=answer_raw,
+            answer_annotated=answer_annotated,
+            chatflow_id=chatflow_id,
+            source_documents=source_documents,
+            entity_status=entity_status,
+            entity_owner=entity_owner,
+        )
+        return rec.id, []
+    return rec_id, _load_entities(db, rec_id, [row["entity_text"] for row in parsed])
+
+def update_record_annotation(db: Session, rec_id: int, answer_annotated: str | None, entity_status: str) -> bool:
+    """
+    更新后台实体抽取结果：标注答案与抽取状态
+    """
+    rec = db.get(QARecord, rec_id)
+    if not rec:
+        return False
+    if answer_annotated is not None:
+        rec.answer_annotated = answer_annotated
+    # 重新赋值新dict，确保JSON字段的变更被检测到；抽取结束后不再需要持有者
+    extra = dict(rec.extra or {})
+    extra["entity_status"] = entity_status
+    extra.pop("entity_owner", None)
+    rec.extra = extra
+    db.commit()
+    return True
+
+def _pending_owned_by(owner: str):
+    return (
+        QARecord.extra["entity_status"].as_string() == "pending",
+        QARecord.extra["entity_owner"].as_string() == owner,
+    )
+
+def renew_entity_leases(db: Session, owner: str, rec_ids: List[int]) -> int:
+    """
+    为本进程仍在处理的 pending 记录续约（刷新 updated_at），返回续约的记录数
+    """
+    if not rec_ids:
+        return 0
+    result = db.execute(
+        update(QARecord)
+        .where(QARecord.id.in_(rec_ids), *_pending_owned_by(owner))
+        .values(updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount
+
+def claim_stale_pending_records(db: Session, owner: str, older_than: datetime, limit: int) -> List[Tuple[int, str, str]]:
+    """
+    认领 older_than 之前最后更新（租约已过期）、后台实体抽取仍为 pending 的记录，返回 [(记录ID, 原始答案, 当前标注答案)]
+
+    pending 记录的 updated_at 即租约：持有者进程定期续约（renew_entity_leases），只有持有者退出或重启后才会过期。
+    认领以 updated_at 为条件，同时刷新租约并把持有者改为 owner，多个进程同时扫描时每条记录只会被一个进程认领
+    """
+    stmt = (
+        select(QARecord.id, QARecord.answer_raw, QARecord.answer_annotated, QARecord.extra, QARecord.updated_at)
+        .where(
+            QARecord.is_deleted == 0,
+            QARecord.updated_at < older_than,
+            QARecord.extra["entity_status"].as_string() == "pending",
+        )
+        .order_by(QARecord.id)
+        .limit(limit)
+    )
+    claimed = []
+    now = datetime.utcnow()
+    for rec_id, answer_raw, answer_annotated, extra, updated_at in db.execute(stmt).all():
+        result = db.execute(
+            update(QARecord)
+            .where(QARecord.id == rec_id, QARecord.updated_at == updated_at)
+            .values(updated_at=now, extra={**(extra or {}), "entity_owner": owner})
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            claimed.append((rec_id, answer_raw or "", answer_annotated))
+    db.commit()
+    return claimed
 
 def get_entities_by_qa_record(db: Session, qa_record_id: int) -> List[QAEntity]:
     """
@@ -233,15 +547,16 @@ def get_entity_by_id(db: Session, entity_id: int) -> QAEntity | None:
 
 def increment_entity_click_count(db: Session, entity_id: int) -> bool:
     """
-    增加实体点击次数
+    增加实体点击次数（原子自增，立即提交；接口层默认走 counters 写回缓冲）
     """
-    entity = db.get(QAEntity, entity_id)
-    if not entity:
-        return False
-    
-    entity.click_count += 1
+    result = db.execute(
+        update(QAEntity)
+        .where(QAEntity.id == entity_id)
+        .values(click_count=QAEntity.click_count + 1)
+        .execution_options(synchronize_session=False)
+    )
     db.commit()
-    return True
+    return result.rowcount > 0
 
 def update_entity_gstore_cache(db: Session, entity_id: int, gstore_result: Dict[str, Any]) -> bool:
     """
@@ -255,38 +570,287 @@ def update_entity_gstore_cache(db: Session, entity_id: int, gstore_result: Dict[
     db.commit()
     return True
 
-def get_history_by_username(db: Session, username: str, page: int, size: int) -> Tuple[int, List[QARecord]]:
-    stmt_total = select(func.count(QARecord.id)).where(QARecord.username == username, QARecord.is_deleted == 0)
-    total = db.scalar(stmt_total) or 0
+def get_history_by_username(
+    db: Session,
+    username: str,
+    page: int,
+    size: int,
+    *,
+    cursor: Optional[str] = None,
+    with_total: bool = True
+) -> Tuple[Optional[int], List[QARecord], Optional[str]]:
+    total = None
+    if with_total:
+        stmt_total = select(func.count(QARecord.id)).where(QARecord.username == username, QARecord.is_deleted == 0)
+        total = db.scalar(stmt_total) or 0
 
     stmt_items = (
         select(QARecord)
         .where(QARecord.username == username, QARecord.is_deleted == 0)
-        .order_by(QARecord.created_at.desc())
-        .offset((page - 1) * size)
-        .limit(size)
+        .options(selectinload(QARecord.entities))  # 一次 IN 查询加载本页全部实体
     )
-    items = list(db.scalars(stmt_items))
-    return total, items
+    items, next_cursor = keyset_page(
+        db, stmt_items, QARecord.created_at, QARecord.id,
+        size=size, page=page, cursor=cursor, descending=True
+    )
+    return total, items, next_cursor
 
 def get_record_by_id(db: Session, rec_id: int) -> QARecord | None:
     return db.get(QARecord, rec_id)
 
 def set_feedback(db: Session, rec_id: int, like: bool) -> bool:
-    rec = db.get(QARecord, rec_id)
-    if not rec or rec.is_deleted == 1:
-        return False
-    if like:
-        rec.likes += 1
-    else:
-        rec.dislikes += 1
+    """
+    点赞/点踩（原子自增，立即提交；接口层默认走 counters 写回缓冲）
+    """
+    column = QARecord.likes if like else QARecord.dislikes
+    result = db.execute(
+        update(QARecord)
+        .where(QARecord.id == rec_id, QARecord.is_deleted == 0)
+        .values({column.key: column + 1})
+        .execution_options(synchronize_session=False)
+    )
     db.commit()
-    return True
+    return result.rowcount > 0
 
-def logical_delete(db: Session, rec_id: int) -> bool:
-    rec = db.get(QARecord, rec_id)
-    if not rec or rec.is_deleted == 1:
-        return False
-    rec.is_deleted = 1
+def is_record_active(db: Session, rec_id: int) -> bool:
+    """
+    记录是否存在且未删除（只查主键，不加载整行）
+    """
+    return db.scalar(select(QARecord.id).where(QARecord.id == rec_id, QARecord.is_deleted == 0)) is not None
+
+def logical_delete(db: Session, rec_id: int) -> Tuple[bool, Optional[str]]:
+    """
+    软删除问答记录并同步扣减所属对话的问答轮数，返回 (是否删除成功, 所属对话ID)
+    """
+    conversation_id = db.scalar(
+        select(QARecord.conversation_id).where(QARecord.id == rec_id, QARecord.is_deleted == 0)
+    )
+    result = db.execute(
+        update(QARecord)
+        .where(QARecord.id == rec_id, QARecord.is_deleted == 0)
+        .values(is_deleted=1, deleted_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount > 0 and conversation_id:
+        db.execute(
+            update(Conversation)
+            .where(Conversation.conversation_id == conversation_id, Conversation.turn_count > 0)
+            .values(turn_count=Conversation.turn_count - 1, updated_at=Conversation.updated_at)
+            .execution_options(synchronize_session=False)
+        )
+    db.commit()
+    return result.rowcount > 0, conversation_id
+
+def backfill_deleted_at(db: Session, model, now: datetime, limit: int) -> int:
+    """
+    为升级前软删除、没有 deleted_at 的行补上删除时间（分批），使其从现在开始计算保留期
+    """
+    ids = list(db.scalars(
+        select(model.id).where(model.is_deleted == 1, model.deleted_at.is_(None)).limit(limit)
+    ))
+    if not ids:
+        return 0
+    db.execute(
+        update(model).where(model.id.in_(ids)).values(deleted_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return len(ids)
+
+def purge_deleted_records_chunk(db: Session, cutoff: datetime, limit: int) -> Tuple[int, int]:
+    """
+    物理删除一批软删除时间早于 cutoff 的问答记录及其实体，返回 (记录数, 实体数)
+    """
+    ids = list(db.scalars(
+        select(QARecord.id)
+        .where(QARecord.is_deleted == 1, QARecord.deleted_at < cutoff)
+        .order_by(QARecord.deleted_at)
+        .limit(limit)
+    ))
+    if not ids:
+        return 0, 0
+    entities = db.execute(delete(QAEntity).where(QAEntity.qa_record_id.in_(ids))).rowcount
+    db.execute(delete(QASourceRef).where(QASourceRef.qa_record_id.in_(ids)))
+    records = db.execute(delete(QARecord).where(QARecord.id.in_(ids))).rowcount
+    db.commit()
+    return records, entities
+
+def purge_deleted_conversations_chunk(db: Session, cutoff: datetime, limit: int) -> int:
+    """
+    物理删除一批软删除时间早于 cutoff、且已没有任何问答记录的对话页面
+    """
+    has_records = select(QARecord.id).where(QARecord.conversation_id == Conversation.conversation_id).exists()
+    ids = list(db.scalars(
+        select(Conversation.id)
+        .where(Conversation.is_deleted == 1, Conversation.deleted_at < cutoff, ~has_records)
+        .order_by(Conversation.deleted_at)
+        .limit(limit)
+    ))
+    if not ids:
+        return 0
+    deleted = db.execute(delete(Conversation).where(Conversation.id.in_(ids))).rowcount
+    db.commit()
+    return deleted
+
+def purge_orphan_source_chunks_chunk(
+    db: Session,
+    after_hash: str,
+    limit: int,
+    referenced_before: datetime
+) -> Tuple[Optional[str], int]:
+    """
+    按哈希顺序取一批来源片段，删除其中没有任何记录引用、且 last_referenced_at 早于 referenced_before 的片段，
+    返回 (本批最大哈希, 删除数)，没有更多片段时哈希为None。
+    是否被引用在 DELETE 语句内判断，不依赖事先读取的引用集合
+    """
+    batch = list(db.scalars(
+        select(SourceChunk.hash).where(SourceChunk.hash > after_hash).order_by(SourceChunk.hash).limit(limit)
+    ))
+    if not batch:
+        return None, 0
+    referenced = select(QASourceRef.hash).where(QASourceRef.hash == SourceChunk.hash).exists()
+    deleted = db.execute(
+        delete(SourceChunk)
+        .where(SourceChunk.hash.in_(batch), SourceChunk.last_referenced_at < referenced_before, ~referenced)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return batch[-1], deleted
+
+def get_first_turn_intents(db: Session, sources: Tuple[str, ...], limit: int) -> List[Tuple[str, int]]:
+    """
+    获取最近对话的首轮问题及其固定的意图 (question, intent_id)，只取意图来源在 sources 中的对话，用于训练本地意图分类器
+    """
+    earlier = aliased(QARecord)
+    first_id = (
+        select(func.min(earlier.id))
+        .where(earlier.conversation_id == Conversation.conversation_id)
+        .scalar_subquery()
+    )
+    intent_source = Conversation.extra["intent_source"].as_string()
+    stmt = (
+        select(QARecord.question, Conversation.extra["intent_id"].as_integer())
+        .join(Conversation, QARecord.conversation_id == Conversation.conversation_id)
+        .where(QARecord.id == first_id, QARecord.is_deleted == 0, intent_source.in_(sources))
+        .order_by(QARecord.id.desc())
+        .limit(limit)
+    )
+    return [(question, intent_id) for question, intent_id in db.execute(stmt) if intent_id is not None]
+
+
+def get_distinct_entity_texts(db: Session, limit: int) -> List[str]:
+    """
+    获取历史实体文本（去重），用于构建本地实体词典
+    """
+    stmt = select(QAEntity.entity_text).distinct().limit(limit)
+    return list(db.scalars(stmt))
+
+
+def get_graph_cache(db: Session, entity_key: str) -> GStoreEntityCache | None:
+    """
+    获取共享的gStore实体查询缓存
+    """
+    return db.scalar(select(GStoreEntityCache).where(GStoreEntityCache.entity_key == entity_key))
+
+def save_graph_cache(
+    db: Session,
+    *,
+    entity_key: str,
+    entity_text: str,
+    result: Dict[str, Any],
+    graph_version: str,
+    expires_at: datetime
+) -> None:
+    """
+    写入（或覆盖）共享的gStore实体查询缓存
+    """
+    row = get_graph_cache(db, entity_key)
+    if row is None:
+        row = GStoreEntityCache(entity_key=entity_key)
+        db.add(row)
+    row.entity_text = entity_text
+    row.result = result
+    row.graph_version = graph_version
+    row.expires_at = expires_at
+    try:
+        db.commit()
+    except IntegrityError:
+        # 并发写入同一实体，保留先写入的结果
+        db.rollback()
+
+def get_graph_caches(db: Session, entity_keys: List[str]) -> List[GStoreEntityCache]:
+    """
+    批量获取共享的gStore实体查询缓存（一次查询）
+    """
+    if not entity_keys:
+        return []
+    stmt = select(GStoreEntityCache).where(GStoreEntityCache.entity_key.in_(entity_keys))
+    return list(db.scalars(stmt))
+
+def save_graph_caches(db: Session, entries: List[Dict[str, Any]], graph_version: str, expires_at: datetime) -> None:
+    """
+    批量写入（或覆盖）共享的gStore实体查询缓存，一次提交
+
+    Args:
+        entries: [{"entity_key", "entity_text", "result"}, ...]
+    """
+    if not entries:
+        return
+    existing = {row.entity_key: row for row in get_graph_caches(db, [e["entity_key"] for e in entries])}
+    for entry in entries:
+        row = existing.get(entry["entity_key"])
+        if row is None:
+            row = GStoreEntityCache(entity_key=entry["entity_key"])
+            db.add(row)
+            existing[entry["entity_key"]] = row
+        row.entity_text = entry["entity_text"]
+        row.result = entry["result"]
+        row.graph_version = graph_version
+        row.expires_at = expires_at
+    try:
+        db.commit()
+    except IntegrityError:
+        # 与其他进程并发写入，退回逐条写入
+        db.rollback()
+        for entry in entries:
+            save_graph_cache(db, graph_version=graph_version, expires_at=expires_at, **entry)
+
+def get_entities_by_ids(db: Session, entity_ids: List[int]) -> List[QAEntity]:
+    """
+    按ID批量获取实体
+    """
+    if not entity_ids:
+        return []
+    stmt = select(QAEntity).where(QAEntity.id.in_(entity_ids))
+    return list(db.scalars(stmt))
+
+def get_graph_version(db: Session) -> Optional[str]:
+    """
+    获取持久化的当前图版本，从未切换过时返回None
+    """
+    return db.scalar(select(GraphState.version).where(GraphState.name == "gstore"))
+
+def set_graph_version(db: Session, graph_version: str) -> None:
+    """
+    写入当前图版本
+    """
+    row = db.get(GraphState, "gstore")
+    if row is None:
+        db.add(GraphState(name="gstore", version=graph_version))
+    else:
+        row.version = graph_version
+    try:
+        db.commit()
+    except IntegrityError:
+        # 其他进程同时首次写入，改为更新
+        db.rollback()
+        db.execute(update(GraphState).where(GraphState.name == "gstore").values(version=graph_version))
+        db.commit()
+
+def delete_stale_graph_cache(db: Session, graph_version: str) -> int:
+    """
+    删除非当前图版本的缓存行
+    """
+    result = db.execute(delete(GStoreEntityCache).where(GStoreEntityCache.graph_version != graph_version))
     db.commit()
-    return True
\ No newline at end of file
+    return result.rowcount
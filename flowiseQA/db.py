@@ -1,4 +1,7 @@
-from sqlalchemy import create_engine
+import logging
+from typing import Any, Callable
+from sqlalchemy import Connection, Index, Table, create_engine, inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from config import mysql_url, DB_ECHO
 
@@ -6,4 +9,82 @@ class Base(DeclarativeBase):
     pass
 
 engine = create_engine(mysql_url(), echo=DB_ECHO, pool_pre_ping=True, future=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
\ No newline at end of file
+SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+
+logger = logging.getLogger(__name__)
+
+def _exists(kind: str, table_name: str, name: str) -> bool:
+    # 每次重新检查，其他进程可能刚刚创建了同名对象
+    inspector = inspect(engine)
+    if kind == "column":
+        return name in {c["name"] for c in inspector.get_columns(table_name)}
+    return name in {i["name"] for i in inspector.get_indexes(table_name)}
+
+def _apply(kind: str, table_name: str, name: str, action: Callable[[Connection], Any]) -> None:
+    """
+    在独立事务中执行一条DDL；多个进程同时启动时可能已被其他进程执行，此时重新检查对象存在即视为成功
+    """
+    try:
+        with engine.begin() as conn:
+            action(conn)
+    except (OperationalError, ProgrammingError) as e:
+        if not _exists(kind, table_name, name):
+            raise
+        logger.info("%s已由其他进程创建: %s.%s (%s)", "列" if kind == "column" else "索引", table_name, name, e.orig)
+        return
+    logger.info("已%s: %s.%s", "添加列" if kind == "column" else "创建索引", table_name, name)
+
+def _add_column_ddl(table: Table, column) -> str:
+    ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+    if column.server_default is not None:
+        # 与 CREATE TABLE 相同的方式渲染默认值（字符串按方言转义并加引号）
+        default = engine.dialect.ddl_compiler(engine.dialect, None).get_column_default_string(column)
+        ddl += f" NOT NULL DEFAULT {default}"
+    return ddl
+
+def _dedupe(conn: Connection, index: Index) -> None:
+    """
+    创建唯一索引前删除已有的重复行（每组保留主键最小的一行）
+    """
+    table = index.table
+    pk = table.primary_key.columns.values()[0].name
+    columns = ", ".join(c.name for c in index.columns)
+    result = conn.execute(text(
+        f"DELETE FROM {table.name} WHERE {pk} NOT IN "
+        f"(SELECT keep FROM (SELECT MIN({pk}) AS keep FROM {table.name} GROUP BY {columns}) AS k)"
+    ))
+    if result.rowcount:
+        logger.info("创建唯一索引 %s 前删除重复行: %d", index.name, result.rowcount)
+
+def _create_index(index: Index) -> Callable[[Connection], None]:
+    def action(conn: Connection) -> None:
+        if index.unique and index.info.get("dedupe"):
+            _dedupe(conn, index)
+        index.create(bind=conn)
+    return action
+
+def sync_schema() -> None:
+    """
+    启动时同步表结构：create_all 只会创建缺失的表，这里再为已有表补齐模型中新增的列与索引。
+    新增列一律按可空列添加（有 server_default 的除外），不修改或删除已有列。
+    多个worker可能同时执行：每条DDL单独提交，对象已被其他进程创建时跳过
+    """
+    try:
+        Base.metadata.create_all(bind=engine)
+    except (OperationalError, ProgrammingError) as e:
+        # 其他进程同时建表：再执行一次，已存在的表会被跳过
+        logger.info("建表与其他进程冲突，重试: %s", e.orig)
+        Base.metadata.create_all(bind=engine)
+
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                ddl = _add_column_ddl(table, column)
+                _apply("column", table.name, column.name, lambda conn, ddl=ddl: conn.execute(text(ddl)))
+
+        existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                _apply("index", table.name, index.name, _create_index(index))
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+from config import HEDGE_ENABLED, HEDGE_MIN_DELAY, HEDGE_MIN_SAMPLES, HEDGE_WINDOW
+
+# 请求级时间预算：入口处设置截止时间（保存在 contextvar 中，随协程与其创建的任务传递），
+# 各上游调用的超时取 min(自身超时, 剩余预算)，可选阶段在剩余预算不足时直接跳过。
+# 幂等的读请求（意图识别、gStore查询）超过近期 p95 仍未返回时再发一个对冲请求，取先成功的结果
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """
+    请求的时间预算已用完
+    """
+
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+_counters: Dict[str, int] = defaultdict(int)
+
+def start(budget: float) -> None:
+    """
+    为当前请求设置时间预算（秒）
+    """
+    _deadline.set(time.monotonic() + budget)
+
+def remaining() -> Optional[float]:
+    """
+    剩余预算（秒），未设置预算时返回None
+    """
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def timeout_for(default: float) -> float:
+    """
+    计算上游调用的超时：不超过剩余预算；预算已用完时抛出 DeadlineExceeded
+    """
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        _counters["exceeded"] += 1
+        raise DeadlineExceeded("请求时间预算已用完")
+    return min(default, left)
+
+def has_time_for(seconds: float, stage: Optional[str] = None) -> bool:
+    """
+    剩余预算是否足够执行一个至少需要 seconds 秒的阶段；不足且指定了 stage 时记录一次跳过
+    """
+    left = remaining()
+    if left is None or left >= seconds:
+        return True
+    if stage:
+        _counters[f"skipped_{stage}"] += 1
+    return False
+
+class _LatencyWindow:
+    """
+    最近 N 次成功调用的耗时，用于估计对冲延迟（p95）
+    """
+    def __init__(self):
+        self._samples: Deque[float] = deque(maxlen=HEDGE_WINDOW)
+        self._lock = threading.Lock()
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def p95(self) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def stats(self) -> Dict[str, Any]:
+        p95 = self.p95()
+        return {
+            "samples": len(self._samples),
+            "p95_seconds": round(p95, 4) if p95 is not None else None,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+        }
+
+_windows: Dict[str, _LatencyWindow] = defaultdict(_LatencyWindow)
+
+async def hedged(name: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    执行幂等调用：耗时超过该调用近期 p95 时再发起一次相同调用，返回先成功的结果并取消另一个。
+    样本不足、对冲关闭或剩余预算不足以等到 p95 时只发起一次
+    """
+    window = _windows[name]
+    p95 = window.p95()
+    started = time.monotonic()
+    delay = max(p95, HEDGE_MIN_DELAY) if p95 is not None else None
+    if not HEDGE_ENABLED or delay is None or not has_time_for(delay):
+        result = await fn()
+        window.observe(time.monotonic() - started)
+        return result
+
+    primary = asyncio.ensure_future(fn())
+    pending = {primary}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            window.hedged += 1
+            pending.add(asyncio.ensure_future(fn()))
+        error: Optional[BaseException] = None
+        while True:
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        window.hedge_wins += 1
+                    window.observe(time.monotonic() - started)
+                    return task.result()
+                error = task.exception()
+            if not pending:
+                raise error
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in pending:
+            task.cancel()
+
+def deadline_stats() -> Dict[str, Any]:
+    return {
+        "counters": dict(_counters),
+        "hedging": {name: window.stats() for name, window in _windows.items()},
+    }
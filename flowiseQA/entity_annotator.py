@@ -0,0 +1,194 @@
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+from config import (
+    ENTITY_ANNOTATOR_MODE, ENTITY_DICT_REFRESH_INTERVAL,
+    ENTITY_DICT_MAX_TERMS, ENTITY_DICT_MIN_LENGTH
+)
+from crud import get_distinct_entity_texts
+from executors import run_background
+from gstore_client import afetch_labels
+
+logger = logging.getLogger(__name__)
+
+# 本地实体标注：用 gStore rdfs:label 与历史 QAEntity.entity_text 构建 Aho-Corasick 自动机，
+# 一次扫描即可找出答案中的全部实体，输出与LLM标注一致的 <class>实体</class> 格式
+
+OPEN_TAG = "<class>"
+CLOSE_TAG = "</class>"
+
+@dataclass
+class EntitySpan:
+    text: str
+    start: int  # 在标注后文本中的起止位置（含标签），与 extract_and_save_entities 一致
+    end: int
+
+def _fold(text: str) -> str:
+    # 逐字符小写，保证折叠后长度不变，匹配位置可直接映射回原文
+    return "".join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+def _is_word_char(c: str) -> bool:
+    return c.isascii() and c.isalnum()
+
+class AhoCorasick:
+    """
+    多模式串匹配自动机，返回最左最长、互不重叠的匹配
+    """
+    def __init__(self, patterns: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]  # 每个状态上结束的模式长度（含失败链）
+        self.size = 0
+        for pattern in patterns:
+            self._add(pattern)
+        self._build()
+
+    def _add(self, pattern: str) -> None:
+        state = 0
+        for c in pattern:
+            nxt = self._goto[state].get(c)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][c] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        if len(pattern) not in self._out[state]:
+            self._out[state].append(len(pattern))
+            self.size += 1
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and c not in self._goto[f]:
+                    f = self._fail[f]
+                fallback = self._goto[f].get(c, 0)
+                self._fail[nxt] = fallback if fallback != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> List[Tuple[int, int]]:
+        matches = []
+        state = 0
+        for i, c in enumerate(text):
+            while state and c not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(c, 0)
+            for length in self._out[state]:
+                matches.append((i - length + 1, i + 1))
+
+        # 最左最长、互不重叠
+        matches.sort(key=lambda m: (m[0], m[0] - m[1]))
+        selected = []
+        last_end = 0
+        for start, end in matches:
+            if start < last_end:
+                continue
+            # 英文/数字模式需要整词匹配，避免 COT 命中 COTTON
+            if _is_word_char(text[start]) and start > 0 and _is_word_char(text[start - 1]):
+                continue
+            if _is_word_char(text[end - 1]) and end < len(text) and _is_word_char(text[end]):
+                continue
+            selected.append((start, end))
+            last_end = end
+        return selected
+
+def _clean_terms(terms: Iterable[str]) -> List[str]:
+    cleaned = set()
+    for term in terms:
+        if not term:
+            continue
+        term = _fold(term.strip())
+        if len(term) < ENTITY_DICT_MIN_LENGTH or len(term) > 64:
+            continue
+        if term.isdigit() or "<" in term or ">" in term:
+            continue
+        cleaned.add(term)
+        if len(cleaned) >= ENTITY_DICT_MAX_TERMS:
+            break
+    return sorted(cleaned)
+
+_automaton: Optional[AhoCorasick] = None
+
+def is_ready() -> bool:
+    return _automaton is not None and _automaton.size > 0
+
+def build_dictionary(terms: Iterable[str]) -> int:
+    """
+    用给定词条重建自动机，返回词条数
+    """
+    global _automaton
+    automaton = AhoCorasick(_clean_terms(terms))
+    _automaton = automaton
+    logger.info("实体词典已更新: %d 个词条", automaton.size)
+    return automaton.size
+
+def annotate(text: str) -> Tuple[str, List[EntitySpan]]:
+    """
+    本地标注：返回 (带 <class> 标签的文本, 实体位置列表)
+    """
+    automaton = _automaton
+    if automaton is None or not text:
+        return text, []
+
+    parts = []
+    spans = []
+    cursor = 0
+    out_len = 0
+    for start, end in automaton.find(_fold(text)):
+        plain = text[cursor:start]
+        parts.append(plain)
+        out_len += len(plain)
+        entity_text = text[start:end]
+        tagged = f"{OPEN_TAG}{entity_text}{CLOSE_TAG}"
+        parts.append(tagged)
+        spans.append(EntitySpan(entity_text, out_len, out_len + len(tagged)))
+        out_len += len(tagged)
+        cursor = end
+    parts.append(text[cursor:])
+    return "".join(parts), spans
+
+def use_local() -> bool:
+    """
+    当前模式下是否使用本地标注
+    """
+    if ENTITY_ANNOTATOR_MODE == "local":
+        return True
+    if ENTITY_ANNOTATOR_MODE == "llm":
+        return False
+    return is_ready()
+
+async def refresh_dictionary(session_factory) -> int:
+    """
+    从 gStore 标签和历史实体重建词典
+    """
+    terms: List[str] = []
+    try:
+        terms.extend(await afetch_labels(max_labels=ENTITY_DICT_MAX_TERMS))
+    except Exception as e:
+        logger.warning("拉取gStore标签失败: %s", e)
+
+    db = session_factory()
+    try:
+        terms.extend(await run_background(get_distinct_entity_texts, db, ENTITY_DICT_MAX_TERMS))
+    finally:
+        await run_background(db.close)
+
+    return await run_background(build_dictionary, terms)
+
+async def refresh_periodically(session_factory) -> None:
+    """
+    后台任务：定期刷新实体词典
+    """
+    while True:
+        try:
+            await refresh_dictionary(session_factory)
+        except Exception as e:
+            logger.warning("实体词典刷新失败: %s", e)
+        await asyncio.sleep(ENTITY_DICT_REFRESH_INTERVAL)
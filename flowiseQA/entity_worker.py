@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 后台实体抽取工作池：有界队列 + 固定数量的worker协程。
+# /qa 入库后立即返回，标注与实体入库在这里异步完成，完成后唤醒等待该记录的订阅者
+
+Job = Callable[[], Awaitable[None]]
+
+# 本进程的标识：写入 pending 记录（entity_owner），只有持有者会为记录续约
+WORKER_ID = f"{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class EntityWorkerPool:
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks: List[asyncio.Task] = []
+        self._events: Dict[int, asyncio.Event] = {}
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float) -> None:
+        """
+        停止工作池：先在超时时间内等待队列处理完，再取消worker
+        """
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("实体抽取队列未处理完: 剩余 %d 个任务", self.queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def submit(self, rec_id: int, job: Job) -> bool:
+        """
+        提交任务，队列已满时返回False（调用方应同步执行）；同一记录已在队列中或执行中时不重复提交
+        """
+        if rec_id in self._events:
+            return True
+        try:
+            self.queue.put_nowait((rec_id, job))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self._events.setdefault(rec_id, asyncio.Event())
+        return True
+
+    def holds(self, rec_id: int) -> bool:
+        """
+        记录的任务是否已在本进程的队列中或正在执行
+        """
+        return rec_id in self._events
+
+    def held(self) -> List[int]:
+        """
+        本进程队列中与执行中的全部记录ID
+        """
+        return list(self._events)
+
+    def free_slots(self) -> int:
+        return self.queue.maxsize - self.queue.qsize()
+
+    async def wait(self, rec_id: int, timeout: float) -> bool:
+        """
+        等待指定记录的任务完成（仅本进程提交的任务），超时或任务不存在返回False
+        """
+        event = self._events.get(rec_id)
+        if event is None:
+            return False
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _run(self) -> None:
+        while True:
+            rec_id, job = await self.queue.get()
+            try:
+                await job()
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error("后台实体抽取失败: rec_id=%s, %s", rec_id, e, exc_info=True)
+            finally:
+                event = self._events.pop(rec_id, None)
+                if event is not None:
+                    event.set()
+                self.queue.task_done()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.workers,
+            "queued": self.queue.qsize(),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+_pool: Optional[EntityWorkerPool] = None
+
+def start_pool(workers: int, queue_size: int) -> EntityWorkerPool:
+    global _pool
+    _pool = EntityWorkerPool(workers, queue_size)
+    _pool.start()
+    return _pool
+
+def get_pool() -> Optional[EntityWorkerPool]:
+    return _pool
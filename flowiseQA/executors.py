@@ -0,0 +1,199 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional
+import anyio
+import anyio.to_thread
+import deadline
+from config import LLM_SLOTS, LLM_QUEUE_SIZE, LLM_QUEUE_TIMEOUT, LLM_RETRY_AFTER, QA_THREADS, DB_THREADS, BACKGROUND_THREADS
+
+# 按接口类别隔离执行资源，避免大量慢速问答拖垮其他接口：
+# - LLM通道：/qa、/qa/stream 的并发槽位，满载时有限排队，排不上立即返回503，而不是让所有请求一起变慢
+# - QA线程池：问答流水线中的数据库等阻塞操作使用独立线程池（run_qa），不占用其他接口的线程
+# - DB线程池：只读数据库的接口（/history、/conversations、/qa/{id}/entities、实体查询及其gStore缓存读写等）显式通过 run_db 执行
+# - 后台线程池：后台任务（软删除清理、计数写回、实体词典/标签索引重建、意图分类器训练、轮数回填、遗留任务认领）
+#   通过 run_background 在少量线程中执行，不与请求争用线程
+# - 请求依赖注入的数据库会话在DB线程池中关闭，问答流水线与后台任务自建的会话在各自的线程池中关闭
+# - 其余同步接口（写操作、统计接口）仍使用 AnyIO 默认线程池
+# - /health 为异步接口，不依赖数据库会话，不占用任何线程池与槽位
+
+class LaneFull(Exception):
+    """
+    通道繁忙：排队已满或排队超时
+    """
+    def __init__(self, lane: str, retry_after: int):
+        super().__init__(f"{lane} 通道繁忙，请稍后重试")
+        self.lane = lane
+        self.retry_after = retry_after
+
+class _Lease:
+    __slots__ = ("_gate", "_released")
+
+    def __init__(self, gate: "AdmissionGate"):
+        self._gate = gate
+        self._released = False
+
+    def release(self) -> None:
+        """
+        归还槽位（可重复调用，只生效一次）
+        """
+        if not self._released:
+            self._released = True
+            self._gate._release()
+
+class AdmissionGate:
+    """
+    有限并发 + 有限排队的准入控制；槽位按先来先得转交给排队中的请求
+    """
+    def __init__(self, name: str, slots: int, queue_size: int, queue_timeout: float, retry_after: int):
+        self.name = name
+        self.slots = slots
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.active = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> _Lease:
+        if self.active < self.slots and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return _Lease(self)
+        if len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            raise LaneFull(self.name, self.retry_after)
+
+        # 排队等待时间同时受请求时间预算约束
+        timeout = self.queue_timeout
+        left = deadline.remaining()
+        if left is not None:
+            timeout = max(0.0, min(timeout, left))
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise LaneFull(self.name, self.retry_after)
+        except BaseException:
+            # 取消时若槽位已转交给本请求，需要归还
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        self.admitted += 1
+        return _Lease(self)
+
+    def _release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # 槽位直接转交，active 不变
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        lease = await self.acquire()
+        try:
+            yield
+        finally:
+            lease.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "slots": self.slots,
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "queue_size": self.queue_size,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+llm_gate = AdmissionGate("llm", LLM_SLOTS, LLM_QUEUE_SIZE, LLM_QUEUE_TIMEOUT, LLM_RETRY_AFTER)
+
+def llm_slot():
+    """
+    占用一个LLM通道槽位：async with llm_slot(): ...
+    """
+    return llm_gate.slot()
+
+async def release_after(stream: AsyncIterator[Any], lease: _Lease) -> AsyncIterator[Any]:
+    """
+    流式响应结束（或客户端断开）后归还槽位
+    """
+    try:
+        async for item in stream:
+            yield item
+    finally:
+        lease.release()
+
+_qa_limiter: Optional[anyio.CapacityLimiter] = None
+_db_limiter: Optional[anyio.CapacityLimiter] = None
+_background_limiter: Optional[anyio.CapacityLimiter] = None
+_default_limiter: Optional[anyio.CapacityLimiter] = None
+
+def configure() -> None:
+    """
+    应用启动时（事件循环内）创建各线程池的并发限制
+    """
+    global _qa_limiter, _db_limiter, _background_limiter, _default_limiter
+    _qa_limiter = anyio.CapacityLimiter(QA_THREADS)
+    _db_limiter = anyio.CapacityLimiter(DB_THREADS)
+    _background_limiter = anyio.CapacityLimiter(BACKGROUND_THREADS)
+    # 默认线程池只记录下来用于统计，大小保持不变
+    _default_limiter = anyio.to_thread.current_default_thread_limiter()
+
+async def run_qa(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    在QA线程池中执行阻塞调用（问答流水线的数据库操作）
+    """
+    global _qa_limiter
+    if _qa_limiter is None:
+        _qa_limiter = anyio.CapacityLimiter(QA_THREADS)
+    return await anyio.to_thread.run_sync(partial(fn, *args, **kwargs), limiter=_qa_limiter)
+
+async def run_db(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    在DB线程池中执行阻塞调用（只读数据库接口）
+    """
+    global _db_limiter
+    if _db_limiter is None:
+        _db_limiter = anyio.CapacityLimiter(DB_THREADS)
+    return await anyio.to_thread.run_sync(partial(fn, *args, **kwargs), limiter=_db_limiter)
+
+async def run_background(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    在后台线程池中执行阻塞调用（后台任务）
+    """
+    global _background_limiter
+    if _background_limiter is None:
+        _background_limiter = anyio.CapacityLimiter(BACKGROUND_THREADS)
+    return await anyio.to_thread.run_sync(partial(fn, *args, **kwargs), limiter=_background_limiter)
+
+def _limiter_stats(limiter: Optional[anyio.CapacityLimiter]) -> Optional[Dict[str, Any]]:
+    if limiter is None:
+        return None
+    return {"threads": int(limiter.total_tokens), "busy": limiter.borrowed_tokens, "waiting": limiter.statistics().tasks_waiting}
+
+def executor_stats() -> Dict[str, Any]:
+    return {
+        "llm": llm_gate.stats(),
+        "threads": {
+            "qa": _limiter_stats(_qa_limiter),
+            "db": _limiter_stats(_db_limiter),
+            "background": _limiter_stats(_background_limiter),
+            "default": _limiter_stats(_default_limiter),
+        },
+    }
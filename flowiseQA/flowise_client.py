@@ -1,9 +1,15 @@
 
-import requests
-from typing import Optional, Dict, List, Any
-from config import FLOWISE_BASE_URL, FLOWISE_CHATFLOW_ID, FLOWISE_API_KEY
+from typing import Optional, Dict, List, Any, Tuple, AsyncIterator
+from config import FLOWISE_BASE_URL, FLOWISE_CHATFLOW_ID, FLOWISE_API_KEY, FLOWISE_TIMEOUT
+from upstream import get_async_client
+import singleflight
+import deadline
+import tracing
+import logging
 import json
 
+logger = logging.getLogger(__name__)
+
 def _headers_json():
     headers = {"Content-Type": "application/json"}
     if FLOWISE_API_KEY:
@@ -30,12 +36,12 @@ def _extract_source_documents(resp_json) -> List[Dict[str, Any]]:
     source_docs = resp_json.get("sourceDocuments", [])
     return source_docs if isinstance(source_docs, list) else []
 
-def _call_flowise_api(
+def _build_prediction_request(
         question: str,
         override_config: Optional[Dict[str, Any]] = None,
-        is_entity_extract: bool = False,  # 新增：标记是否是实体抽取请求
-        chatflow_id: Optional[str] = None  # 新增：传递chatflow_id
-) -> dict:
+        is_entity_extract: bool = False,
+        chatflow_id: Optional[str] = None
+) -> Tuple[str, Dict[str, Any]]:
     # 使用传入的chatflow_id，若没有则使用默认的FLOWISE_CHATFLOW_ID
     effective_chatflow_id = chatflow_id or FLOWISE_CHATFLOW_ID
     url = f"{FLOWISE_BASE_URL}/api/v1/prediction/{effective_chatflow_id}"
@@ -45,52 +51,105 @@ def _call_flowise_api(
         "overrideConfig": override_config or {}
     }
 
-    # 打印日志时区分请求类型，避免混淆
-    if is_entity_extract:
-        print(f"=== 实体抽取：发送给Flowise的请求体 ===")
-    else:
-        print(f"=== 用户问答：发送给Flowise的请求体 ===")
+    # 日志中区分请求类型，避免混淆；请求体只在DEBUG级别序列化
+    tracing.debug(logger, "%s请求Flowise: url=%s payload=%s",
+                  "实体抽取" if is_entity_extract else "用户问答", url, tracing.LazyJson(payload))
+    return url, payload
 
-    print(f"请求URL: {url}")
-    print(f"请求体: {json.dumps(payload, ensure_ascii=False, indent=2)}")
-    print("===========================")
+# 同一chatflow、相同载荷（问题 + overrideConfig，含sessionId）的并发预测只调用一次Flowise
+_flight = singleflight.group("flowise")
 
-    resp = requests.post(url, json=payload, headers=_headers_json(), timeout=60)
+async def _post_prediction(url: str, payload: Dict[str, Any], timeout: float) -> dict:
+    resp = await get_async_client("flowise").post(url, json=payload, headers=_headers_json(), timeout=timeout)
     resp.raise_for_status()
     return resp.json()
 
-# 修改call_flowise和call_flowise_full，使其支持传递chatflow_id参数
+async def _acall_flowise_api(
+        question: str,
+        override_config: Optional[Dict[str, Any]] = None,
+        is_entity_extract: bool = False,
+        chatflow_id: Optional[str] = None,
+        timeout: float = FLOWISE_TIMEOUT
+) -> dict:
+    url, payload = _build_prediction_request(question, override_config, is_entity_extract, chatflow_id)
+    timeout = deadline.timeout_for(timeout)
+    resp_json, _ = await _flight.do(singleflight.key(url, payload), lambda: _post_prediction(url, payload, timeout))
+    return resp_json
 
-def call_flowise(
+# 异步版本：供 /qa 异步流水线使用，不占用线程池
+async def acall_flowise(
         question: str,
         override_config: Optional[Dict[str, Any]] = None,
-        chatflow_id: Optional[str] = None  # 新增：传递chatflow_id
+        chatflow_id: Optional[str] = None,
+        timeout: float = FLOWISE_TIMEOUT
 ) -> str:
-    resp_json = _call_flowise_api(question, override_config, is_entity_extract=False, chatflow_id=chatflow_id)
+    resp_json = await _acall_flowise_api(question, override_config, is_entity_extract=False, chatflow_id=chatflow_id, timeout=timeout)
     return _extract_text(resp_json)
 
-def call_flowise_full(
+async def acall_flowise_full(
         question: str,
         override_config: Optional[Dict[str, Any]] = None,
-        chatflow_id: Optional[str] = None  # 新增：传递chatflow_id
+        chatflow_id: Optional[str] = None,
+        timeout: float = FLOWISE_TIMEOUT
 ) -> Dict[str, Any]:
-    resp_json = _call_flowise_api(question, override_config, is_entity_extract=False, chatflow_id=chatflow_id)
+    resp_json = await _acall_flowise_api(question, override_config, is_entity_extract=False, chatflow_id=chatflow_id, timeout=timeout)
     return {
         "text": _extract_text(resp_json),
         "source_documents": _extract_source_documents(resp_json),
         "override_config": override_config
     }
 
-
-
-# 3. 实体抽取调用（新增传递overrideConfig）
-def extract_entities_with_model(
+async def astream_flowise(
+        question: str,
+        override_config: Optional[Dict[str, Any]] = None,
+        chatflow_id: Optional[str] = None,
+        timeout: float = FLOWISE_TIMEOUT
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    以流式方式调用Flowise预测接口，逐个产出 (event, data)
+
+    event 取值与Flowise一致：token / sourceDocuments / metadata / error / end 等
+    """
+    url, payload = _build_prediction_request(question, override_config, False, chatflow_id)
+    payload["streaming"] = True
+    async with get_async_client("flowise").stream("POST", url, json=payload, headers=_headers_json(), timeout=timeout) as resp:
+        resp.raise_for_status()
+        content_type = resp.headers.get("content-type", "")
+        if "text/event-stream" not in content_type:
+            # chatflow不支持流式时Flowise直接返回完整JSON
+            resp_json = json.loads(await resp.aread())
+            yield "token", _extract_text(resp_json)
+            yield "sourceDocuments", _extract_source_documents(resp_json)
+            yield "end", "[DONE]"
+            return
+
+        async for line in resp.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if not data:
+                continue
+            try:
+                message = json.loads(data)
+            except json.JSONDecodeError:
+                # 旧版本Flowise直接推送token文本
+                yield "token", data
+                continue
+            if isinstance(message, dict) and "event" in message:
+                yield message["event"], message.get("data")
+                if message["event"] == "end":
+                    return
+            else:
+                yield "token", data
+
+async def aextract_entities_with_model(
         answer_text: str,
-        override_config: Optional[Dict[str, Any]] = None  # 新增：传递overrideConfig
+        override_config: Optional[Dict[str, Any]] = None,
+        timeout: float = FLOWISE_TIMEOUT
 ) -> str:
     prompt = build_entity_extraction_prompt(answer_text)
-    # 调用时传入overrideConfig，确保实体抽取请求也携带sessionId
-    return call_flowise(prompt, override_config=override_config)
+    resp_json = await _acall_flowise_api(prompt, override_config, is_entity_extract=True, timeout=timeout)
+    return _extract_text(resp_json)
 
 # 构建实体抽取Prompt（保持不变）
 def build_entity_extraction_prompt(answer_text: str) -> str:
@@ -105,28 +164,3 @@ def build_entity_extraction_prompt(answer_text: str) -> str:
         f"待处理文本：\n{answer_text}\n\n"
         "标注结果："
     )
-
-# 知识库相关函数（保持不变）
-def get_all_knowledge_bases() -> List[Dict[str, Any]]:
-    url = f"{FLOWISE_BASE_URL}/api/v1/document-store/store"
-    headers = {"Authorization": f"Bearer {FLOWISE_API_KEY}", "Content-Type": "application/json"}
-    try:
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        data = response.json()
-        return data if isinstance(data, list) else []
-    except Exception as e:
-        print(f"获取知识库列表失败: {e}")
-        raise Exception(f"获取知识库列表失败: {str(e)}")
-
-def get_knowledge_base_by_id(kb_id: str) -> Dict[str, Any]:
-    url = f"{FLOWISE_BASE_URL}/api/v1/document-store/store/{kb_id}"
-    headers = {"Authorization": f"Bearer {FLOWISE_API_KEY}", "Content-Type": "application/json"}
-    try:
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        data = response.json()
-        return data if isinstance(data, dict) else {}
-    except Exception as e:
-        print(f"获取知识库详情失败: {e}")
-        raise Exception(f"获取知识库详情失败: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import time
+import unicodedata
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from cache import TTLCache
+from config import (
+    GSTORE_GRAPH_VERSION, GRAPH_VERSION_CHECK_INTERVAL, GRAPH_CACHE_SIZE, GRAPH_CACHE_TTL, GRAPH_CACHE_DB_TTL,
+    GSTORE_BATCH_SIZE
+)
+from crud import (
+    get_graph_cache, save_graph_cache, get_graph_caches, save_graph_caches, delete_stale_graph_cache,
+    get_graph_version, set_graph_version
+)
+from gstore_client import (
+    aquery_entity_nodes, aquery_uri_neighborhood, aquery_entities_batch, aquery_neighborhoods_batch
+)
+from executors import run_db
+import label_index
+import singleflight
+import deadline
+
+logger = logging.getLogger(__name__)
+
+# gStore实体邻域缓存：按归一化实体文本共享，同一实体无论出现在多少条答案中只查询一次gStore
+#   第一层：进程内 LRU/TTL
+#   第二层：gstore_entity_cache 表（跨进程、跨重启）
+# 每条缓存记录图版本，版本变化（图数据库重新导入）后旧结果一律视为未命中；
+# 当前版本持久化在 graph_state 表中，各进程定期重新读取，任一进程切换版本后其他进程随之失效
+
+_memory = TTLCache(GRAPH_CACHE_SIZE, GRAPH_CACHE_TTL, name="graph")
+_graph_version = GSTORE_GRAPH_VERSION
+_version_checked_at: Optional[float] = None
+_counters: Counter = Counter()
+# 同一实体的并发点击共享一次gStore查询
+_flight = singleflight.group("gstore")
+
+def normalize_entity(entity_text: str) -> str:
+    """
+    实体文本归一化：全半角统一、去首尾空白、合并空白、小写
+    """
+    text = unicodedata.normalize("NFKC", entity_text).strip().lower()
+    return " ".join(text.split())[:255]
+
+def graph_version() -> str:
+    return _graph_version
+
+def _apply_version(version: str) -> None:
+    global _graph_version, _version_checked_at
+    _version_checked_at = time.monotonic()
+    if version != _graph_version:
+        logger.info("图版本已变化: %s -> %s", _graph_version, version)
+        _graph_version = version
+        _memory.clear()
+
+async def sync_version(db: Session) -> str:
+    """
+    距上次读取超过 GRAPH_VERSION_CHECK_INTERVAL 时从数据库重新读取当前图版本；读取失败时沿用进程内版本
+    """
+    if _version_checked_at is not None and time.monotonic() - _version_checked_at < GRAPH_VERSION_CHECK_INTERVAL:
+        return _graph_version
+    try:
+        version = await run_db(get_graph_version, db)
+    except Exception as e:
+        logger.warning("读取图版本失败: %s", e)
+        return _graph_version
+    _apply_version(version or GSTORE_GRAPH_VERSION)
+    return _graph_version
+
+def _load_from_db(db: Session, key: str) -> Optional[Dict[str, Any]]:
+    row = get_graph_cache(db, key)
+    if row is None or row.graph_version != _graph_version or row.expires_at <= datetime.utcnow():
+        return None
+    return row.result
+
+def _save_to_db(db: Session, key: str, entity_text: str, result: Dict[str, Any], version: str) -> None:
+    save_graph_cache(
+        db,
+        entity_key=key,
+        entity_text=entity_text[:255],
+        result=result,
+        graph_version=version,
+        expires_at=datetime.utcnow() + timedelta(seconds=GRAPH_CACHE_DB_TTL),
+    )
+
+def lookup_memory(entity_text: str) -> Optional[Dict[str, Any]]:
+    """
+    仅查询进程内缓存
+    """
+    hit = _memory.get((_graph_version, normalize_entity(entity_text)))
+    if hit is not None:
+        _counters["memory_hits"] += 1
+    return hit
+
+async def lookup(db: Session, entity_text: str) -> Optional[Dict[str, Any]]:
+    """
+    依次查询进程内缓存与数据库缓存，未命中返回None
+    """
+    await sync_version(db)
+    key = normalize_entity(entity_text)
+    hit = _memory.get((_graph_version, key))
+    if hit is not None:
+        _counters["memory_hits"] += 1
+        return hit
+
+    hit = await run_db(_load_from_db, db, key)
+    if hit is not None:
+        _counters["db_hits"] += 1
+        _memory.set((_graph_version, key), hit)
+        return hit
+
+    _counters["misses"] += 1
+    return None
+
+async def store(db: Session, entity_text: str, result: Dict[str, Any]) -> None:
+    """
+    写入两层缓存
+    """
+    key = normalize_entity(entity_text)
+    version = _graph_version
+    _memory.set((version, key), result)
+    try:
+        await run_db(_save_to_db, db, key, entity_text, result, version)
+        _counters["stores"] += 1
+    except Exception as e:
+        logger.warning("写入gStore缓存失败: %s", e)
+
+async def get_or_query(db: Session, entity_text: str) -> Tuple[Dict[str, Any], bool]:
+    """
+    获取实体邻域：优先走缓存，未命中时查询gStore并回填
+
+    Returns:
+        (查询结果, 是否来自缓存)
+    """
+    hit = await lookup(db, entity_text)
+    if hit is not None:
+        return hit, True
+
+    # 查询失败直接抛出，不缓存失败结果；合并进来的请求不重复回填
+    result, shared = await _flight.do((_graph_version, normalize_entity(entity_text)), lambda: deadline.hedged("gstore", lambda: query_graph(entity_text)))
+    if not shared:
+        await store(db, entity_text, result)
+    return result, False
+
+async def query_graph(entity_text: str) -> Dict[str, Any]:
+    """
+    查询gStore：标签索引能解析出URI时只查邻域，否则回退到CONTAINS全图查询
+    """
+    uris = label_index.resolve(entity_text)
+    if uris is None:
+        _counters["contains_queries"] += 1
+        return await aquery_entity_nodes(entity_text, raise_errors=True)
+    _counters["neighborhood_queries"] += 1
+    return await aquery_uri_neighborhood(uris, entity_text, raise_errors=True)
+
+def _load_many_from_db(db: Session, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+    now = datetime.utcnow()
+    return {
+        row.entity_key: row.result
+        for row in get_graph_caches(db, keys)
+        if row.graph_version == _graph_version and row.expires_at > now
+    }
+
+def _chunks(items: List[Any], size: int) -> List[List[Any]]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+async def get_or_query_many(db: Session, entity_texts: List[str]) -> Dict[str, Tuple[Optional[Dict[str, Any]], bool]]:
+    """
+    批量获取实体邻域：进程内缓存 -> 一次数据库查询 -> 按 GSTORE_BATCH_SIZE 分组的批量SPARQL，结果批量回填两层缓存
+
+    Returns:
+        {实体文本: (查询结果, 是否来自缓存)}，所在分组查询失败的实体结果为 None（不缓存）
+    """
+    await sync_version(db)
+    results: Dict[str, Tuple[Optional[Dict[str, Any]], bool]] = {}
+    key_to_text: Dict[str, str] = {}
+    for text in entity_texts:
+        key = normalize_entity(text)
+        hit = _memory.get((_graph_version, key))
+        if hit is not None:
+            _counters["memory_hits"] += 1
+            results[text] = (hit, True)
+        else:
+            key_to_text.setdefault(key, text)
+
+    db_hits: Dict[str, Dict[str, Any]] = {}
+    if key_to_text:
+        db_hits = await run_db(_load_many_from_db, db, list(key_to_text))
+        for key, hit in db_hits.items():
+            _counters["db_hits"] += 1
+            _memory.set((_graph_version, key), hit)
+            results[key_to_text[key]] = (hit, True)
+    missing = {key: text for key, text in key_to_text.items() if key not in db_hits}
+
+    # 未命中：按标签索引能否解析分为邻域查询与CONTAINS查询两类，分组并发执行
+    uri_map: Dict[str, List[str]] = {}
+    contains_texts: List[str] = []
+    fetched: Dict[str, Dict[str, Any]] = {}
+    for text in missing.values():
+        _counters["misses"] += 1
+        uris = label_index.resolve(text)
+        if uris is None:
+            contains_texts.append(text)
+        else:
+            uri_map[text] = uris
+
+    calls = []
+    for chunk in _chunks(list(uri_map), GSTORE_BATCH_SIZE):
+        _counters["neighborhood_queries"] += 1
+        calls.append(deadline.hedged(
+            "gstore_batch", lambda chunk=chunk: aquery_neighborhoods_batch({text: uri_map[text] for text in chunk})
+        ))
+    for chunk in _chunks(contains_texts, GSTORE_BATCH_SIZE):
+        _counters["contains_queries"] += 1
+        calls.append(deadline.hedged("gstore_batch", lambda chunk=chunk: aquery_entities_batch(chunk)))
+    for outcome in await asyncio.gather(*calls, return_exceptions=True):
+        if isinstance(outcome, Exception):
+            logger.warning("批量查询gStore失败: %s", outcome)
+            continue
+        fetched.update(outcome)
+
+    version = _graph_version
+    entries = []
+    for key, text in missing.items():
+        result = fetched.get(text)
+        results[text] = (result, False)
+        if result is not None:
+            _memory.set((version, key), result)
+            entries.append({"entity_key": key, "entity_text": text[:255], "result": result})
+    if entries:
+        try:
+            expires_at = datetime.utcnow() + timedelta(seconds=GRAPH_CACHE_DB_TTL)
+            await run_db(save_graph_caches, db, entries, version, expires_at)
+            _counters["stores"] += len(entries)
+        except Exception as e:
+            logger.warning("批量写入gStore缓存失败: %s", e)
+
+    # 归一化后相同的实体文本共用同一结果
+    for text in entity_texts:
+        if text not in results:
+            results[text] = results[key_to_text[normalize_entity(text)]]
+    return results
+
+def _persist_version(db: Session, version: str) -> int:
+    set_graph_version(db, version)
+    return delete_stale_graph_cache(db, version)
+
+async def invalidate(db: Session, new_version: Optional[str] = None) -> Dict[str, Any]:
+    """
+    图数据库重新导入后调用：切换并持久化图版本，清空进程内缓存并删除旧版本的持久化缓存
+    （其他进程在 GRAPH_VERSION_CHECK_INTERVAL 内读取到新版本）
+
+    线程池中只做数据库写入，进程内版本与缓存在事件循环中切换
+    """
+    version = new_version or datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+    deleted = await run_db(_persist_version, db, version)
+    _apply_version(version)
+    _memory.clear()
+    _counters["invalidations"] += 1
+    logger.info("gStore缓存已失效: 新版本=%s, 删除 %d 行", version, deleted)
+    return {"graph_version": version, "deleted": deleted}
+
+def graph_cache_stats() -> Dict[str, Any]:
+    return {
+        "graph_version": _graph_version,
+        **dict(_counters),
+        "memory": _memory.stats(),
+    }
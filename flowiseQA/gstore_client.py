@@ -1,11 +1,14 @@
-import requests
-from typing import Dict, List, Any, Optional
-from config import GSTORE_BASE_URL, GSTORE_USERNAME, GSTORE_PASSWORD, GSTORE_DB_NAME
+import httpx
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Any, Tuple
+from config import GSTORE_BASE_URL, GSTORE_USERNAME, GSTORE_PASSWORD, GSTORE_DB_NAME, GSTORE_TIMEOUT
+from upstream import get_async_client
+import deadline
+import tracing
 import json
 import logging
 
-# 配置日志
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+# 日志级别由入口统一配置；大对象只在DEBUG级别（或本请求开启调试）时才序列化输出
 logger = logging.getLogger(__name__)
 
 def _get_gstore_headers():
@@ -15,156 +18,120 @@ def _get_gstore_headers():
         "Accept": "application/json"
     }
 
-def query_entity_nodes(entity_text: str) -> Dict[str, Any]:
+def _build_entity_sparql(entity_text: str) -> str:
     """
-    查询实体相关的节点和关系 - 通用版本
+    构建实体相关三元组的SPARQL查询语句
+    """
+    # 转义实体文本，防止SPARQL注入
+    escaped_entity_text = entity_text.replace('"', '\\"').replace("'", "\\'")
+    
+    # 构建通用的SPARQL查询语句
+    sparql_query = f"""
+    SELECT DISTINCT ?subject ?predicate ?object ?subjectLabel ?objectLabel ?subjectType ?objectType
+    WHERE {{
+        # 主查询：查找所有三元组
+        ?subject ?predicate ?object .
+    
+        # 获取主体的标签和类型信息
+        OPTIONAL {{ 
+            ?subject <http://www.w3.org/2000/01/rdf-schema#label> ?subjectLabel 
+        }}
+        OPTIONAL {{ 
+            ?subject <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> ?subjectType 
+        }}
+    
+        # 获取客体的标签和类型信息（仅当客体是URI时）
+        OPTIONAL {{ 
+            ?object <http://www.w3.org/2000/01/rdf-schema#label> ?objectLabel 
+            FILTER(isURI(?object))
+        }}
+        OPTIONAL {{ 
+            ?object <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> ?objectType 
+            FILTER(isURI(?object))
+        }}
+    
+        # 过滤条件：查找与目标实体相关的三元组
+        FILTER(
+            # 1. 主体标签包含目标实体
+            (BOUND(?subjectLabel) && (
+                CONTAINS(LCASE(STR(?subjectLabel)), LCASE("{escaped_entity_text}")) ||
+                STR(?subjectLabel) = "{escaped_entity_text}"
+            )) ||
+    
+            # 2. 客体标签包含目标实体
+            (BOUND(?objectLabel) && (
+                CONTAINS(LCASE(STR(?objectLabel)), LCASE("{escaped_entity_text}")) ||
+                STR(?objectLabel) = "{escaped_entity_text}"
+            )) ||
+    
+            # 3. 主体URI包含目标实体
+            CONTAINS(LCASE(STR(?subject)), LCASE("{escaped_entity_text}")) ||
+    
+            # 4. 客体URI包含目标实体（当客体是URI时）
+            (isURI(?object) && CONTAINS(LCASE(STR(?object)), LCASE("{escaped_entity_text}"))) ||
+    
+            # 5. 客体字面量值包含目标实体（当客体是字面量时）
+            (isLiteral(?object) && (
+                CONTAINS(LCASE(STR(?object)), LCASE("{escaped_entity_text}")) ||
+                STR(?object) = "{escaped_entity_text}"
+            ))
+        )
+    }}
+    ORDER BY ?subject ?predicate ?object
+    LIMIT 100
+    """
+    tracing.debug(logger, "生成的SPARQL查询:\n%s", sparql_query)
+    return sparql_query
+
+def _handle_query_response(response: Dict[str, Any], entity_text: str) -> Dict[str, Any]:
+    """
+    处理gstore查询响应，解析为nodes和relations
+    """
+    if response and "results" in response and "bindings" in response["results"]:
+        bindings = response["results"]["bindings"]
+        if tracing.debug_enabled(logger):
+            # 只输出前3条原始结果作为样例
+            tracing.debug(logger, "原始查询结果 %d 条，样例: %s", len(bindings), tracing.LazyJson(bindings[:3]))
+
+        parsed_result = _parse_gstore_response(bindings, entity_text)
+        logger.info("实体 %s 查询完成: %d 条结果, %d 个节点, %d 个关系",
+                    entity_text, len(bindings), len(parsed_result["nodes"]), len(parsed_result["relations"]))
+        return parsed_result
+    else:
+        logger.warning("GStore响应中没有results或bindings字段: %s", tracing.LazyJson(response))
+        return {"nodes": [], "relations": []}
+
+async def aquery_entity_nodes(entity_text: str, raise_errors: bool = False) -> Dict[str, Any]:
+    """
+    查询实体相关的节点和关系 - 异步版本
     
     Args:
         entity_text: 实体文本
+        raise_errors: 查询失败时抛出异常而不是返回空结果（供缓存层区分失败与空结果）
         
     Returns:
         包含nodes和relations的字典
     """
-    print(f"\n=== SPARQL查询开始 ===")
-    print(f"查询实体: '{entity_text}'")
-    
-    logger.info(f"开始查询实体: {entity_text}")
+    logger.info("开始查询实体: %s", entity_text)
     
     try:
-        # 转义实体文本，防止SPARQL注入
-        escaped_entity_text = entity_text.replace('"', '\\"').replace("'", "\\'")
-        print(f"转义后实体: '{escaped_entity_text}'")
-        logger.debug(f"转义后的实体文本: {escaped_entity_text}")
-        
-        # 构建通用的SPARQL查询语句
-        sparql_query = f"""
-        SELECT DISTINCT ?subject ?predicate ?object ?subjectLabel ?objectLabel ?subjectType ?objectType
-        WHERE {{
-            # 主查询：查找所有三元组
-            ?subject ?predicate ?object .
-            
-            # 获取主体的标签和类型信息
-            OPTIONAL {{ 
-                ?subject <http://www.w3.org/2000/01/rdf-schema#label> ?subjectLabel 
-            }}
-            OPTIONAL {{ 
-                ?subject <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> ?subjectType 
-            }}
-            
-            # 获取客体的标签和类型信息（仅当客体是URI时）
-            OPTIONAL {{ 
-                ?object <http://www.w3.org/2000/01/rdf-schema#label> ?objectLabel 
-                FILTER(isURI(?object))
-            }}
-            OPTIONAL {{ 
-                ?object <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> ?objectType 
-                FILTER(isURI(?object))
-            }}
-            
-            # 过滤条件：查找与目标实体相关的三元组
-            FILTER(
-                # 1. 主体标签包含目标实体
-                (BOUND(?subjectLabel) && (
-                    CONTAINS(LCASE(STR(?subjectLabel)), LCASE("{escaped_entity_text}")) ||
-                    STR(?subjectLabel) = "{escaped_entity_text}"
-                )) ||
-                
-                # 2. 客体标签包含目标实体
-                (BOUND(?objectLabel) && (
-                    CONTAINS(LCASE(STR(?objectLabel)), LCASE("{escaped_entity_text}")) ||
-                    STR(?objectLabel) = "{escaped_entity_text}"
-                )) ||
-                
-                # 3. 主体URI包含目标实体
-                CONTAINS(LCASE(STR(?subject)), LCASE("{escaped_entity_text}")) ||
-                
-                # 4. 客体URI包含目标实体（当客体是URI时）
-                (isURI(?object) && CONTAINS(LCASE(STR(?object)), LCASE("{escaped_entity_text}"))) ||
-                
-                # 5. 客体字面量值包含目标实体（当客体是字面量时）
-                (isLiteral(?object) && (
-                    CONTAINS(LCASE(STR(?object)), LCASE("{escaped_entity_text}")) ||
-                    STR(?object) = "{escaped_entity_text}"
-                ))
-            )
-        }}
-        ORDER BY ?subject ?predicate ?object
-        LIMIT 100
-        """
-        
-        print(f"\n--- 生成的SPARQL查询 ---")
-        print(sparql_query)
-        print(f"--- SPARQL查询结束 ---\n")
-        
-        logger.debug(f"生成的SPARQL查询:\n{sparql_query}")
-        
+        sparql_query = _build_entity_sparql(entity_text)
         # 调用gstore查询接口
-        print(f"正在发送请求到GStore...")
-        response = _execute_gstore_query(sparql_query)
-        
-        print(f"GStore响应状态: {'成功' if response else '失败'}")
-        
-        logger.debug(f"GStore响应: {json.dumps(response, indent=2, ensure_ascii=False)}")
-        
-        if response and "results" in response and "bindings" in response["results"]:
-            bindings = response["results"]["bindings"]
-            print(f"原始查询结果数量: {len(bindings)} 条")
-            logger.info(f"查询到 {len(bindings)} 条原始结果")
-            
-            # 打印前3条原始结果作为样例
-            if bindings:
-                print(f"\n--- 前3条原始结果样例 ---")
-                for i, binding in enumerate(bindings[:3]):
-                    print(f"结果 {i+1}: {json.dumps(binding, ensure_ascii=False, indent=2)}")
-                print(f"--- 原始结果样例结束 ---\n")
-            
-            parsed_result = _parse_gstore_response(bindings, entity_text)
-            
-            print(f"解析后节点数量: {len(parsed_result['nodes'])}")
-            print(f"解析后关系数量: {len(parsed_result['relations'])}")
-            
-            # 打印解析后的节点和关系概要
-            if parsed_result['nodes']:
-                print(f"\n--- 解析后的节点概要 ---")
-                for i, node in enumerate(parsed_result['nodes'][:3]):
-                    print(f"节点 {i+1}: ID={node.get('id', 'N/A')}, Label={node.get('label', 'N/A')}")
-                if len(parsed_result['nodes']) > 3:
-                    print(f"... 还有 {len(parsed_result['nodes']) - 3} 个节点")
-                print(f"--- 节点概要结束 ---\n")
-            
-            if parsed_result['relations']:
-                print(f"\n--- 解析后的关系概要 ---")
-                for i, relation in enumerate(parsed_result['relations'][:3]):
-                    print(f"关系 {i+1}: {relation.get('source', 'N/A')} -> {relation.get('relation', 'N/A')} -> {relation.get('target', 'N/A')}")
-                if len(parsed_result['relations']) > 3:
-                    print(f"... 还有 {len(parsed_result['relations']) - 3} 个关系")
-                print(f"--- 关系概要结束 ---\n")
-            
-            logger.info(f"解析后得到 {len(parsed_result['nodes'])} 个节点, {len(parsed_result['relations'])} 个关系")
-            
-            print(f"=== SPARQL查询完成 ===\n")
-            return parsed_result
-        else:
-            print(f"⚠️  GStore响应格式异常: 缺少results或bindings字段")
-            print(f"响应内容: {json.dumps(response, ensure_ascii=False, indent=2) if response else 'None'}")
-            logger.warning("GStore响应中没有results或bindings字段")
-            print(f"=== SPARQL查询完成（无结果） ===\n")
-            return {"nodes": [], "relations": []}
-            
+        response = await _aexecute_gstore_query(sparql_query)
+        return _handle_query_response(response, entity_text)
+
     except Exception as e:
-        print(f"❌ SPARQL查询失败: {e}")
-        logger.error(f"查询gstore失败: {e}", exc_info=True)
-        print(f"=== SPARQL查询失败 ===\n")
+        logger.error("查询gstore失败: %s", e, exc_info=True)
+        if raise_errors:
+            raise
         return {"nodes": [], "relations": []}
 
-def _execute_gstore_query(sparql_query: str) -> Dict[str, Any]:
+async def _aexecute_gstore_query(sparql_query: str) -> Dict[str, Any]:
     """
-    执行gstore SPARQL查询
+    执行gstore SPARQL查询（异步）
     """
     url = f"{GSTORE_BASE_URL}/query"
-    print(f"请求URL: {url}")
-    logger.debug(f"请求URL: {url}")
-    
+
     payload = {
         "operation": "query",
         "username": GSTORE_USERNAME,
@@ -172,69 +139,244 @@ def _execute_gstore_query(sparql_query: str) -> Dict[str, Any]:
         "db_name": GSTORE_DB_NAME,
         "sparql": sparql_query
     }
-    
-    print(f"数据库名称: {GSTORE_DB_NAME}")
-    print(f"用户名: {GSTORE_USERNAME}")
-    
-    logger.debug(f"请求payload: {json.dumps(payload, indent=2, ensure_ascii=False)}")
-    
+
     try:
-        print(f"发送HTTP POST请求...")
-        response = requests.post(
-            url, 
-            json=payload, 
-            headers=_get_gstore_headers(),
-            timeout=30
-        )
-        
-        print(f"HTTP状态码: {response.status_code}")
-        logger.debug(f"HTTP状态码: {response.status_code}")
-        logger.debug(f"响应头: {dict(response.headers)}")
-        
+        with tracing.span("gstore.query"):
+            response = await get_async_client("gstore").post(
+                url,
+                json=payload,
+                headers=_get_gstore_headers(),
+                timeout=deadline.timeout_for(GSTORE_TIMEOUT)
+            )
+
         if response.status_code != 200:
-            print(f"❌ HTTP请求失败，状态码: {response.status_code}")
-            print(f"响应内容: {response.text}")
-        
+            logger.warning("GStore请求失败，状态码: %s, 响应: %.500s", response.status_code, response.text)
+
         response.raise_for_status()
-        
-        response_json = response.json()
-        print(f"✅ 成功获取JSON响应")
-        
-        # 简化的响应概要
-        if isinstance(response_json, dict):
-            if "results" in response_json:
-                bindings_count = len(response_json.get("results", {}).get("bindings", []))
-                print(f"响应包含 {bindings_count} 条绑定结果")
-            else:
-                print(f"响应字段: {list(response_json.keys())}")
-        
-        logger.debug(f"响应JSON: {json.dumps(response_json, indent=2, ensure_ascii=False)}")
-        
-        return response_json
-        
-    except requests.exceptions.RequestException as e:
-        print(f"❌ HTTP请求异常: {e}")
-        logger.error(f"HTTP请求失败: {e}")
+        return response.json()
+
+    except httpx.HTTPError as e:
+        logger.error("HTTP请求失败: %s", e)
         raise
     except json.JSONDecodeError as e:
-        print(f"❌ JSON解析失败: {e}")
-        print(f"原始响应: {response.text}")
-        logger.error(f"JSON解析失败: {e}")
-        logger.error(f"原始响应内容: {response.text}")
+        logger.error("JSON解析失败: %s, 原始响应: %.500s", e, response.text)
         raise
 
+async def afetch_labels(page_size: int = 5000, max_labels: int = 200000) -> List[str]:
+    """
+    分页拉取图数据库中所有 rdfs:label 值（用于构建本地实体词典）
+    """
+    labels: List[str] = []
+    offset = 0
+    while offset < max_labels:
+        sparql_query = (
+            "SELECT DISTINCT ?label WHERE { "
+            "?s <http://www.w3.org/2000/01/rdf-schema#label> ?label "
+            f"}} ORDER BY ?label LIMIT {page_size} OFFSET {offset}"
+        )
+        response = await _aexecute_gstore_query(sparql_query)
+        bindings = (response or {}).get("results", {}).get("bindings", [])
+        labels.extend(b["label"]["value"] for b in bindings if "label" in b)
+        if len(bindings) < page_size:
+            break
+        offset += page_size
+    logger.info("拉取到 %d 个标签", len(labels))
+    return labels
+
+async def afetch_literals(page_size: int = 5000, max_rows: int = 500000) -> Tuple[List[Tuple[str, str]], bool]:
+    """
+    分页拉取 (主体URI, 字面量) 对（含 rdfs:label），用于构建本地标签索引
+
+    Returns:
+        (结果列表, 是否拉取完整)，达到 max_rows 上限时视为不完整
+    """
+    rows: List[Tuple[str, str]] = []
+    offset = 0
+    while offset < max_rows:
+        sparql_query = (
+            "SELECT ?s ?o WHERE { ?s ?p ?o . FILTER(isLiteral(?o)) } "
+            f"ORDER BY ?s ?o LIMIT {page_size} OFFSET {offset}"
+        )
+        response = await _aexecute_gstore_query(sparql_query)
+        bindings = (response or {}).get("results", {}).get("bindings", [])
+        rows.extend((b["s"]["value"], b["o"]["value"]) for b in bindings if "s" in b and "o" in b)
+        if len(bindings) < page_size:
+            return rows, True
+        offset += page_size
+    return rows, False
+
+def _is_safe_uri(uri: str) -> bool:
+    return bool(uri) and not any(c in uri for c in '<>"{}|^`\\ \t\r\n')
+
+def _build_neighborhood_sparql(uris: List[str], limit: int = 100) -> str:
+    """
+    构建绑定URI的邻域查询：只展开给定节点的出边与入边，不做全图过滤
+    """
+    values = " ".join(f"<{uri}>" for uri in uris if _is_safe_uri(uri))
+    return f"""
+    SELECT DISTINCT ?subject ?predicate ?object ?subjectLabel ?objectLabel ?subjectType ?objectType
+    WHERE {{
+        {{ VALUES ?subject {{ {values} }} ?subject ?predicate ?object . }}
+        UNION
+        {{ VALUES ?object {{ {values} }} ?subject ?predicate ?object . }}
+        OPTIONAL {{ ?subject <http://www.w3.org/2000/01/rdf-schema#label> ?subjectLabel }}
+        OPTIONAL {{ ?subject <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> ?subjectType }}
+        OPTIONAL {{
+            ?object <http://www.w3.org/2000/01/rdf-schema#label> ?objectLabel
+            FILTER(isURI(?object))
+        }}
+        OPTIONAL {{
+            ?object <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> ?objectType
+            FILTER(isURI(?object))
+        }}
+    }}
+    ORDER BY ?subject ?predicate ?object
+    LIMIT {limit}
+    """
+
+async def aquery_uri_neighborhood(uris: List[str], entity_text: str, raise_errors: bool = False) -> Dict[str, Any]:
+    """
+    按已解析出的URI查询邻域节点和关系（替代按文本CONTAINS全图扫描）
+    """
+    logger.info("按URI查询实体邻域: %s -> %d 个URI", entity_text, len(uris))
+    try:
+        response = await _aexecute_gstore_query(_build_neighborhood_sparql(uris))
+        return _handle_query_response(response, entity_text)
+    except Exception as e:
+        logger.error("查询gstore失败: %s", e, exc_info=True)
+        if raise_errors:
+            raise
+        return {"nodes": [], "relations": []}
+
+# 单个实体最多返回的三元组数（与单实体查询的 LIMIT 一致）
+_ENTITY_ROW_LIMIT = 100
+
+def _escape_literal(text: str) -> str:
+    return text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ").replace("\r", " ")
+
+def _build_batch_entity_sparql(entity_texts: List[str]) -> str:
+    """
+    构建多实体的CONTAINS查询：用 VALUES ?needle 一次匹配多个实体文本，结果中的 ?needle 标明所属实体
+    """
+    values = " ".join(f'"{_escape_literal(text)}"' for text in entity_texts)
+    return f"""
+    SELECT DISTINCT ?needle ?subject ?predicate ?object ?subjectLabel ?objectLabel ?subjectType ?objectType
+    WHERE {{
+        VALUES ?needle {{ {values} }}
+        ?subject ?predicate ?object .
+        OPTIONAL {{ ?subject <http://www.w3.org/2000/01/rdf-schema#label> ?subjectLabel }}
+        OPTIONAL {{ ?subject <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> ?subjectType }}
+        OPTIONAL {{
+            ?object <http://www.w3.org/2000/01/rdf-schema#label> ?objectLabel
+            FILTER(isURI(?object))
+        }}
+        OPTIONAL {{
+            ?object <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> ?objectType
+            FILTER(isURI(?object))
+        }}
+        FILTER(
+            (BOUND(?subjectLabel) && CONTAINS(LCASE(STR(?subjectLabel)), LCASE(?needle))) ||
+            (BOUND(?objectLabel) && CONTAINS(LCASE(STR(?objectLabel)), LCASE(?needle))) ||
+            CONTAINS(LCASE(STR(?subject)), LCASE(?needle)) ||
+            (isURI(?object) && CONTAINS(LCASE(STR(?object)), LCASE(?needle))) ||
+            (isLiteral(?object) && CONTAINS(LCASE(STR(?object)), LCASE(?needle)))
+        )
+    }}
+    ORDER BY ?needle ?subject ?predicate ?object
+    LIMIT {_ENTITY_ROW_LIMIT * len(entity_texts)}
+    """
+
+def _bindings_of(response: Dict[str, Any]) -> List[Dict]:
+    if response and "results" in response and "bindings" in response["results"]:
+        return response["results"]["bindings"]
+    logger.warning("GStore响应中没有results或bindings字段")
+    return []
+
+async def _complete_truncated(
+        grouped: Dict[str, List[Dict]],
+        truncated: bool,
+        requery: Callable[[str], Awaitable[Dict[str, Any]]]
+) -> Dict[str, Dict[str, Any]]:
+    """
+    批量查询命中全局 LIMIT 时，结果不足单实体上限的实体可能被排在前面的实体挤占，逐个补查；
+    补查失败的实体不出现在返回结果中（调用方视为未查到，不缓存）
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    pending: List[str] = []
+    for text, bindings in grouped.items():
+        if truncated and len(bindings) < _ENTITY_ROW_LIMIT:
+            pending.append(text)
+        else:
+            results[text] = _parse_gstore_response(bindings, text)
+    if pending:
+        logger.info("批量查询结果达到上限，逐个补查 %d 个实体", len(pending))
+        outcomes = await asyncio.gather(*(requery(text) for text in pending), return_exceptions=True)
+        for text, outcome in zip(pending, outcomes):
+            if isinstance(outcome, Exception):
+                logger.warning("补查实体 %s 失败: %s", text, outcome)
+            else:
+                results[text] = outcome
+    return results
+
+async def aquery_entities_batch(entity_texts: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    一次SPARQL查询多个实体（CONTAINS匹配），按 ?needle 拆分结果
+
+    Returns:
+        {实体文本: {"nodes": [...], "relations": [...]}}，批量查询失败时抛出异常；
+        结果被全局 LIMIT 截断且补查失败的实体不在返回结果中
+    """
+    response = await _aexecute_gstore_query(_build_batch_entity_sparql(entity_texts))
+    bindings = _bindings_of(response)
+    grouped: Dict[str, List[Dict]] = {text: [] for text in entity_texts}
+    for binding in bindings:
+        needle = binding.get("needle", {}).get("value")
+        if needle in grouped and len(grouped[needle]) < _ENTITY_ROW_LIMIT:
+            grouped[needle].append(binding)
+    truncated = len(bindings) >= _ENTITY_ROW_LIMIT * len(entity_texts)
+    return await _complete_truncated(grouped, truncated, lambda text: aquery_entity_nodes(text, raise_errors=True))
+
+async def aquery_neighborhoods_batch(uri_map: Dict[str, List[str]]) -> Dict[str, Dict[str, Any]]:
+    """
+    一次SPARQL查询多个实体的URI邻域，按主体/客体所属URI拆分结果
+
+    Args:
+        uri_map: {实体文本: [候选URI, ...]}
+
+    Returns:
+        {实体文本: {"nodes": [...], "relations": [...]}}，批量查询失败时抛出异常；
+        结果被全局 LIMIT 截断且补查失败的实体不在返回结果中
+    """
+    all_uris = sorted({uri for uris in uri_map.values() for uri in uris})
+    limit = _ENTITY_ROW_LIMIT * len(uri_map)
+    response = await _aexecute_gstore_query(_build_neighborhood_sparql(all_uris, limit=limit))
+    bindings = _bindings_of(response)
+    owners: Dict[str, List[str]] = {}
+    for text, uris in uri_map.items():
+        for uri in uris:
+            owners.setdefault(uri, []).append(text)
+
+    grouped: Dict[str, List[Dict]] = {text: [] for text in uri_map}
+    for binding in bindings:
+        matched = set()
+        for var in ("subject", "object"):
+            matched.update(owners.get(binding.get(var, {}).get("value"), []))
+        for text in matched:
+            if len(grouped[text]) < _ENTITY_ROW_LIMIT:
+                grouped[text].append(binding)
+    return await _complete_truncated(
+        grouped, len(bindings) >= limit,
+        lambda text: aquery_uri_neighborhood(uri_map[text], text, raise_errors=True),
+    )
+
 def _parse_gstore_response(bindings: List[Dict], entity_text: str) -> Dict[str, Any]:
     """
     解析gstore查询响应，提取节点和关系 - 增强版本
     """
-    logger.debug(f"开始解析 {len(bindings)} 条绑定结果")
-    
     nodes = {}
     relations = []
     
-    for i, binding in enumerate(bindings):
-        logger.debug(f"处理第 {i+1} 条绑定: {binding}")
-        
+    for binding in bindings:
         # 提取主体节点
         if "subject" in binding:
             subject_uri = binding["subject"]["value"]
@@ -243,7 +385,6 @@ def _parse_gstore_response(bindings: List[Dict], entity_text: str) -> Dict[str,
             subject_label = None
             if "subjectLabel" in binding:
                 subject_label = binding["subjectLabel"]["value"]
-                logger.debug(f"找到主体标签: {subject_label}")
             else:
                 # 从URI提取标签
                 if "#" in subject_uri:
@@ -252,7 +393,6 @@ def _parse_gstore_response(bindings: List[Dict], entity_text: str) -> Dict[str,
                     subject_label = subject_uri.split("/")[-1]
                 else:
                     subject_label = subject_uri
-                logger.debug(f"从URI提取主体标签: {subject_label}")
             
             # 获取主体类型
             subject_type = binding.get("subjectType", {}).get("value", "")
@@ -264,14 +404,12 @@ def _parse_gstore_response(bindings: List[Dict], entity_text: str) -> Dict[str,
                     "type": subject_type,
                     "properties": {}
                 }
-                logger.debug(f"添加主体节点: {subject_uri} -> {subject_label}")
         
         # 提取客体节点（仅当客体是URI时）
         if "object" in binding:
             object_value = binding["object"]["value"]
             object_type_info = binding["object"].get("type", "")
             
-            logger.debug(f"处理客体: {object_value}, 类型: {object_type_info}")
             
             # 只为URI类型的客体创建节点
             if object_type_info == "uri" or object_value.startswith("http"):
@@ -279,7 +417,6 @@ def _parse_gstore_response(bindings: List[Dict], entity_text: str) -> Dict[str,
                 object_label = None
                 if "objectLabel" in binding:
                     object_label = binding["objectLabel"]["value"]
-                    logger.debug(f"找到客体标签: {object_label}")
                 else:
                     # 从URI提取标签
                     if "#" in object_value:
@@ -288,7 +425,6 @@ def _parse_gstore_response(bindings: List[Dict], entity_text: str) -> Dict[str,
                         object_label = object_value.split("/")[-1]
                     else:
                         object_label = object_value
-                    logger.debug(f"从URI提取客体标签: {object_label}")
                 
                 # 获取客体类型
                 object_type = binding.get("objectType", {}).get("value", "")
@@ -300,7 +436,6 @@ def _parse_gstore_response(bindings: List[Dict], entity_text: str) -> Dict[str,
                         "type": object_type,
                         "properties": {}
                     }
-                    logger.debug(f"添加客体节点: {object_value} -> {object_label}")
         
         # 提取关系
         if "subject" in binding and "predicate" in binding and "object" in binding:
@@ -333,49 +468,10 @@ def _parse_gstore_response(bindings: List[Dict], entity_text: str) -> Dict[str,
                 relation["target_type"] = "uri"
             
             relations.append(relation)
-            logger.debug(f"添加关系: {binding['subject']['value']} -> {predicate_label} -> {object_value}")
     
-    logger.info(f"解析完成: {len(nodes)} 个节点, {len(relations)} 个关系")
+    tracing.debug(logger, "解析完成: %d 条绑定, %d 个节点, %d 个关系", len(bindings), len(nodes), len(relations))
     
     return {
         "nodes": list(nodes.values()),
         "relations": relations
     }
-
-def test_gstore_connection() -> bool:
-    """
-    测试gstore连接
-    """
-    logger.info("测试GStore连接...")
-    
-    try:
-        url = f"{GSTORE_BASE_URL}/query"
-        payload = {
-            "operation": "query",
-            "username": GSTORE_USERNAME,
-            "password": GSTORE_PASSWORD,
-            "db_name": GSTORE_DB_NAME,
-            "sparql": "SELECT ?s ?p ?o WHERE { ?s ?p ?o } LIMIT 1"
-        }
-        
-        logger.debug(f"连接测试URL: {url}")
-        logger.debug(f"连接测试payload: {json.dumps(payload, indent=2, ensure_ascii=False)}")
-        
-        response = requests.post(
-            url, 
-            json=payload, 
-            headers=_get_gstore_headers(),
-            timeout=10
-        )
-        
-        logger.debug(f"连接测试响应状态: {response.status_code}")
-        logger.debug(f"连接测试响应内容: {response.text}")
-        
-        success = response.status_code == 200
-        logger.info(f"GStore连接测试结果: {'成功' if success else '失败'}")
-        
-        return success
-        
-    except Exception as e:
-        logger.error(f"GStore连接测试失败: {e}", exc_info=True)
-        return False
\ No newline at end of file
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+from cache import TTLCache
+from config import (
+    INTENT_LOCAL_ENABLED, INTENT_CACHE_SIZE, INTENT_CACHE_TTL,
+    INTENT_LOCAL_MIN_SIMILARITY, INTENT_LOCAL_MIN_MARGIN,
+    INTENT_TRAIN_LIMIT, INTENT_RETRAIN_INTERVAL
+)
+from crud import get_first_turn_intents
+from executors import run_background
+from ollama_client import arequest_intent, DEFAULT_INTENT_ID
+import singleflight
+import deadline
+
+logger = logging.getLogger(__name__)
+
+# 意图解析层：归一化问题缓存 -> 关键词规则 -> TF-IDF最近质心分类器 -> Ollama
+# 常见问题在本地即可完成路由，只有本地置信度不足时才调用基座模型
+
+_intent_cache = TTLCache(INTENT_CACHE_SIZE, INTENT_CACHE_TTL, name="intent")
+# 归一化后相同的并发问题共享一次Ollama调用
+_flight = singleflight.group("ollama_intent")
+
+# 各意图的关键词（仅在只命中一个意图时直接采用）
+INTENT_KEYWORDS: Dict[int, List[str]] = {
+    1: ["搭配", "组合", "协同", "配合", "配套", "编组"],
+    2: ["方案", "决策", "策略", "优先级", "怎么选", "如何选", "如何制定", "规划"],
+    3: ["实时", "战况", "态势", "部署", "敌情", "敌方", "动态", "当前"],
+    4: ["维修", "修理", "怎么修", "保养", "补给", "故障", "检修", "更换", "维护"],
+}
+
+_PUNCT_RE = re.compile(r"[\s\W_]+", re.UNICODE)
+
+def normalize_question(question: str) -> str:
+    """
+    问题归一化：全半角统一、小写、去除空白与标点
+    """
+    text = unicodedata.normalize("NFKC", question).lower()
+    return _PUNCT_RE.sub("", text)
+
+def _match_keywords(normalized: str) -> Optional[int]:
+    matched = [intent_id for intent_id, words in INTENT_KEYWORDS.items() if any(w in normalized for w in words)]
+    return matched[0] if len(matched) == 1 else None
+
+def _ngrams(normalized: str) -> Counter:
+    grams = Counter(normalized)
+    grams.update(normalized[i:i + 2] for i in range(len(normalized) - 1))
+    return grams
+
+class CentroidClassifier:
+    """
+    基于字符 1-2 gram TF-IDF 的最近质心分类器
+    """
+    def __init__(self):
+        self.idf: Dict[str, float] = {}
+        self.centroids: Dict[int, Dict[str, float]] = {}
+        self.samples = 0
+
+    def _vectorize(self, normalized: str) -> Dict[str, float]:
+        tf = _ngrams(normalized)
+        vec = {g: (1 + math.log(c)) * self.idf[g] for g, c in tf.items() if g in self.idf}
+        norm = math.sqrt(sum(v * v for v in vec.values()))
+        return {g: v / norm for g, v in vec.items()} if norm else {}
+
+    def fit(self, samples: List[Tuple[str, int]]) -> None:
+        docs = [(_ngrams(q), intent_id) for q, intent_id in samples if q]
+        df = Counter()
+        for grams, _ in docs:
+            df.update(grams.keys())
+        n = len(docs)
+        self.idf = {g: math.log((1 + n) / (1 + c)) + 1 for g, c in df.items()}
+
+        sums: Dict[int, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        for q, intent_id in samples:
+            for g, v in self._vectorize(q).items():
+                sums[intent_id][g] += v
+        centroids = {}
+        for intent_id, vec in sums.items():
+            norm = math.sqrt(sum(v * v for v in vec.values()))
+            if norm:
+                centroids[intent_id] = {g: v / norm for g, v in vec.items()}
+        self.centroids = centroids
+        self.samples = n
+
+    def predict(self, normalized: str) -> Tuple[Optional[int], float, float]:
+        """
+        Returns:
+            (意图ID, 最高相似度, 与次高相似度的差值)
+        """
+        if not self.centroids:
+            return None, 0.0, 0.0
+        vec = self._vectorize(normalized)
+        scores = sorted(
+            ((sum(v * centroid.get(g, 0.0) for g, v in vec.items()), intent_id)
+             for intent_id, centroid in self.centroids.items()),
+            reverse=True
+        )
+        best_score, best_intent = scores[0]
+        second_score = scores[1][0] if len(scores) > 1 else 0.0
+        return best_intent, best_score, best_score - second_score
+
+_classifier = CentroidClassifier()
+_source_counts: Counter = Counter()
+
+# 训练样本只取可信的路由来源：Ollama 识别结果与唯一命中的关键词规则。
+# 本地分类器自身的预测不参与训练，避免分类器不断强化自己的错误
+TRAINING_SOURCES = ("ollama", "rules")
+
+def train_from_history(db) -> int:
+    """
+    使用各对话首轮问题及其固定的意图训练本地分类器，返回样本数
+
+    只有首轮问题经过意图识别（后续轮次沿用固定的意图，如“那第二步呢”不能作为该意图的样本）
+    """
+    samples = [
+        (normalize_question(question), int(intent_id))
+        for question, intent_id in get_first_turn_intents(db, TRAINING_SOURCES, INTENT_TRAIN_LIMIT)
+    ]
+
+    classifier = CentroidClassifier()
+    classifier.fit(samples)
+    global _classifier
+    _classifier = classifier
+    logger.info("意图分类器训练完成: %d 条样本, %d 个意图", classifier.samples, len(classifier.centroids))
+    return classifier.samples
+
+def classify_locally(question: str) -> Tuple[Optional[int], str]:
+    """
+    本地分类：返回 (意图ID, 来源)，置信度不足时意图ID为None
+    """
+    normalized = normalize_question(question)
+    intent_id = _match_keywords(normalized)
+    if intent_id is not None:
+        return intent_id, "rules"
+    intent_id, score, margin = _classifier.predict(normalized)
+    if intent_id is not None and score >= INTENT_LOCAL_MIN_SIMILARITY and margin >= INTENT_LOCAL_MIN_MARGIN:
+        return intent_id, "centroid"
+    return None, "none"
+
+async def resolve_intent(question: str) -> Tuple[int, str]:
+    """
+    解析问题意图：依次尝试缓存、本地分类器，最后调用Ollama
+
+    Returns:
+        (意图ID, 来源)，来源为 rules / centroid / ollama / default；命中缓存时返回首次解析时的来源
+    """
+    key = normalize_question(question)
+    cached = _intent_cache.get(key)
+    if cached is not None:
+        _source_counts["cache"] += 1
+        return cached
+
+    intent_id, source = None, "ollama"
+    if INTENT_LOCAL_ENABLED:
+        intent_id, source = classify_locally(question)
+    if intent_id is None:
+        source = "ollama"
+        try:
+            intent_id, _ = await _flight.do(key or question, lambda: deadline.hedged("ollama_intent", lambda: arequest_intent(question)))
+        except Exception as e:
+            # 识别失败不写缓存，下次同样的问题仍会重新识别
+            logger.warning("意图识别失败: %s，默认使用意图ID=%d", e, DEFAULT_INTENT_ID)
+            _source_counts["default"] += 1
+            return DEFAULT_INTENT_ID, "default"
+
+    _source_counts[source] += 1
+    logger.debug("意图解析: intent_id=%s source=%s", intent_id, source)
+    if key:
+        _intent_cache.set(key, (intent_id, source))
+    return intent_id, source
+
+def resolver_stats() -> Dict[str, object]:
+    return {
+        "sources": dict(_source_counts),
+        "cache": _intent_cache.stats(),
+        "classifier_samples": _classifier.samples,
+    }
+
+async def retrain_periodically(session_factory) -> None:
+    """
+    后台任务：定期用历史问答重新训练本地分类器
+    """
+    while True:
+        db = session_factory()
+        try:
+            await run_background(train_from_history, db)
+        except Exception as e:
+            logger.warning("意图分类器训练失败: %s", e)
+        finally:
+            await run_background(db.close)
+        await asyncio.sleep(INTENT_RETRAIN_INTERVAL)
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from config import KB_CACHE_TTL, KB_CACHE_STALE_TTL
+from knowledge_base_client import aget_all_knowledge_bases, aget_knowledge_base_by_id
+from schemas import KnowledgeBaseInfo, KnowledgeBaseFile
+
+logger = logging.getLogger(__name__)
+
+# 知识库元数据缓存（stale-while-revalidate）：
+#   年龄 < KB_CACHE_TTL              直接返回
+#   KB_CACHE_TTL <= 年龄 < STALE_TTL  返回旧快照，同时在后台刷新（同一时刻只有一个刷新任务）
+#   更旧或尚无快照                    等待刷新；刷新失败但有旧快照时仍返回旧快照
+# 快照中预先构建好 KnowledgeBaseInfo / KnowledgeBaseFile 模型以及跨 loader 展平的文件索引，
+# 分页与按文件名/状态过滤都在内存中完成
+
+@dataclass
+class KnowledgeBaseSnapshot:
+    raw: List[Dict[str, Any]]
+    infos: List[KnowledgeBaseInfo]
+    by_id: Dict[str, KnowledgeBaseInfo]
+    files: Dict[str, List[KnowledgeBaseFile]]  # kb_id -> 全部 loader 的文件
+    loaded_at: float = field(default_factory=time.monotonic)
+
+    def age(self) -> float:
+        return time.monotonic() - self.loaded_at
+
+def _build_file(file_data: Dict[str, Any]) -> KnowledgeBaseFile:
+    return KnowledgeBaseFile(
+        id=file_data.get("id", ""),
+        name=file_data.get("name", ""),
+        mimePrefix=file_data.get("mimePrefix", ""),
+        size=file_data.get("size", 0),
+        status=file_data.get("status", ""),
+        uploaded=file_data.get("uploaded", "")
+    )
+
+def _build_info(kb_data: Dict[str, Any]) -> KnowledgeBaseInfo:
+    loaders = []
+    for loader_data in kb_data.get("loaders", []):
+        loaders.append({
+            "id": loader_data.get("id", ""),
+            "loaderId": loader_data.get("loaderId", ""),
+            "loaderName": loader_data.get("loaderName", ""),
+            "loaderConfig": loader_data.get("loaderConfig", {}),
+            "splitterId": loader_data.get("splitterId", ""),
+            "splitterName": loader_data.get("splitterName", ""),
+            "splitterConfig": loader_data.get("splitterConfig", {}),
+            "totalChunks": loader_data.get("totalChunks", 0),
+            "totalChars": loader_data.get("totalChars", 0),
+            "status": loader_data.get("status", ""),
+            "files": [_build_file(f) for f in loader_data.get("files", [])],
+            "source": loader_data.get("source", "")
+        })
+
+    vector_store_config = None
+    if kb_data.get("vectorStoreConfig"):
+        vector_store_config = {
+            "config": kb_data["vectorStoreConfig"].get("config", {}),
+            "name": kb_data["vectorStoreConfig"].get("name", "")
+        }
+
+    embedding_config = None
+    if kb_data.get("embeddingConfig"):
+        embedding_config = {
+            "config": kb_data["embeddingConfig"].get("config", {}),
+            "name": kb_data["embeddingConfig"].get("name", "")
+        }
+
+    return KnowledgeBaseInfo(
+        id=kb_data.get("id", ""),
+        name=kb_data.get("name", ""),
+        description=kb_data.get("description", ""),
+        loaders=loaders,
+        whereUsed=kb_data.get("whereUsed", []),
+        createdDate=kb_data.get("createdDate", ""),
+        updatedDate=kb_data.get("updatedDate", ""),
+        status=kb_data.get("status", ""),
+        vectorStoreConfig=vector_store_config,
+        embeddingConfig=embedding_config,
+        recordManagerConfig=kb_data.get("recordManagerConfig"),
+        workspaceId=kb_data.get("workspaceId", ""),
+        totalChars=kb_data.get("totalChars", 0),
+        totalChunks=kb_data.get("totalChunks", 0)
+    )
+
+def build_snapshot(knowledge_bases: List[Dict[str, Any]]) -> KnowledgeBaseSnapshot:
+    infos = []
+    for kb_data in knowledge_bases:
+        try:
+            infos.append(_build_info(kb_data))
+        except Exception as e:
+            logger.warning("处理知识库数据失败: %s", e)
+    return KnowledgeBaseSnapshot(
+        raw=knowledge_bases,
+        infos=infos,
+        by_id={info.id: info for info in infos},
+        files={info.id: [f for loader in info.loaders for f in loader.files] for info in infos},
+    )
+
+_snapshot: Optional[KnowledgeBaseSnapshot] = None
+_refresh_task: Optional[asyncio.Task] = None
+_counters: Dict[str, int] = defaultdict(int)
+
+async def _refresh() -> KnowledgeBaseSnapshot:
+    global _snapshot
+    try:
+        snapshot = build_snapshot(await aget_all_knowledge_bases())
+    except Exception:
+        _counters["refresh_errors"] += 1
+        raise
+    _snapshot = snapshot
+    _counters["refreshes"] += 1
+    return snapshot
+
+def _ensure_refresh() -> asyncio.Task:
+    """
+    启动（或复用正在进行的）刷新任务，并发请求共享同一次Flowise调用
+    """
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(_refresh())
+        # 后台刷新的异常在这里消费掉，避免 "Task exception was never retrieved"
+        _refresh_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return _refresh_task
+
+async def get_snapshot() -> KnowledgeBaseSnapshot:
+    snapshot = _snapshot
+    if snapshot is not None:
+        age = snapshot.age()
+        if age < KB_CACHE_TTL:
+            _counters["fresh_hits"] += 1
+            return snapshot
+        if age < KB_CACHE_STALE_TTL:
+            _counters["stale_hits"] += 1
+            _ensure_refresh()
+            return snapshot
+
+    _counters["misses"] += 1
+    try:
+        return await asyncio.shield(_ensure_refresh())
+    except Exception as e:
+        if snapshot is None:
+            raise
+        logger.warning("刷新知识库缓存失败，返回旧数据: %s", e)
+        return snapshot
+
+async def get_knowledge_base_files(kb_id: str) -> Optional[tuple]:
+    """
+    返回 (知识库信息, 展平的文件列表)；缓存中没有该知识库时直接查询Flowise（可能是刚创建的），
+    并在后台刷新缓存。知识库不存在时返回None
+    """
+    snapshot = await get_snapshot()
+    info = snapshot.by_id.get(kb_id)
+    if info is not None:
+        return info, snapshot.files[kb_id]
+
+    _counters["detail_fallbacks"] += 1
+    kb_data = await aget_knowledge_base_by_id(kb_id)
+    if not kb_data:
+        return None
+    _ensure_refresh()
+    info = _build_info(kb_data)
+    return info, [f for loader in info.loaders for f in loader.files]
+
+def invalidate() -> None:
+    global _snapshot
+    _snapshot = None
+
+def kb_cache_stats() -> Dict[str, Any]:
+    snapshot = _snapshot
+    return {
+        **dict(_counters),
+        "knowledge_bases": len(snapshot.infos) if snapshot else 0,
+        "files": sum(len(files) for files in snapshot.files.values()) if snapshot else 0,
+        "age_seconds": round(snapshot.age(), 1) if snapshot else None,
+    }
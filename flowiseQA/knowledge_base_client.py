@@ -1,31 +1,57 @@
-import requests
 from typing import List, Dict, Any
-from config import FLOWISE_BASE_URL, FLOWISE_API_KEY
+from config import FLOWISE_BASE_URL, FLOWISE_API_KEY, FLOWISE_KB_TIMEOUT
+from upstream import get_async_client
+import singleflight
+import httpx
+import logging
 
-def get_all_knowledge_bases() -> List[Dict[str, Any]]:
-    """
-    调用Flowise API获取所有知识库
-    """
-    url = f"{FLOWISE_BASE_URL}/api/v1/document-store/store"
-    
-    headers = {
+logger = logging.getLogger(__name__)
+
+def _kb_headers() -> Dict[str, str]:
+    return {
         "Authorization": f"Bearer {FLOWISE_API_KEY}",
         "Content-Type": "application/json"
     }
-    
-    try:
-        response = requests.get(url, headers=headers, timeout=30)
+
+# 相同URL的并发知识库请求共享一次Flowise调用
+_flight = singleflight.group("knowledge_base")
+
+async def _aget_json(url: str) -> Any:
+    async def fetch():
+        response = await get_async_client("flowise").get(url, headers=_kb_headers(), timeout=FLOWISE_KB_TIMEOUT)
         response.raise_for_status()
-        
-        data = response.json()
-        if isinstance(data, list):
-            return data
-        else:
-            return []
-            
-    except requests.exceptions.RequestException as e:
-        print(f"调用Flowise知识库API失败: {e}")
+        return response.json()
+
+    data, _ = await _flight.do(url, fetch)
+    return data
+
+async def aget_all_knowledge_bases() -> List[Dict[str, Any]]:
+    """
+    调用Flowise API获取所有知识库（异步）
+    """
+    url = f"{FLOWISE_BASE_URL}/api/v1/document-store/store"
+
+    try:
+        data = await _aget_json(url)
+        return data if isinstance(data, list) else []
+
+    except httpx.HTTPError as e:
+        logger.warning("调用Flowise知识库API失败: %s", e)
         raise Exception(f"获取知识库列表失败: {str(e)}")
     except Exception as e:
-        print(f"解析知识库API响应失败: {e}")
-        raise Exception(f"解析知识库数据失败: {str(e)}")
\ No newline at end of file
+        logger.warning("解析知识库API响应失败: %s", e)
+        raise Exception(f"解析知识库数据失败: {str(e)}")
+
+async def aget_knowledge_base_by_id(kb_id: str) -> Dict[str, Any]:
+    """
+    调用Flowise API获取指定知识库详情（异步）
+    """
+    url = f"{FLOWISE_BASE_URL}/api/v1/document-store/store/{kb_id}"
+
+    try:
+        data = await _aget_json(url)
+        return data if isinstance(data, dict) else {}
+
+    except Exception as e:
+        logger.warning("获取知识库详情失败: %s", e)
+        raise Exception(f"获取知识库详情失败: {str(e)}")
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+from config import (
+    LABEL_INDEX_ENABLED, LABEL_INDEX_REFRESH_INTERVAL, LABEL_INDEX_PAGE_SIZE,
+    LABEL_INDEX_MAX_ROWS, LABEL_INDEX_MAX_URIS
+)
+from executors import run_background
+from gstore_client import afetch_literals
+
+logger = logging.getLogger(__name__)
+
+# 标签索引：定期从gStore同步 (URI, 标签/字面量)，在本地建立二元组倒排索引，
+# 支持中文子串匹配（与原SPARQL中 CONTAINS(LCASE(...)) 语义一致），把实体文本解析为候选URI。
+# 解析成功后 gStore 只需执行绑定URI的邻域查询，不再全图扫描
+
+def _local_name(uri: str) -> str:
+    if "#" in uri:
+        return uri.split("#")[-1]
+    if "/" in uri:
+        return uri.rstrip("/").split("/")[-1]
+    return uri
+
+def _bigrams(text: str) -> List[str]:
+    return [text[i:i + 2] for i in range(len(text) - 1)]
+
+class LabelIndex:
+    """
+    二元组倒排索引：文档为 (URI, 小写文本)，查询时对所有二元组的倒排表求交，再做子串校验
+    """
+    def __init__(self, rows: Iterable[Tuple[str, str]], complete: bool = True):
+        self.uris: List[str] = []
+        self.texts: List[str] = []
+        self.complete = complete
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        seen = set()
+        subjects = set()
+        for uri, text in rows:
+            subjects.add(uri)
+            self._add(uri, text, seen)
+        # 原查询还会匹配URI本身，这里把URI末段也作为文本建索引
+        for uri in subjects:
+            self._add(uri, _local_name(uri), seen)
+        self._postings = dict(self._postings)
+
+    def _add(self, uri: str, text: str, seen: set) -> None:
+        text = (text or "").strip().lower()
+        if not text or (uri, text) in seen:
+            return
+        seen.add((uri, text))
+        doc_id = len(self.texts)
+        self.uris.append(uri)
+        self.texts.append(text)
+        for gram in set(_bigrams(text)):
+            self._postings[gram].append(doc_id)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def search(self, entity_text: str, limit: int) -> Optional[List[str]]:
+        """
+        返回包含实体文本的文档对应的URI（完全相等的优先，其次文本较短的），
+        查询文本不足两个字符时返回None（无法用二元组索引）
+        """
+        query = entity_text.strip().lower()
+        grams = set(_bigrams(query))
+        if not grams:
+            return None
+
+        postings = []
+        for gram in grams:
+            docs = self._postings.get(gram)
+            if not docs:
+                return []
+            postings.append(docs)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for docs in postings[1:]:
+            candidates.intersection_update(docs)
+            if not candidates:
+                return []
+
+        matches = sorted(
+            (doc_id for doc_id in candidates if query in self.texts[doc_id]),
+            key=lambda doc_id: (self.texts[doc_id] != query, len(self.texts[doc_id]), doc_id),
+        )
+        uris: List[str] = []
+        for doc_id in matches:
+            uri = self.uris[doc_id]
+            if uri not in uris:
+                uris.append(uri)
+                if len(uris) >= limit:
+                    break
+        return uris
+
+_index: Optional[LabelIndex] = None
+_synced_at: Optional[float] = None
+_lookups: Dict[str, int] = defaultdict(int)
+
+def is_ready() -> bool:
+    return LABEL_INDEX_ENABLED and _index is not None and len(_index) > 0
+
+def resolve(entity_text: str) -> Optional[List[str]]:
+    """
+    把实体文本解析为候选URI
+
+    Returns:
+        URI列表；None 表示索引不可用或未命中（调用方应回退到CONTAINS查询）。
+        索引只覆盖同步时刻的字面量，未命中不能证明图中没有匹配，因此不返回空列表
+    """
+    index = _index
+    if not is_ready():
+        _lookups["unavailable"] += 1
+        return None
+    uris = index.search(entity_text, LABEL_INDEX_MAX_URIS)
+    if not uris:
+        _lookups["fallback"] += 1
+        return None
+    _lookups["resolved"] += 1
+    return uris
+
+async def refresh_index() -> int:
+    """
+    从gStore重新同步并重建索引，返回文档数
+    """
+    global _index, _synced_at
+    rows, complete = await afetch_literals(LABEL_INDEX_PAGE_SIZE, LABEL_INDEX_MAX_ROWS)
+    index = await run_background(LabelIndex, rows, complete)
+    _index = index
+    _synced_at = time.time()
+    logger.info("标签索引已更新: %d 条文本, 完整=%s", len(index), complete)
+    return len(index)
+
+async def refresh_periodically() -> None:
+    """
+    后台任务：定期同步标签索引
+    """
+    if not LABEL_INDEX_ENABLED:
+        return
+    while True:
+        try:
+            await refresh_index()
+        except Exception as e:
+            logger.warning("标签索引同步失败: %s", e)
+        await asyncio.sleep(LABEL_INDEX_REFRESH_INTERVAL)
+
+def label_index_stats() -> Dict[str, object]:
+    index = _index
+    return {
+        "enabled": LABEL_INDEX_ENABLED,
+        "documents": len(index) if index else 0,
+        "bigrams": len(index._postings) if index else 0,
+        "complete": index.complete if index else False,
+        "synced_at": _synced_at,
+        "lookups": dict(_lookups),
+    }
@@ -1,34 +1,107 @@
 from fastapi import FastAPI, Depends, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware  # 添加这行
 from sqlalchemy.orm import Session
 from contextlib import asynccontextmanager
-from db import Base, engine, SessionLocal
+from db import SessionLocal, sync_schema
 from schemas import (
-    QARequest, QAResponse, HistoryResponse, HistoryItem, FeedbackRequest,
-    SourceDocument, EntityInfo, EntityClickRequest, EntityQueryResponse,
+    QARequest, QAResponse, HistoryResponse, FeedbackRequest,
+    SourceDocument, EntityClickRequest, EntityQueryResponse,
     ConversationCreateRequest, ConversationUpdateRequest, ConversationInfo,
-    ConversationsResponse, ConversationQAResponse, KnowledgeBaseInfo, KnowledgeBasesResponse,
-    KnowledgeBaseFile, KnowledgeBaseFilesResponse
+    ConversationsResponse, ConversationQAResponse, KnowledgeBasesResponse,
+    KnowledgeBaseFilesResponse, EntityStatusResponse,
+    EntityBatchQueryRequest, EntityBatchQueryResponse
 )
-from flowise_client import call_flowise, call_flowise_full, extract_entities_with_model, get_knowledge_base_by_id, get_all_knowledge_bases
+from qa_pipeline import (
+    load_conversation, resolve_route, generate_answer, replace_mermaid,
+    annotate_answer, add_intent_banner, persist_turn, sse_event, annotate_record, recover_periodically
+)
+from entity_worker import start_pool as start_entity_pool, get_pool as get_entity_pool
+import answer_cache
+from answer_cache import CachedAnswer
+from cache import all_cache_stats
+from flowise_client import astream_flowise
+from upstream import close_clients, pool_stats
+from cassette import cassette_stats
+from executors import LaneFull, executor_stats, llm_gate, llm_slot, release_after, run_db, run_qa, configure as configure_executors
+from singleflight import singleflight_stats
+from deadline import DeadlineExceeded, start as start_deadline, deadline_stats
+from intent_resolver import retrain_periodically, resolver_stats
+from entity_annotator import refresh_periodically as refresh_entity_dictionary
+import asyncio
+from starlette.background import BackgroundTask
 from crud import (
-    create_record, get_history_by_username, set_feedback, logical_delete,
-    extract_and_save_entities, get_entities_by_qa_record, get_entity_by_id,
-    increment_entity_click_count, update_entity_gstore_cache,
+    get_history_by_username, is_record_active, logical_delete,
+    get_entities_by_qa_record, get_entity_by_id,
+    get_entities_by_ids, load_source_chunks,
     create_conversation, get_conversation_by_id, get_conversations_by_username,
-    update_conversation, delete_conversation, get_qa_records_by_conversation
+    update_conversation, delete_conversation, get_qa_records_by_conversation,
+    get_record_by_id
+)
+import counters
+import kb_cache
+import purge
+import graph_cache
+import serializers
+import label_index
+import conversation_state
+import metrics
+import tracing
+import logging
+from config import (
+    ENTITY_BACKGROUND_DEFAULT, ENTITY_WORKERS, ENTITY_QUEUE_SIZE, ENTITY_SUBSCRIBE_TIMEOUT,
+    LABEL_INDEX_ENABLED, QA_DEADLINE
 )
-from gstore_client import query_entity_nodes
-from config import APP_PORT, FLOWISE_CHATFLOW_ID_1,FLOWISE_CHATFLOW_ID_2,FLOWISE_CHATFLOW_ID_3,FLOWISE_CHATFLOW_ID_4
+
+# 统一配置日志级别与格式（含 trace id）
+tracing.configure_logging()
+logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # 启动时建表（不存在则创建）
-    Base.metadata.create_all(bind=engine)
+    # 按接口类别划分线程池（QA流水线 / 只读数据库接口）
+    configure_executors()
+    # 启动时建表（不存在则创建），并为已有表补齐新增的列与索引
+    sync_schema()
+
+    # 后台定期训练本地意图分类器
+    intent_task = asyncio.create_task(retrain_periodically(SessionLocal))
+    # 后台定期刷新本地实体词典
+    entity_dict_task = asyncio.create_task(refresh_entity_dictionary(SessionLocal))
+    # 后台实体抽取工作池
+    entity_pool = start_entity_pool(ENTITY_WORKERS, ENTITY_QUEUE_SIZE)
+    # 重新提交重启前遗留的 pending 记录
+    entity_recover_task = asyncio.create_task(recover_periodically(SessionLocal))
+    # 监听知识库更新，失效答案缓存
+    kb_watch_task = asyncio.create_task(answer_cache.watch_knowledge_bases())
+    # 后台定期同步gStore标签索引
+    label_index_task = asyncio.create_task(label_index.refresh_periodically())
+    # 点击数与点赞/点踩的定期写回
+    counter_task = asyncio.create_task(counters.flush_periodically(SessionLocal))
+    # 定期物理删除超过保留期的软删除数据
+    purge_task = asyncio.create_task(purge.purge_periodically(SessionLocal))
+    # 为升级前的对话回填问答轮数
+    turn_backfill_task = asyncio.create_task(conversation_state.backfill(SessionLocal))
 
     yield
 
+    intent_task.cancel()
+    entity_dict_task.cancel()
+    entity_recover_task.cancel()
+    kb_watch_task.cancel()
+    label_index_task.cancel()
+    counter_task.cancel()
+    purge_task.cancel()
+    turn_backfill_task.cancel()
+    await entity_pool.stop(timeout=10)
+    # 关闭前写回缓冲中剩余的计数
+    try:
+        await counters.flush(SessionLocal)
+    except Exception as e:
+        logger.warning("关闭时计数器写回失败: %s", e)
+    # 关闭时释放上游连接池
+    await close_clients()
+
 app = FastAPI(title="QA + Entity Extraction Service", version="1.0.0", lifespan=lifespan)
 
 # 添加CORS中间件
@@ -39,356 +112,500 @@ app.add_middleware(
     allow_methods=["*"],  # 允许所有HTTP方法
     allow_headers=["*"],  # 允许所有请求头
 )
+# 在途请求数与按路由的请求耗时
+app.add_middleware(metrics.MetricsMiddleware)
+# 请求级 trace id 与单请求调试开关（最外层，覆盖其他中间件的日志）
+app.add_middleware(tracing.TraceMiddleware)
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
 
-def get_db():
+@app.exception_handler(LaneFull)
+async def lane_full_handler(request, exc: LaneFull):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
+async def get_db():
+    # 异步依赖：创建会话不涉及IO，关闭（归还连接）在DB线程池中执行，不占用默认线程池
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
+        await run_db(db.close)
 
 @app.get("/health")
-def health():
+async def health():
+    # 异步接口：不占用线程池与LLM槽位，问答满载时仍能及时响应
     return {"status": "ok"}
-from config import MERMAID_URL,OLLAMA_URL,OLLAMA_MODEL
-import requests  # 确保导入requests库用于调用接口
-import json
-from typing import Optional
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_api():
+    """
+    Prometheus 文本格式指标：各阶段耗时直方图、上游错误/超时、连接池、缓存命中与在途请求
+    """
+    return PlainTextResponse(metrics.render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/upstreams/stats")
+def upstream_stats():
+    """
+    上游连接池统计：请求数、错误/超时数、在途请求、新建连接数与当前池状态
+    """
+    return pool_stats()
+
+@app.get("/cassette/stats")
+def upstream_cassette_stats():
+    """
+    上游流量录制/回放状态：模式、磁带路径、已录制条数与回放命中情况
+    """
+    return cassette_stats()
+
+@app.get("/coalescing/stats")
+def coalescing_stats():
+    """
+    上游请求合并统计：实际发出的调用数与被合并（共享结果）的调用数
+    """
+    return singleflight_stats()
+
+@app.get("/executors/stats")
+def executors_stats():
+    """
+    执行隔离状态：LLM通道的占用/排队/拒绝数，各线程池的占用情况
+    """
+    return executor_stats()
+
+@app.get("/deadline/stats")
+def deadline_stats_api():
+    """
+    时间预算统计：预算耗尽次数、因预算不足跳过的阶段，以及各幂等调用的 p95 与对冲次数
+    """
+    return deadline_stats()
+
+@app.get("/cache/stats")
+def cache_stats():
+    """
+    进程内各缓存的容量与命中统计
+    """
+    return {
+        **all_cache_stats(),
+        "answer": answer_cache.answer_cache_stats(),
+        "graph_tiers": graph_cache.graph_cache_stats(),
+        "label_index": label_index.label_index_stats(),
+        "knowledge_bases": kb_cache.kb_cache_stats(),
+    }
 
-from pydantic import BaseModel
-# 意图识别响应模型
-class IntentRecognitionResponse(BaseModel):
-    intent_id: int  # 1-5的意图ID
+@app.get("/counters/stats")
+def counters_stats():
+    """
+    计数器写回缓冲：待写回行数、写回延迟（flush_lag_seconds）与累计写回量
+    """
+    return counters.counter_stats()
+
+@app.get("/purge/stats")
+def purge_stats():
+    """
+    软删除清理任务的累计删除量与最近一次运行情况
+    """
+    return purge.purge_stats()
+
+@app.post("/purge/run")
+async def purge_run():
+    """
+    立即执行一轮软删除清理
+    """
+    return await purge.purge_once(SessionLocal)
+
+@app.get("/intent/stats")
+def intent_stats():
+    """
+    意图解析统计：各来源（缓存/规则/本地分类器/Ollama）命中次数与缓存状态
+    """
+    return resolver_stats()
+from typing import Optional
 
 @app.post("/qa", response_model=QAResponse)
-def qa(req: QARequest, chatflow_id: Optional[str] = None, db: Session = Depends(get_db)):
+async def qa(req: QARequest, chatflow_id: Optional[str] = None, db: Session = Depends(get_db)):
+    # 本轮问答的整体时间预算（含等待LLM槽位的时间），各阶段的上游超时不超过剩余预算
+    start_deadline(QA_DEADLINE)
+    async with llm_slot():
+        return await _qa(req, chatflow_id, db)
+
+async def _qa(req: QARequest, chatflow_id: Optional[str], db: Session):
     # ============ 0) 初始化 overrideConfig ============
     override_config = {}
     if req.conversation_id:
         override_config = {"sessionId": req.conversation_id}
-    print(f"=== 初始化overrideConfig ===")
-    print(f"overrideConfig: {json.dumps(override_config, ensure_ascii=False)}")
-    print(f"传入的 chatflow_id: {chatflow_id}")
+    tracing.debug(logger, "overrideConfig: %s, 传入的 chatflow_id: %s", tracing.LazyJson(override_config), chatflow_id)
 
     # ============ 0.1) 验证权限 ============
-    conversation = None
-    if req.conversation_id:
-        conversation = get_conversation_by_id(db, req.conversation_id)
-        if not conversation:
-            raise HTTPException(status_code=404, detail="对话页面不存在")
-        if conversation.username != req.username:
-            raise HTTPException(status_code=403, detail="无权限访问此对话页面")
+    conversation = await load_conversation(db, req.conversation_id, req.username)
 
     # =====================================================
-    # ✅ 1) 检查conversation是否已有intent_id
+    # ✅ 1-2) 已有intent_id直接用；否则进行意图识别
     # =====================================================
-    existing_intent_id = None
-    existing_chatflow_id = None
-    first_turn = True  # 是否是本会话第一条QA
-
-    if conversation and getattr(conversation, "extra", None):
-        extra = conversation.extra or {}
-        existing_intent_id = extra.get("intent_id")
-        existing_chatflow_id = extra.get("chatflow_id")
-
-        # 判断是否已有QA记录（如果已有则不是第一条）
-        from crud import get_qa_records_by_conversation
-        total, _ = get_qa_records_by_conversation(db, conversation.conversation_id, 1, 1)
-        if total > 0:
-            first_turn = False
+    route = await resolve_route(db, conversation, req.question)
 
     # =====================================================
-    # ✅ 2) 如果已有intent_id，直接用；否则进行识别
+    # ✅ 3) 查答案缓存（仅首轮：此时不依赖会话记忆）
     # =====================================================
-    if existing_intent_id and existing_chatflow_id:
-        intent_id = existing_intent_id
-        flowise_chatflow_id = existing_chatflow_id
-        print(f"=== 已存在intent_id={intent_id}，跳过意图识别，使用固定chatflow_id={flowise_chatflow_id} ===")
+    cached, cache_probe = None, None
+    if route.first_turn:
+        with metrics.stage("answer_cache"):
+            cached, cache_probe = await answer_cache.lookup(route.chatflow_id, req.question)
+
+    background = req.background_entities if req.background_entities is not None else ENTITY_BACKGROUND_DEFAULT
+    entity_pool = get_entity_pool()
+    entity_status = "done"
+
+    if cached:
+        tracing.debug(logger, "命中答案缓存，跳过Flowise调用")
+        answer_raw = original_answer_raw = cached.answer_raw
+        source_documents = cached.source_documents
+        mermaid_replaced = cached.mermaid_replaced
+        answer_annotated = cached.answer_annotated
     else:
-        # === 执行意图识别逻辑（保留你原来的那段） ===
-        intent_id = None
-        try:
-            intent_prompt = f"""你是一个严格执行分类任务的机器人。输出要求：
-1. 必须输出合法的 JSON 格式，不带任何额外文字；
-2. 格式固定为：{{"intent_id": 整数}}；
-3. 整数必须是 1、2、3、4 或 5 之一。
-
-意图定义如下（明确边界）：
-1. 装备关联与组合推荐：涉及装备之间的搭配、组合、协同使用等问题（如装备A和什么搭配好、装备B与装备C的协同方式）；
-2. 后装保障决策支持：涉及后装保障的策略制定、方案选择等决策类问题（如某地区补给方案如何制定、维修优先级决策）；
-3. 实时战况：涉及战场实时态势、兵力部署、敌情动态等实时信息查询/分析；
-4. 其他后装保障（维修、保养、补给）：涉及具体的维修方法、保养流程、补给操作等执行类问题；
-5. 无意义内容（乱码或无效文本）：无法理解的乱码、无实际含义的文本。
-
-示例（覆盖所有意图）：
-用户：步枪怎么修？
-输出：{{"intent_id": 4}}
-
-用户：坦克和什么装备搭配协同作战好？
-输出：{{"intent_id": 1}}
-
-用户：前线部队补给方案怎么选？
-输出：{{"intent_id": 2}}
-
-用户：当前敌方坦克的部署位置？
-输出：{{"intent_id": 3}}
-
-用户：asdf123乱码文本
-输出：{{"intent_id": 5}}
-
-用户问题：{req.question}
-请输出结果：
-"""
-
-            ollama_response = requests.post(
-                url=OLLAMA_URL,
-                headers={"Content-Type": "application/json"},
-                json={
-                    "model": OLLAMA_MODEL,
-                    "prompt": intent_prompt,
-                    "stream": False,
-                    "format": "json",
-                    "options": {"temperature": 0.1}
-                },
-                timeout=10
-            )
-
-            raw_response = ollama_response.json()
-            response_content = raw_response.get("response", "").strip()
-            intent_data = json.loads(response_content)
-            intent_id = int(intent_data.get("intent_id", 4))
-            print(f"识别意图ID: {intent_id}")
-
-        except Exception as e:
-            print(f"意图识别失败: {str(e)}，默认使用意图ID=4")
-            intent_id = 4
-
-        intent_to_chatflow = {
-            1: FLOWISE_CHATFLOW_ID_1,
-            2: FLOWISE_CHATFLOW_ID_2,
-            3: FLOWISE_CHATFLOW_ID_3,
-            4: FLOWISE_CHATFLOW_ID_4,
-            5: FLOWISE_CHATFLOW_ID_4,
-        }
-
-        flowise_chatflow_id = intent_to_chatflow.get(intent_id, FLOWISE_CHATFLOW_ID_4)
-        print(f"=== 根据意图映射选择Flowise Chatflow ID: {flowise_chatflow_id} ===")
-
-        # ✅ 首次识别后存入conversation.extra
-        if conversation:
-            conv_extra = conversation.extra or {}
-            conv_extra["intent_id"] = intent_id
-            conv_extra["chatflow_id"] = flowise_chatflow_id
-            update_conversation(db, conversation.conversation_id, extra=conv_extra)
-            print(f"已将intent_id={intent_id}写入conversation.extra")
-
-    # =====================================================
-    # ✅ 3) 调用 Flowise
-    # =====================================================
-    flowise_response = call_flowise_full(
-        question=req.question,
-        override_config=override_config,
-        chatflow_id=flowise_chatflow_id
-    )
-    answer_raw = flowise_response["text"]
-    source_documents = flowise_response["source_documents"]
-
-    original_answer_raw = answer_raw
-    mermaid_replaced = False
-
-    # ============ 4) 调用 mermaid ============
-    try:
-        mermaid_response = requests.post(
-            url=MERMAID_URL,
-            headers={"Content-Type": "application/json"},
-            json={"content": answer_raw},
-            timeout=5
-        )
-        if mermaid_response.status_code == 200:
-            mermaid_result = mermaid_response.json()
-            if (mermaid_result.get("success") is True and isinstance(mermaid_result.get("result"), str)):
-                answer_raw = mermaid_result["result"]
-                mermaid_replaced = True
-                print(f"mermaid替换成功: {mermaid_result.get('message', '无信息')}")
-            else:
-                print(f"mermaid替换未成功: {mermaid_result.get('message', '未返回原因')}")
+        # ============ 3.1) 调用 Flowise ============
+        flowise_response = await generate_answer(req.question, override_config, route.chatflow_id)
+        answer_raw = flowise_response["text"]
+        source_documents = flowise_response["source_documents"]
+
+        original_answer_raw = answer_raw
+
+        # ============ 4) 调用 mermaid ============
+        answer_raw, mermaid_replaced = await replace_mermaid(answer_raw)
+
+        # ============ 5) 实体抽取 ============
+        if mermaid_replaced:
+            answer_annotated = answer_raw
+            tracing.debug(logger, "mermaid替换成功，跳过实体抽取")
+        elif background and entity_pool is not None:
+            # 后台模式：先返回未标注的答案，标注与实体入库交给工作池
+            answer_annotated = original_answer_raw
+            entity_status = "pending"
         else:
-            print(f"mermaid接口返回非200状态码: {mermaid_response.status_code}")
-    except Exception as e:
-        print(f"mermaid接口调用异常: {str(e)}，使用原始数据")
+            answer_annotated = await annotate_answer(original_answer_raw)
 
-    # ============ 5) 实体抽取 ============
-    if mermaid_replaced:
-        answer_annotated = answer_raw
-        print("mermaid替换成功，跳过实体抽取")
-    else:
-        try:
-            answer_annotated = extract_entities_with_model(original_answer_raw)
-            if not answer_annotated.strip():
-                answer_annotated = original_answer_raw
-        except Exception as e:
-            print(f"实体抽取失败: {e}，使用原始答案")
-            answer_annotated = original_answer_raw
+    def remember(annotated: str) -> None:
+        if cache_probe is not None and not cached:
+            answer_cache.store(cache_probe, CachedAnswer(
+                answer_raw=answer_raw,
+                answer_annotated=annotated,
+                source_documents=source_documents,
+                mermaid_replaced=mermaid_replaced,
+            ))
 
+    if entity_status == "done":
+        remember(answer_annotated)
 
     # =====================================================
     # ✅ 5) 仅在首次对话时添加“匹配说明”
     # =====================================================
-    intent_description_map = {
-        1: "装备关联与组合推荐智能体",
-        2: "后装保障决策支持智能体",
-        3: "实时战况分析智能体",
-        4: "其他后装保障智能体",
-        5: "无意义内容处理智能体"
-    }
-
-    intent_description = intent_description_map.get(intent_id, "后装保障智能体")
-
-    if first_turn:
-        answer_annotated = f"本次对话已为您匹配【{intent_description}】进行处理，以下是具体回答：\n\n{answer_annotated}"
-    else:
-        print("非首次对话，跳过意图描述添加")
+    answer_annotated = add_intent_banner(answer_annotated, route.intent_id, route.first_turn)
 
     # =====================================================
-    # ✅ 6) 入库（保持原逻辑）
+    # ✅ 6-7) 入库并提取实体
     # =====================================================
-    rec = create_record(
+    rec_id, entities = await persist_turn(
         db,
         username=req.username,
         conversation_id=req.conversation_id,
         question=req.question,
         answer_raw=answer_raw,
         answer_annotated=answer_annotated,
-        chatflow_id=flowise_chatflow_id,
+        chatflow_id=route.chatflow_id,
         source_documents=source_documents,
+        save_entities=not mermaid_replaced and entity_status == "done",
+        entity_status=entity_status,
     )
 
-    # ============ 7) 提取实体 ============
-    entities = []
-    if not mermaid_replaced:
-        try:
-            entities = extract_and_save_entities(db, rec.id, answer_annotated)
-        except Exception as e:
-            print(f"实体保存失败: {e}")
+    if entity_status == "pending":
+        job = lambda: annotate_record(rec_id, original_answer_raw, route.intent_id, route.first_turn, on_annotated=remember)
+        if not entity_pool.submit(rec_id, job):
+            # 队列已满，退化为同步抽取
+            try:
+                answer_annotated, entities = await job()
+                entity_status = "done"
+            except Exception as e:
+                logger.warning("实体抽取失败: %s", e)
+                entity_status = "failed"
 
     # ============ 8) 构建响应 ============
-    entity_infos = [
-        EntityInfo(
-            id=entity.id,
-            entity_text=entity.entity_text,
-            entity_type=entity.entity_type,
-            start_position=entity.start_position,
-            end_position=entity.end_position,
-            click_count=entity.click_count
-        )
-        for entity in entities
-    ]
+    entity_infos = serializers.entity_infos(entities)
 
     return QAResponse(
-        id=rec.id,
-        username=rec.username,
-        conversation_id=rec.conversation_id,
-        question=rec.question,
-        answer_raw=rec.answer_raw or "",
-        answer_annotated=rec.answer_annotated,
+        id=rec_id,
+        username=req.username,
+        conversation_id=req.conversation_id,
+        question=req.question,
+        answer_raw=answer_raw or "",
+        answer_annotated=answer_annotated,
         source_documents=[SourceDocument(**doc) for doc in source_documents] if source_documents else [],
-        entities=entity_infos
+        entities=entity_infos,
+        entity_status=entity_status
     )
 
+async def _load_entity_status(db: Session, rec_id: int) -> EntityStatusResponse | None:
+    def load():
+        rec = get_record_by_id(db, rec_id)
+        if not rec or rec.is_deleted == 1:
+            return None
+        entities = get_entities_by_qa_record(db, rec_id)
+        return EntityStatusResponse(
+            id=rec.id,
+            status=(rec.extra or {}).get("entity_status", "done"),
+            answer_annotated=rec.answer_annotated,
+            entities=serializers.entity_infos(entities)
+        )
+    return await run_db(load)
+
+@app.get("/qa/{rec_id}/entities", response_model=EntityStatusResponse)
+async def get_record_entities(rec_id: int, db: Session = Depends(get_db)):
+    """
+    查询后台实体抽取结果（轮询）
+    """
+    result = await _load_entity_status(db, rec_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="记录不存在或已删除")
+    return result
 
+@app.get("/qa/{rec_id}/entities/stream")
+async def subscribe_record_entities(rec_id: int):
+    """
+    订阅后台实体抽取结果（SSE）：抽取完成后推送一次 entities 事件
+    """
+    db = SessionLocal()
+    result = await _load_entity_status(db, rec_id)
+    if result is None:
+        await run_db(db.close)
+        raise HTTPException(status_code=404, detail="记录不存在或已删除")
 
+    async def event_stream(result: EntityStatusResponse):
+        try:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + ENTITY_SUBSCRIBE_TIMEOUT
+            while result.status == "pending" and loop.time() < deadline:
+                entity_pool = get_entity_pool()
+                # 本进程提交的任务可直接等待完成通知，否则按秒轮询数据库
+                if entity_pool is None or not await entity_pool.wait(rec_id, 1.0):
+                    await asyncio.sleep(1.0)
+                db.expire_all()
+                result = await _load_entity_status(db, rec_id) or result
+            yield sse_event("entities", result.model_dump())
+            yield sse_event("done", {})
+        finally:
+            await run_db(db.close)
+
+    return StreamingResponse(
+        event_stream(result),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-@app.get("/history", response_model=HistoryResponse)
-def history(username: str, page: int = 1, size: int = 10, db: Session = Depends(get_db)):
-    total, records = get_history_by_username(db, username, page, size)
-    items = []
-    for r in records:
-        source_docs = []
-        if r.extra and "source_documents" in r.extra:
-            source_docs = [SourceDocument(**doc) for doc in r.extra["source_documents"]]
-
-        # 获取实体信息
-        entities = get_entities_by_qa_record(db, r.id)
-        entity_infos = [
-            EntityInfo(
-                id=entity.id,
-                entity_text=entity.entity_text,
-                entity_type=entity.entity_type,
-                start_position=entity.start_position,
-                end_position=entity.end_position,
-                click_count=entity.click_count
-            )
-            for entity in entities
-        ]
 
-        items.append(HistoryItem(
-            id=r.id,
-            username=r.username,
-            conversation_id=r.conversation_id,
-            question=r.question,
-            answer_annotated=r.answer_annotated,
-            source_documents=source_docs,
-            entities=entity_infos,
-            created_at=r.created_at
-        ))
 
-    return HistoryResponse(total=total, items=items)
+
+@app.post("/qa/stream")
+async def qa_stream(req: QARequest, db: Session = Depends(get_db)):
+    """
+    流式问答接口（SSE）：边生成边推送Flowise token，结束后推送标注答案、实体和记录ID
+
+    事件顺序：meta -> token* -> answer -> entities -> record -> done（出错时推送 error）
+    """
+    override_config = {}
+    if req.conversation_id:
+        override_config = {"sessionId": req.conversation_id}
+
+    # 槽位在开始推送前占用（满载时直接返回503），推送结束后归还
+    lease = await llm_gate.acquire()
+    # 权限校验与路由在开始推送前完成，错误仍以普通HTTP状态码返回
+    try:
+        conversation = await load_conversation(db, req.conversation_id, req.username)
+        route = await resolve_route(db, conversation, req.question)
+    except BaseException:
+        lease.release()
+        raise
+
+    async def event_stream():
+        yield sse_event("meta", {
+            "intent_id": route.intent_id,
+            "chatflow_id": route.chatflow_id,
+            "first_turn": route.first_turn,
+        })
+
+        tokens = []
+        source_documents = []
+        try:
+            async for event, data in astream_flowise(req.question, override_config, route.chatflow_id):
+                if event == "token" and data:
+                    tokens.append(data)
+                    yield sse_event("token", {"text": data})
+                elif event == "sourceDocuments" and isinstance(data, list):
+                    source_documents = data
+                elif event == "error":
+                    yield sse_event("error", {"detail": str(data)})
+                    return
+        except Exception as e:
+            yield sse_event("error", {"detail": f"Flowise 调用失败: {e}"})
+            return
+
+        original_answer_raw = "".join(tokens)
+        answer_raw, mermaid_replaced = await replace_mermaid(original_answer_raw)
+        if mermaid_replaced:
+            answer_annotated = answer_raw
+        else:
+            answer_annotated = await annotate_answer(original_answer_raw)
+        answer_annotated = add_intent_banner(answer_annotated, route.intent_id, route.first_turn)
+
+        yield sse_event("answer", {
+            "answer_raw": answer_raw,
+            "answer_annotated": answer_annotated,
+            "source_documents": source_documents,
+        })
+
+        # 依赖注入的会话在响应开始前就已关闭，入库使用独立会话
+        stream_db = SessionLocal()
+        try:
+            rec_id, entities = await persist_turn(
+                stream_db,
+                username=req.username,
+                conversation_id=req.conversation_id,
+                question=req.question,
+                answer_raw=answer_raw,
+                answer_annotated=answer_annotated,
+                chatflow_id=route.chatflow_id,
+                source_documents=source_documents,
+                save_entities=not mermaid_replaced,
+            )
+            entity_infos = serializers.entity_infos(entities)
+        except Exception as e:
+            yield sse_event("error", {"detail": f"入库失败: {e}"})
+            return
+        finally:
+            await run_qa(stream_db.close)
+
+        yield sse_event("entities", entity_infos)
+        yield sse_event("record", {"id": rec_id})
+        yield sse_event("done", {})
+
+    return StreamingResponse(
+        release_after(event_stream(), lease),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # 推送开始前客户端就断开时生成器不会执行，由后台任务兜底归还
+        background=BackgroundTask(lease.release),
+    )
+
+@app.get("/history", response_model=HistoryResponse)
+async def history(
+        username: str,
+        page: int = 1,
+        size: int = 10,
+        cursor: Optional[str] = None,
+        with_total: bool = True,
+        db: Session = Depends(get_db)
+):
+    """
+    用户问答历史（按时间倒序）。传入上一页返回的 next_cursor 翻页；with_total=false 时不统计总数
+    """
+    def load():
+        try:
+            total, records, next_cursor = get_history_by_username(
+                db, username, page, size, cursor=cursor, with_total=with_total
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"total": total, "items": serializers.history_items(records, load_source_chunks(db, records)), "next_cursor": next_cursor}
+    return await run_db(load)
 
 @app.post("/entity/query", response_model=EntityQueryResponse)
-def query_entity(req: EntityClickRequest, db: Session = Depends(get_db)):
+async def query_entity(req: EntityClickRequest, db: Session = Depends(get_db)):
     """
     实体点击查询接口：查询实体相关的知识图谱节点
     """
     # 1) 验证实体是否存在
-    entity = get_entity_by_id(db, req.entity_id)
+    entity = await run_db(get_entity_by_id, db, req.entity_id)
     if not entity:
         raise HTTPException(status_code=404, detail="实体不存在")
+    # 提交会使实体过期，先取出需要的字段
+    entity_text = entity.entity_text
 
-    # 2) 增加点击次数
-    increment_entity_click_count(db, req.entity_id)
-
-    # 3) 检查是否有缓存
-    if entity.gstore_query_cache:
-        return EntityQueryResponse(
-            entity_id=req.entity_id,
-            entity_text=entity.entity_text,
-            nodes=entity.gstore_query_cache.get("nodes", []),
-            relations=entity.gstore_query_cache.get("relations", []),
-            cached=True
-        )
+    # 2) 增加点击次数（写入内存缓冲，由后台任务批量写回）
+    counters.incr("entity_click", req.entity_id)
 
-    # 4) 调用gstore查询
+    # 3) 按实体文本查共享缓存，未命中再查询gStore
     try:
-        gstore_result = query_entity_nodes(req.entity_text)
-
-        # 5) 缓存查询结果
-        update_entity_gstore_cache(db, req.entity_id, gstore_result)
-
-        return EntityQueryResponse(
-            entity_id=req.entity_id,
-            entity_text=entity.entity_text,
-            nodes=gstore_result.get("nodes", []),
-            relations=gstore_result.get("relations", []),
-            cached=False
-        )
+        gstore_result, cached = await graph_cache.get_or_query(db, entity_text)
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"GStore 查询失败: {e}")
 
+    return EntityQueryResponse(
+        entity_id=req.entity_id,
+        entity_text=entity_text,
+        nodes=gstore_result.get("nodes", []),
+        relations=gstore_result.get("relations", []),
+        cached=cached
+    )
+
+@app.post("/entity/query/batch", response_model=EntityBatchQueryResponse)
+async def query_entities_batch(req: EntityBatchQueryRequest, db: Session = Depends(get_db)):
+    """
+    批量实体查询接口：一次返回一条答案中全部实体的知识图谱节点（用于悬停预览，不计入点击次数）
+    """
+    if req.qa_record_id is None and not req.entity_ids:
+        raise HTTPException(status_code=400, detail="需要提供 qa_record_id 或 entity_ids")
+
+    if req.qa_record_id is not None:
+        entities = await run_db(get_entities_by_qa_record, db, req.qa_record_id)
+        if req.entity_ids:
+            wanted = set(req.entity_ids)
+            entities = [e for e in entities if e.id in wanted]
+    else:
+        entities = await run_db(get_entities_by_ids, db, req.entity_ids)
+    pairs = [(e.id, e.entity_text) for e in entities]
+
+    results = await graph_cache.get_or_query_many(db, list(dict.fromkeys(text for _, text in pairs)))
+
+    items, failed = [], []
+    for entity_id, entity_text in pairs:
+        result, cached = results[entity_text]
+        if result is None:
+            failed.append(entity_id)
+            continue
+        items.append(EntityQueryResponse(
+            entity_id=entity_id,
+            entity_text=entity_text,
+            nodes=result.get("nodes", []),
+            relations=result.get("relations", []),
+            cached=cached
+        ))
+    return EntityBatchQueryResponse(items=items, failed=failed)
+
+@app.post("/entity/cache/invalidate")
+async def invalidate_entity_cache(graph_version: Optional[str] = None, db: Session = Depends(get_db)):
+    """
+    图数据库重新导入后调用：切换图版本并清空gStore邻域缓存，同时在后台重新同步标签索引
+    """
+    result = await graph_cache.invalidate(db, graph_version)
+    if LABEL_INDEX_ENABLED:
+        asyncio.create_task(label_index.refresh_index())
+    return result
+
 @app.post("/feedback")
 def feedback(req: FeedbackRequest, db: Session = Depends(get_db)):
     if req.type not in ("like", "dislike"):
         raise HTTPException(status_code=400, detail="type 仅支持 like | dislike")
-    ok = set_feedback(db, req.id, like=(req.type == "like"))
-    if not ok:
+    if not is_record_active(db, req.id):
         raise HTTPException(status_code=404, detail="记录不存在或已删除")
+    # 写入内存缓冲，由后台任务批量写回
+    counters.incr(req.type, req.id)
     return JSONResponse(content={"status": "ok"})
 
 @app.delete("/qa/{rec_id}")
 def delete_record(rec_id: int, db: Session = Depends(get_db)):
-    ok = logical_delete(db, rec_id)
+    ok, conversation_id = logical_delete(db, rec_id)
     if not ok:
         raise HTTPException(status_code=404, detail="记录不存在或已删除")
+    if conversation_id:
+        conversation_state.invalidate(conversation_id)
     return JSONResponse(content={"status": "ok"})
 
 # 对话页面相关API接口
@@ -412,52 +629,74 @@ def create_conversation_api(req: ConversationCreateRequest, db: Session = Depend
         username=conversation.username,
         description=conversation.description,
         is_active=conversation.is_active,
+        turn_count=conversation.turn_count,
+        last_qa_at=conversation.last_qa_at,
         created_at=conversation.created_at,
         updated_at=conversation.updated_at
     )
 
 @app.get("/conversations", response_model=ConversationsResponse)
-def get_conversations_api(username: str, page: int = 1, size: int = 10, db: Session = Depends(get_db)):
-    """
-    获取用户的对话页面列表
-    """
-    total, conversations = get_conversations_by_username(db, username, page, size)
-
-    items = [
-        ConversationInfo(
-            id=conv.id,
-            conversation_id=conv.conversation_id,
-            title=conv.title,
-            username=conv.username,
-            description=conv.description,
-            is_active=conv.is_active,
-            created_at=conv.created_at,
-            updated_at=conv.updated_at
-        )
-        for conv in conversations
-    ]
+async def get_conversations_api(
+        username: str,
+        page: int = 1,
+        size: int = 10,
+        cursor: Optional[str] = None,
+        with_total: bool = True,
+        db: Session = Depends(get_db)
+):
+    """
+    获取用户的对话页面列表（支持游标分页）
+    """
+    def load():
+        try:
+            total, conversations, next_cursor = get_conversations_by_username(
+                db, username, page, size, cursor=cursor, with_total=with_total
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        items = [
+            ConversationInfo(
+                id=conv.id,
+                conversation_id=conv.conversation_id,
+                title=conv.title,
+                username=conv.username,
+                description=conv.description,
+                is_active=conv.is_active,
+                turn_count=conv.turn_count,
+                last_qa_at=conv.last_qa_at,
+                created_at=conv.created_at,
+                updated_at=conv.updated_at
+            )
+            for conv in conversations
+        ]
 
-    return ConversationsResponse(total=total, items=items)
+        return ConversationsResponse(total=total, items=items, next_cursor=next_cursor)
+    return await run_db(load)
 
 @app.get("/conversations/{conversation_id}", response_model=ConversationInfo)
-def get_conversation_api(conversation_id: str, db: Session = Depends(get_db)):
+async def get_conversation_api(conversation_id: str, db: Session = Depends(get_db)):
     """
     获取指定对话页面信息
     """
-    conversation = get_conversation_by_id(db, conversation_id)
-    if not conversation:
-        raise HTTPException(status_code=404, detail="对话页面不存在")
+    def load():
+        conversation = get_conversation_by_id(db, conversation_id)
+        if not conversation:
+            raise HTTPException(status_code=404, detail="对话页面不存在")
 
-    return ConversationInfo(
-        id=conversation.id,
-        conversation_id=conversation.conversation_id,
-        title=conversation.title,
-        username=conversation.username,
-        description=conversation.description,
-        is_active=conversation.is_active,
-        created_at=conversation.created_at,
-        updated_at=conversation.updated_at
-    )
+        return ConversationInfo(
+            id=conversation.id,
+            conversation_id=conversation.conversation_id,
+            title=conversation.title,
+            username=conversation.username,
+            description=conversation.description,
+            is_active=conversation.is_active,
+            turn_count=conversation.turn_count,
+            last_qa_at=conversation.last_qa_at,
+            created_at=conversation.created_at,
+            updated_at=conversation.updated_at
+        )
+    return await run_db(load)
 
 @app.put("/conversations/{conversation_id}")
 def update_conversation_api(
@@ -489,119 +728,78 @@ def delete_conversation_api(conversation_id: str, db: Session = Depends(get_db))
     success = delete_conversation(db, conversation_id)
     if not success:
         raise HTTPException(status_code=404, detail="对话页面不存在")
+    conversation_state.invalidate(conversation_id)
 
     return JSONResponse(content={"status": "ok"})
 
 @app.get("/conversations/{conversation_id}/qa", response_model=ConversationQAResponse)
-def get_conversation_qa_api(
+async def get_conversation_qa_api(
         conversation_id: str,
         page: int = 1,
         size: int = 10,
+        cursor: Optional[str] = None,
+        with_total: bool = True,
         db: Session = Depends(get_db)
 ):
     """
-    获取指定对话页面的QA记录
+    获取指定对话页面的QA记录（支持游标分页）
     """
-    # 验证对话页面是否存在
-    conversation = get_conversation_by_id(db, conversation_id)
-    if not conversation:
-        raise HTTPException(status_code=404, detail="对话页面不存在")
+    def load():
+        # 验证对话页面是否存在
+        conversation = get_conversation_by_id(db, conversation_id)
+        if not conversation:
+            raise HTTPException(status_code=404, detail="对话页面不存在")
 
-    total, records = get_qa_records_by_conversation(db, conversation_id, page, size)
-
-    items = []
-    for r in records:
-        source_docs = []
-        if r.extra and "source_documents" in r.extra:
-            source_docs = [SourceDocument(**doc) for doc in r.extra["source_documents"]]
-
-        # 获取实体信息
-        entities = get_entities_by_qa_record(db, r.id)
-        entity_infos = [
-            EntityInfo(
-                id=entity.id,
-                entity_text=entity.entity_text,
-                entity_type=entity.entity_type,
-                start_position=entity.start_position,
-                end_position=entity.end_position,
-                click_count=entity.click_count
+        # 总数直接使用冗余的问答轮数，尚未回填的旧对话才执行COUNT
+        count_in_db = with_total and conversation.turn_count is None
+        try:
+            total, records, next_cursor = get_qa_records_by_conversation(
+                db, conversation_id, page, size, cursor=cursor, with_total=count_in_db
             )
-            for entity in entities
-        ]
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if with_total and not count_in_db:
+            total = conversation.turn_count
+
+        return {
+            "conversation_id": conversation_id,
+            "conversation_title": conversation.title,
+            "total": total,
+            "items": serializers.history_items(records, load_source_chunks(db, records)),
+            "next_cursor": next_cursor,
+        }
+    return await run_db(load)
 
-        items.append(HistoryItem(
-            id=r.id,
-            username=r.username,
-            conversation_id=r.conversation_id,
-            question=r.question,
-            answer_annotated=r.answer_annotated,
-            source_documents=source_docs,
-            entities=entity_infos,
-            created_at=r.created_at
-        ))
+def _matches(value: str, keyword: Optional[str]) -> bool:
+    return not keyword or keyword.lower() in (value or "").lower()
 
-    return ConversationQAResponse(
-        conversation_id=conversation_id,
-        conversation_title=conversation.title,
-        total=total,
-        items=items
-    )
+def _status_matches(value: str, status: Optional[str]) -> bool:
+    return not status or (value or "").lower() == status.lower()
 
 @app.get("/knowledge-bases/{kb_id}/files", response_model=KnowledgeBaseFilesResponse)
-def get_knowledge_base_files_api(kb_id: str, page: int = 1, size: int = 10):
+async def get_knowledge_base_files_api(
+        kb_id: str,
+        page: int = 1,
+        size: int = 10,
+        name: Optional[str] = None,
+        status: Optional[str] = None
+):
     """
-    获取指定知识库的文件列表（分页）
+    获取指定知识库的文件列表（分页，可按文件名关键字/状态过滤），数据来自知识库元数据缓存
     """
     try:
-        # 调用Flowise API获取知识库详情
-        kb_data = get_knowledge_base_by_id(kb_id)
-
-        if not kb_data:
+        found = await kb_cache.get_knowledge_base_files(kb_id)
+        if not found:
             raise HTTPException(status_code=404, detail="知识库不存在")
+        kb_info, all_files = found
 
-        # 提取所有文件
-        all_files = []
-        for loader in kb_data.get("loaders", []):
-            for file_data in loader.get("files", []):
-                all_files.append({
-                    "id": file_data.get("id", ""),
-                    "name": file_data.get("name", ""),
-                    "mimePrefix": file_data.get("mimePrefix", ""),
-                    "size": file_data.get("size", 0),
-                    "status": file_data.get("status", ""),
-                    "uploaded": file_data.get("uploaded", "")
-                })
-
-        # 计算分页
-        total = len(all_files)
+        files = [f for f in all_files if _matches(f.name, name) and _status_matches(f.status, status)]
         start_index = (page - 1) * size
-        end_index = start_index + size
-
-        # 获取当前页的数据
-        page_items = all_files[start_index:end_index]
-
-        # 转换为响应模型
-        items = []
-        for file_data in page_items:
-            try:
-                file_info = KnowledgeBaseFile(
-                    id=file_data["id"],
-                    name=file_data["name"],
-                    mimePrefix=file_data["mimePrefix"],
-                    size=file_data["size"],
-                    status=file_data["status"],
-                    uploaded=file_data["uploaded"]
-                )
-                items.append(file_info)
-            except Exception as e:
-                print(f"处理文件数据失败: {e}")
-                continue
-
         return KnowledgeBaseFilesResponse(
-            total=total,
-            knowledge_base_id=kb_data.get("id", ""),
-            knowledge_base_name=kb_data.get("name", ""),
-            items=items
+            total=len(files),
+            knowledge_base_id=kb_info.id,
+            knowledge_base_name=kb_info.name,
+            items=files[start_index:start_index + size]
         )
 
     except HTTPException:
@@ -610,93 +808,20 @@ def get_knowledge_base_files_api(kb_id: str, page: int = 1, size: int = 10):
         raise HTTPException(status_code=502, detail=f"获取知识库文件列表失败: {str(e)}")
 
 @app.get("/knowledge-bases", response_model=KnowledgeBasesResponse)
-def get_knowledge_bases_api(page: int = 1, size: int = 10):
+async def get_knowledge_bases_api(
+        page: int = 1,
+        size: int = 10,
+        name: Optional[str] = None,
+        status: Optional[str] = None
+):
     """
-    获取知识库列表（分页）
+    获取知识库列表（分页，可按名称关键字/状态过滤），数据来自知识库元数据缓存
     """
     try:
-        # 调用Flowise API获取所有知识库
-        all_knowledge_bases = get_all_knowledge_bases()
-
-        # 计算分页
-        total = len(all_knowledge_bases)
+        snapshot = await kb_cache.get_snapshot()
+        infos = [kb for kb in snapshot.infos if _matches(kb.name, name) and _status_matches(kb.status, status)]
         start_index = (page - 1) * size
-        end_index = start_index + size
-
-        # 获取当前页的数据
-        page_items = all_knowledge_bases[start_index:end_index]
-
-        # 转换为响应模型
-        items = []
-        for kb_data in page_items:
-            try:
-                # 处理loaders数据
-                loaders = []
-                for loader_data in kb_data.get("loaders", []):
-                    files = []
-                    for file_data in loader_data.get("files", []):
-                        files.append({
-                            "id": file_data.get("id", ""),
-                            "name": file_data.get("name", ""),
-                            "mimePrefix": file_data.get("mimePrefix", ""),
-                            "size": file_data.get("size", 0),
-                            "status": file_data.get("status", ""),
-                            "uploaded": file_data.get("uploaded", "")
-                        })
-
-                    loaders.append({
-                        "id": loader_data.get("id", ""),
-                        "loaderId": loader_data.get("loaderId", ""),
-                        "loaderName": loader_data.get("loaderName", ""),
-                        "loaderConfig": loader_data.get("loaderConfig", {}),
-                        "splitterId": loader_data.get("splitterId", ""),
-                        "splitterName": loader_data.get("splitterName", ""),
-                        "splitterConfig": loader_data.get("splitterConfig", {}),
-                        "totalChunks": loader_data.get("totalChunks", 0),
-                        "totalChars": loader_data.get("totalChars", 0),
-                        "status": loader_data.get("status", ""),
-                        "files": files,
-                        "source": loader_data.get("source", "")
-                    })
-
-                # 处理配置数据
-                vector_store_config = None
-                if kb_data.get("vectorStoreConfig"):
-                    vector_store_config = {
-                        "config": kb_data["vectorStoreConfig"].get("config", {}),
-                        "name": kb_data["vectorStoreConfig"].get("name", "")
-                    }
-
-                embedding_config = None
-                if kb_data.get("embeddingConfig"):
-                    embedding_config = {
-                        "config": kb_data["embeddingConfig"].get("config", {}),
-                        "name": kb_data["embeddingConfig"].get("name", "")
-                    }
-
-                kb_info = KnowledgeBaseInfo(
-                    id=kb_data.get("id", ""),
-                    name=kb_data.get("name", ""),
-                    description=kb_data.get("description", ""),
-                    loaders=loaders,
-                    whereUsed=kb_data.get("whereUsed", []),
-                    createdDate=kb_data.get("createdDate", ""),
-                    updatedDate=kb_data.get("updatedDate", ""),
-                    status=kb_data.get("status", ""),
-                    vectorStoreConfig=vector_store_config,
-                    embeddingConfig=embedding_config,
-                    recordManagerConfig=kb_data.get("recordManagerConfig"),
-                    workspaceId=kb_data.get("workspaceId", ""),
-                    totalChars=kb_data.get("totalChars", 0),
-                    totalChunks=kb_data.get("totalChunks", 0)
-                )
-                items.append(kb_info)
-
-            except Exception as e:
-                print(f"处理知识库数据失败: {e}")
-                continue
-
-        return KnowledgeBasesResponse(total=total, items=items)
+        return KnowledgeBasesResponse(total=len(infos), items=infos[start_index:start_index + size])
 
     except Exception as e:
-        raise HTTPException(status_code=502, detail=f"获取知识库列表失败: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=502, detail=f"获取知识库列表失败: {str(e)}")
@@ -0,0 +1,38 @@
+from typing import Optional
+from config import MERMAID_URL, MERMAID_TIMEOUT
+from upstream import get_async_client
+import deadline
+import tracing
+import logging
+
+logger = logging.getLogger(__name__)
+
+async def areplace_mermaid(content: str, timeout: float = MERMAID_TIMEOUT) -> Optional[str]:
+    """
+    调用mermaid图片替换服务（异步）
+
+    Returns:
+        替换成功时返回替换后的文本，否则返回None（调用方使用原始数据）
+    """
+    try:
+        client = get_async_client("mermaid")
+        resp = await client.post(
+            MERMAID_URL,
+            headers={"Content-Type": "application/json"},
+            json={"content": content},
+            timeout=deadline.timeout_for(timeout)
+        )
+        if resp.status_code != 200:
+            logger.warning("mermaid接口返回非200状态码: %s", resp.status_code)
+            return None
+
+        mermaid_result = resp.json()
+        if mermaid_result.get("success") is True and isinstance(mermaid_result.get("result"), str):
+            tracing.debug(logger, "mermaid替换成功: %s", mermaid_result.get("message", "无信息"))
+            return mermaid_result["result"]
+
+        tracing.debug(logger, "mermaid替换未成功: %s", mermaid_result.get("message", "未返回原因"))
+        return None
+    except Exception as e:
+        logger.warning("mermaid接口调用异常: %s，使用原始数据", e)
+        return None
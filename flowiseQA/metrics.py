@@ -0,0 +1,258 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from cache import all_cache_stats
+from counters import counter_stats
+from db import engine
+from deadline import deadline_stats
+from entity_worker import get_pool
+from executors import executor_stats
+from singleflight import singleflight_stats
+from upstream import pool_stats
+import tracing
+
+# Prometheus 文本格式（0.0.4）指标：请求内各阶段耗时直方图在运行时累计，
+# 上游、连接池、缓存等已有统计在抓取时读取并转换，不引入额外依赖
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+def _escape(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[object], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str], buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # 标签值 -> [各桶计数（非累积）, 总和, 次数]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+        _histograms.append(self)
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(key, list(series[0]), series[1], series[2]) for key, series in self._series.items()]
+        for key, counts, total, count in sorted(snapshot):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {round(total, 6)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+_histograms: List[Histogram] = []
+
+STAGE_SECONDS = Histogram(
+    "qa_stage_duration_seconds", "Duration of each /qa pipeline stage", ("stage", "chatflow_id", "intent_id")
+)
+HTTP_SECONDS = Histogram(
+    "qa_http_request_duration_seconds", "HTTP request duration by route", ("method", "route", "status")
+)
+
+# 当前请求的路由结果（chatflow/意图），由 qa_pipeline 在路由确定后设置，作为阶段耗时的标签
+_route: ContextVar[Tuple[str, str]] = ContextVar("metrics_route", default=("", ""))
+
+def set_route(chatflow_id: Optional[str], intent_id: Optional[int]) -> None:
+    _route.set((chatflow_id or "", "" if intent_id is None else str(intent_id)))
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    记录一个流水线阶段的耗时（标签取阶段结束时的路由结果），同时计入请求追踪
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        chatflow_id, intent_id = _route.get()
+        STAGE_SECONDS.observe(elapsed, stage=name, chatflow_id=chatflow_id, intent_id=intent_id)
+        tracing.record_span(name, elapsed)
+
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+class MetricsMiddleware:
+    """
+    ASGI中间件：统计在途请求数与按路由模板的请求耗时（流式响应计到响应体发送完毕）
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _in_flight
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        with _in_flight_lock:
+            _in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            with _in_flight_lock:
+                _in_flight -= 1
+            route = scope.get("route")
+            HTTP_SECONDS.observe(
+                time.perf_counter() - started,
+                method=scope.get("method", ""),
+                route=getattr(route, "path", "unmatched"),
+                status=status["code"],
+            )
+
+class _Family:
+    """
+    抓取时生成的 gauge/counter 指标族
+    """
+    def __init__(self, name: str, kind: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.kind = kind
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.samples: List[Tuple[Tuple[object, ...], float]] = []
+
+    def add(self, value: Optional[float], *labels: object) -> "_Family":
+        if value is not None:
+            self.samples.append((labels, value))
+        return self
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self.samples:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+def _collect() -> List[_Family]:
+    families = []
+
+    in_flight = _Family("qa_http_requests_in_flight", "gauge", "HTTP requests currently being served")
+    families.append(in_flight.add(_in_flight))
+
+    requests = _Family("qa_upstream_requests_total", "counter", "Upstream HTTP requests", ("upstream", "mode"))
+    errors = _Family("qa_upstream_errors_total", "counter", "Upstream transport errors (excluding timeouts)", ("upstream", "mode"))
+    error_responses = _Family(
+        "qa_upstream_error_responses_total", "counter", "Upstream responses with a 4xx/5xx status", ("upstream", "mode", "class")
+    )
+    timeouts = _Family("qa_upstream_timeouts_total", "counter", "Upstream HTTP timeouts", ("upstream", "mode"))
+    upstream_in_flight = _Family("qa_upstream_in_flight", "gauge", "Upstream requests in flight", ("upstream", "mode"))
+    upstream_conns = _Family("qa_upstream_pool_connections", "gauge", "Upstream async pool connections", ("upstream", "state"))
+    upstream_limit = _Family("qa_upstream_pool_size", "gauge", "Configured upstream pool size", ("upstream",))
+    for name, entry in pool_stats().items():
+        upstream_limit.add(entry["pool_size"], name)
+        snapshot = entry["async"]
+        requests.add(snapshot["requests"], name, "async")
+        errors.add(snapshot["errors"], name, "async")
+        timeouts.add(snapshot["timeouts"], name, "async")
+        error_responses.add(snapshot["server_errors"], name, "async", "5xx").add(snapshot["client_errors"], name, "async", "4xx")
+        upstream_in_flight.add(snapshot["in_flight"], name, "async")
+        pool = entry["async"].get("pool")
+        if pool:
+            upstream_conns.add(pool["active"], name, "active").add(pool["idle"], name, "idle")
+    families += [requests, errors, error_responses, timeouts, upstream_in_flight, upstream_conns, upstream_limit]
+
+    db_pool = _Family("qa_db_pool_connections", "gauge", "Database connection pool usage", ("state",))
+    pool = engine.pool
+    for state, method in (("size", "size"), ("checked_out", "checkedout"), ("overflow", "overflow"), ("checked_in", "checkedin")):
+        fn = getattr(pool, method, None)
+        if callable(fn):
+            db_pool.add(fn(), state)
+    families.append(db_pool)
+
+    cache_hits = _Family("qa_cache_hits_total", "counter", "In-process cache hits", ("cache",))
+    cache_misses = _Family("qa_cache_misses_total", "counter", "In-process cache misses", ("cache",))
+    cache_ratio = _Family("qa_cache_hit_ratio", "gauge", "In-process cache hit ratio", ("cache",))
+    cache_size = _Family("qa_cache_entries", "gauge", "In-process cache entries", ("cache",))
+    for name, stats in all_cache_stats().items():
+        cache_hits.add(stats["hits"], name)
+        cache_misses.add(stats["misses"], name)
+        cache_ratio.add(stats["hit_ratio"], name)
+        cache_size.add(stats["size"], name)
+    families += [cache_hits, cache_misses, cache_ratio, cache_size]
+
+    coalesced = _Family("qa_upstream_coalesced_total", "counter", "Upstream calls served by an identical in-flight call", ("group",))
+    for name, stats in singleflight_stats().items():
+        coalesced.add(stats["coalesced"], name)
+    families.append(coalesced)
+
+    budget = _Family("qa_deadline_events_total", "counter", "Deadline exhaustion and skipped optional stages", ("event",))
+    for event, count in deadline_stats()["counters"].items():
+        budget.add(count, event)
+    hedges = _Family("qa_hedged_requests_total", "counter", "Hedged duplicate requests issued", ("call",))
+    for call, stats in deadline_stats()["hedging"].items():
+        hedges.add(stats["hedged"], call)
+    families += [budget, hedges]
+
+    counter_buffer = counter_stats()
+    families.append(
+        _Family("qa_counter_pending_increments", "gauge", "Buffered click/feedback increments not yet flushed")
+        .add(counter_buffer["pending_increments"])
+    )
+    families.append(
+        _Family("qa_counter_flush_lag_seconds", "gauge", "Age of the oldest unflushed counter increment")
+        .add(counter_buffer["flush_lag_seconds"])
+    )
+
+    lanes = executor_stats()
+    llm = lanes["llm"]
+    families.append(_Family("qa_llm_slots_active", "gauge", "LLM pipeline slots in use").add(llm["active"]))
+    families.append(_Family("qa_llm_queue_waiting", "gauge", "Requests waiting for an LLM pipeline slot").add(llm["waiting"]))
+    rejected = _Family("qa_llm_rejected_total", "counter", "LLM pipeline requests rejected with 503", ("reason",))
+    families.append(rejected.add(llm["rejected"], "queue_full").add(llm["timed_out"], "queue_timeout"))
+    threads = _Family("qa_executor_threads", "gauge", "Worker threads per executor lane", ("lane", "state"))
+    for lane, stats in lanes["threads"].items():
+        if stats:
+            threads.add(stats["busy"], lane, "busy").add(stats["waiting"], lane, "waiting").add(stats["threads"], lane, "limit")
+    families.append(threads)
+
+    entity_pool = get_pool()
+    if entity_pool is not None:
+        queue = _Family("qa_entity_queue", "gauge", "Background entity extraction queue", ("state",))
+        stats = entity_pool.stats()
+        families.append(queue.add(stats["queued"], "queued").add(stats["workers"], "workers"))
+    return families
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for histogram in _histograms:
+        lines += histogram.render()
+    for family in _collect():
+        lines += family.render()
+    return "\n".join(lines) + "\n"
@@ -1,20 +1,33 @@
-from sqlalchemy import Column, BigInteger, Integer, String, Text, DateTime, JSON, ForeignKey
+from sqlalchemy import Column, BigInteger, Integer, String, Text, DateTime, JSON, ForeignKey, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from datetime import datetime
 from db import Base
 import uuid
 
+# 主键/外键ID：MySQL 使用 BIGINT；SQLite 只有 INTEGER PRIMARY KEY 才会自增（测试等本地场景）
+BigId = BigInteger().with_variant(Integer, "sqlite")
+
 class Conversation(Base):
     __tablename__ = "conversations"
+    __table_args__ = (
+        # 用户对话列表：按更新时间倒序的游标分页
+        Index("ix_conversations_user_updated", "username", "is_deleted", "updated_at", "id"),
+        # 清理任务：按删除时间扫描已软删除的行
+        Index("ix_conversations_deleted", "is_deleted", "deleted_at"),
+    )
 
-    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    id: Mapped[int] = mapped_column(BigId, primary_key=True, autoincrement=True)
     conversation_id: Mapped[str] = mapped_column(String(64), unique=True, nullable=False, default=lambda: str(uuid.uuid4()))
     title: Mapped[str] = mapped_column(String(255), nullable=False, default="新对话")
     username: Mapped[str] = mapped_column(String(64), nullable=False)
     description: Mapped[str | None] = mapped_column(Text, nullable=True)
     is_active: Mapped[int] = mapped_column(Integer, default=1, nullable=False)  # 0/1
     is_deleted: Mapped[int] = mapped_column(Integer, default=0, nullable=False)  # 0/1
+    deleted_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)  # 软删除时间，超过保留期后由清理任务物理删除
     extra: Mapped[dict | None] = mapped_column(JSON, nullable=True)
+    # 冗余的问答轮数与最近一次问答时间，由 /qa 写入路径维护；NULL 表示升级前的对话尚未回填
+    turn_count: Mapped[int | None] = mapped_column(Integer, default=0, nullable=True)
+    last_qa_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     
@@ -23,8 +36,15 @@ class Conversation(Base):
 
 class QARecord(Base):
     __tablename__ = "qa_history"
+    __table_args__ = (
+        # 用户历史：按创建时间倒序的游标分页
+        Index("ix_qa_history_user_created", "username", "is_deleted", "created_at", "id"),
+        # 对话内记录：按创建时间正序的游标分页
+        Index("ix_qa_history_conv_created", "conversation_id", "is_deleted", "created_at", "id"),
+        Index("ix_qa_history_deleted", "is_deleted", "deleted_at"),
+    )
 
-    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    id: Mapped[int] = mapped_column(BigId, primary_key=True, autoincrement=True)
     username: Mapped[str] = mapped_column(String(64), nullable=False)
     conversation_id: Mapped[str | None] = mapped_column(String(64), ForeignKey("conversations.conversation_id"), nullable=True)
     question: Mapped[str] = mapped_column(Text, nullable=False)
@@ -34,20 +54,25 @@ class QARecord(Base):
     likes: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
     dislikes: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
     is_deleted: Mapped[int] = mapped_column(Integer, default=0, nullable=False)  # 0/1
+    deleted_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)  # 软删除时间，超过保留期后由清理任务物理删除
     extra: Mapped[dict | None] = mapped_column(JSON, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     
     # 关联实体
-    entities: Mapped[list["QAEntity"]] = relationship("QAEntity", back_populates="qa_record", cascade="all, delete-orphan")
+    entities: Mapped[list["QAEntity"]] = relationship("QAEntity", back_populates="qa_record", cascade="all, delete-orphan", order_by="QAEntity.id")
     # 关联对话页面
     conversation: Mapped["Conversation"] = relationship("Conversation", back_populates="qa_records")
 
 class QAEntity(Base):
     __tablename__ = "qa_entities"
+    __table_args__ = (
+        # 同一记录下实体文本唯一：同一记录被重复抽取时不会写入重复实体
+        Index("uq_qa_entities_record_text", "qa_record_id", "entity_text", unique=True, info={"dedupe": True}),
+    )
 
-    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
-    qa_record_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("qa_history.id"), nullable=False)
+    id: Mapped[int] = mapped_column(BigId, primary_key=True, autoincrement=True)
+    qa_record_id: Mapped[int] = mapped_column(BigId, ForeignKey("qa_history.id"), nullable=False)
     entity_text: Mapped[str] = mapped_column(String(255), nullable=False)
     entity_type: Mapped[str | None] = mapped_column(String(64), nullable=True)
     start_position: Mapped[int | None] = mapped_column(Integer, nullable=True)
@@ -58,4 +83,53 @@ class QAEntity(Base):
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     
     # 关联问答记录
-    qa_record: Mapped["QARecord"] = relationship("QARecord", back_populates="entities")
\ No newline at end of file
+    qa_record: Mapped["QARecord"] = relationship("QARecord", back_populates="entities")
+
+class GStoreEntityCache(Base):
+    """
+    跨记录共享的gStore实体邻域查询缓存（按归一化实体文本）
+    """
+    __tablename__ = "gstore_entity_cache"
+
+    id: Mapped[int] = mapped_column(BigId, primary_key=True, autoincrement=True)
+    entity_key: Mapped[str] = mapped_column(String(255), unique=True, nullable=False)
+    entity_text: Mapped[str] = mapped_column(String(255), nullable=False)
+    result: Mapped[dict] = mapped_column(JSON, nullable=False)
+    graph_version: Mapped[str] = mapped_column(String(64), nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+class GraphState(Base):
+    """
+    当前图版本（单行），各进程据此判断gStore缓存是否失效
+    """
+    __tablename__ = "graph_state"
+
+    name: Mapped[str] = mapped_column(String(32), primary_key=True)
+    version: Mapped[str] = mapped_column(String(64), nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+class SourceChunk(Base):
+    """
+    知识库来源片段，按内容哈希去重存储；问答记录的 extra.source_hashes 引用这里的 hash（引用关系见 qa_source_refs）
+    """
+    __tablename__ = "source_chunks"
+
+    hash: Mapped[str] = mapped_column(String(64), primary_key=True)  # 规范化JSON的 sha256
+    document: Mapped[dict] = mapped_column(JSON, nullable=False)  # 原始 sourceDocument（pageContent + metadata）
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    # 最近一次被新记录引用的时间（按 SOURCE_CHUNK_TOUCH_INTERVAL 粒度更新），清理时在宽限期内的片段不删除
+    last_referenced_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+class QASourceRef(Base):
+    """
+    问答记录对来源片段的引用（与 extra.source_hashes 同步写入），清理来源片段时按 hash 反连接判断是否仍被引用
+    """
+    __tablename__ = "qa_source_refs"
+    __table_args__ = (
+        Index("ix_qa_source_refs_hash", "hash"),
+    )
+
+    qa_record_id: Mapped[int] = mapped_column(BigId, ForeignKey("qa_history.id"), primary_key=True)
+    hash: Mapped[str] = mapped_column(String(64), primary_key=True)
@@ -0,0 +1,108 @@
+import json
+from typing import List
+from config import (
+    OLLAMA_URL, OLLAMA_MODEL, OLLAMA_TIMEOUT, OLLAMA_EMBED_URL, OLLAMA_EMBED_MODEL,
+    FLOWISE_CHATFLOW_ID_1, FLOWISE_CHATFLOW_ID_2, FLOWISE_CHATFLOW_ID_3, FLOWISE_CHATFLOW_ID_4
+)
+from upstream import get_async_client
+import deadline
+import tracing
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 意图识别失败时的默认意图
+DEFAULT_INTENT_ID = 4
+
+INTENT_TO_CHATFLOW = {
+    1: FLOWISE_CHATFLOW_ID_1,
+    2: FLOWISE_CHATFLOW_ID_2,
+    3: FLOWISE_CHATFLOW_ID_3,
+    4: FLOWISE_CHATFLOW_ID_4,
+    5: FLOWISE_CHATFLOW_ID_4,
+}
+
+INTENT_DESCRIPTIONS = {
+    1: "装备关联与组合推荐智能体",
+    2: "后装保障决策支持智能体",
+    3: "实时战况分析智能体",
+    4: "其他后装保障智能体",
+    5: "无意义内容处理智能体"
+}
+
+def chatflow_for_intent(intent_id: int) -> str:
+    """
+    根据意图ID映射Flowise Chatflow ID
+    """
+    return INTENT_TO_CHATFLOW.get(intent_id, FLOWISE_CHATFLOW_ID_4)
+
+def build_intent_prompt(question: str) -> str:
+    return f"""你是一个严格执行分类任务的机器人。输出要求：
+1. 必须输出合法的 JSON 格式，不带任何额外文字；
+2. 格式固定为：{{"intent_id": 整数}}；
+3. 整数必须是 1、2、3、4 或 5 之一。
+
+意图定义如下（明确边界）：
+1. 装备关联与组合推荐：涉及装备之间的搭配、组合、协同使用等问题（如装备A和什么搭配好、装备B与装备C的协同方式）；
+2. 后装保障决策支持：涉及后装保障的策略制定、方案选择等决策类问题（如某地区补给方案如何制定、维修优先级决策）；
+3. 实时战况：涉及战场实时态势、兵力部署、敌情动态等实时信息查询/分析；
+4. 其他后装保障（维修、保养、补给）：涉及具体的维修方法、保养流程、补给操作等执行类问题；
+5. 无意义内容（乱码或无效文本）：无法理解的乱码、无实际含义的文本。
+
+示例（覆盖所有意图）：
+用户：步枪怎么修？
+输出：{{"intent_id": 4}}
+
+用户：坦克和什么装备搭配协同作战好？
+输出：{{"intent_id": 1}}
+
+用户：前线部队补给方案怎么选？
+输出：{{"intent_id": 2}}
+
+用户：当前敌方坦克的部署位置？
+输出：{{"intent_id": 3}}
+
+用户：asdf123乱码文本
+输出：{{"intent_id": 5}}
+
+用户问题：{question}
+请输出结果：
+"""
+
+def _parse_intent_response(raw_response: dict) -> int:
+    response_content = raw_response.get("response", "").strip()
+    intent_data = json.loads(response_content)
+    return int(intent_data.get("intent_id", DEFAULT_INTENT_ID))
+
+async def arequest_intent(question: str, timeout: float = OLLAMA_TIMEOUT) -> int:
+    """
+    调用Ollama基座模型进行意图识别（异步），失败时抛出异常
+    """
+    client = get_async_client("ollama")
+    resp = await client.post(
+        OLLAMA_URL,
+        headers={"Content-Type": "application/json"},
+        json={
+            "model": OLLAMA_MODEL,
+            "prompt": build_intent_prompt(question),
+            "stream": False,
+            "format": "json",
+            "options": {"temperature": 0.1}
+        },
+        timeout=deadline.timeout_for(timeout)
+    )
+    intent_id = _parse_intent_response(resp.json())
+    tracing.debug(logger, "识别意图ID: %s", intent_id)
+    return intent_id
+
+async def aembed(text: str, timeout: float = OLLAMA_TIMEOUT) -> List[float]:
+    """
+    调用Ollama生成文本向量（异步），失败时抛出异常
+    """
+    resp = await get_async_client("ollama").post(
+        OLLAMA_EMBED_URL,
+        json={"model": OLLAMA_EMBED_MODEL, "prompt": text},
+        timeout=deadline.timeout_for(timeout)
+    )
+    resp.raise_for_status()
+    return resp.json().get("embedding", [])
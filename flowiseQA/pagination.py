@@ -0,0 +1,61 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+from sqlalchemy import Select, and_, or_
+from sqlalchemy.orm import Session
+
+# 游标（keyset）分页：游标为不透明的 base64 串，内容是上一页最后一条记录的 (时间戳, id)。
+# 下一页用 (ts, id) 比较代替 OFFSET，配合 (过滤列..., ts, id) 复合索引，每页都是一次索引范围扫描
+
+def encode_cursor(ts: datetime, row_id: int) -> str:
+    raw = json.dumps([ts.isoformat(), row_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    解析游标，格式不合法时抛出 ValueError
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, row_id = json.loads(raw)
+        return datetime.fromisoformat(ts), int(row_id)
+    except Exception as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
+def keyset_page(
+    db: Session,
+    stmt: Select,
+    ts_col: Any,
+    id_col: Any,
+    *,
+    size: int,
+    page: int = 1,
+    cursor: Optional[str] = None,
+    descending: bool = True
+) -> Tuple[List[Any], Optional[str]]:
+    """
+    对查询语句应用游标分页，返回 (本页记录, 下一页游标)；没有下一页时游标为 None。
+    未提供游标时兼容旧的 page 参数（仅第一页之后才会使用 OFFSET）
+    """
+    if cursor:
+        ts, row_id = decode_cursor(cursor)
+        if descending:
+            stmt = stmt.where(or_(ts_col < ts, and_(ts_col == ts, id_col < row_id)))
+        else:
+            stmt = stmt.where(or_(ts_col > ts, and_(ts_col == ts, id_col > row_id)))
+    elif page > 1:
+        stmt = stmt.offset((page - 1) * size)
+
+    if descending:
+        stmt = stmt.order_by(ts_col.desc(), id_col.desc())
+    else:
+        stmt = stmt.order_by(ts_col.asc(), id_col.asc())
+
+    # 多取一条用于判断是否还有下一页
+    rows = list(db.scalars(stmt.limit(size + 1)))
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, ts_col.key), getattr(last, id_col.key))
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from config import (
+    PURGE_ENABLED, PURGE_RETENTION_DAYS, PURGE_INTERVAL, PURGE_CHUNK_SIZE, PURGE_CHUNK_PAUSE, PURGE_SOURCE_GRACE
+)
+from crud import (
+    backfill_deleted_at, purge_deleted_records_chunk, purge_deleted_conversations_chunk,
+    purge_orphan_source_chunks_chunk
+)
+from executors import run_background
+from models import Conversation, QARecord
+
+logger = logging.getLogger(__name__)
+
+# 软删除清理任务：每批最多 PURGE_CHUNK_SIZE 行、每批一个短事务，批与批之间让出一段时间，
+# 避免长时间持有行锁或拖慢线上写入。先删记录与实体，再删已经没有记录的对话页面；
+# 删除过记录后（以及启动后的第一轮）再清理不再被任何记录引用的来源片段
+
+_totals: Dict[str, int] = {
+    "records": 0, "entities": 0, "conversations": 0, "source_chunks": 0, "backfilled": 0, "runs": 0
+}
+_last_run_at: Optional[float] = None
+_last_run_seconds = 0.0
+
+def _run_chunk(session_factory, fn, *args):
+    db = session_factory()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+async def _drain(session_factory, fn, *args) -> list:
+    """
+    反复执行单批操作直到没有可处理的行，返回每批结果
+    """
+    results = []
+    while True:
+        result = await run_background(_run_chunk, session_factory, fn, *args)
+        count = result[0] if isinstance(result, tuple) else result
+        if not count:
+            return results
+        results.append(result)
+        await asyncio.sleep(PURGE_CHUNK_PAUSE)
+
+async def sweep_source_chunks(session_factory, started: datetime) -> int:
+    """
+    分批清理来源片段，返回删除数：每批在一条 DELETE 中反连接 qa_source_refs，
+    只删除没有任何记录（含软删除）引用、且在 PURGE_SOURCE_GRACE 宽限期内未被新记录引用的片段
+    """
+    referenced_before = started - timedelta(seconds=PURGE_SOURCE_GRACE)
+    deleted = 0
+    after_hash = ""
+    while True:
+        after_hash, count = await run_background(
+            _run_chunk, session_factory, purge_orphan_source_chunks_chunk, after_hash, PURGE_CHUNK_SIZE, referenced_before
+        )
+        if after_hash is None:
+            return deleted
+        deleted += count
+        await asyncio.sleep(PURGE_CHUNK_PAUSE)
+
+async def purge_once(session_factory) -> Dict[str, int]:
+    """
+    执行一轮清理，返回本轮删除的行数
+    """
+    global _last_run_at, _last_run_seconds
+    started = time.monotonic()
+    now = datetime.utcnow()
+    cutoff = now - timedelta(days=PURGE_RETENTION_DAYS)
+
+    backfilled = 0
+    for model in (QARecord, Conversation):
+        backfilled += sum(await _drain(session_factory, backfill_deleted_at, model, now, PURGE_CHUNK_SIZE))
+    record_chunks = await _drain(session_factory, purge_deleted_records_chunk, cutoff, PURGE_CHUNK_SIZE)
+    conversations = sum(await _drain(session_factory, purge_deleted_conversations_chunk, cutoff, PURGE_CHUNK_SIZE))
+    records = sum(r for r, _ in record_chunks)
+    source_chunks = 0
+    if records or not _totals["runs"]:
+        source_chunks = await sweep_source_chunks(session_factory, now)
+
+    summary = {
+        "records": records,
+        "entities": sum(e for _, e in record_chunks),
+        "conversations": conversations,
+        "source_chunks": source_chunks,
+        "backfilled": backfilled,
+    }
+    for key, value in summary.items():
+        _totals[key] += value
+    _totals["runs"] += 1
+    _last_run_at = time.time()
+    _last_run_seconds = time.monotonic() - started
+    if any(summary.values()):
+        logger.info("软删除清理完成: %s", summary)
+    return summary
+
+async def purge_periodically(session_factory) -> None:
+    """
+    后台任务：定期清理超过保留期的软删除数据
+    """
+    if not PURGE_ENABLED:
+        return
+    while True:
+        try:
+            await purge_once(session_factory)
+        except Exception as e:
+            logger.warning("软删除清理失败: %s", e)
+        await asyncio.sleep(PURGE_INTERVAL)
+
+def purge_stats() -> Dict[str, object]:
+    return {
+        "enabled": PURGE_ENABLED,
+        "retention_days": PURGE_RETENTION_DAYS,
+        "totals": dict(_totals),
+        "last_run_at": _last_run_at,
+        "last_run_seconds": round(_last_run_seconds, 3),
+    }
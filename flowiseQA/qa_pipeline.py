@@ -0,0 +1,277 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import asyncio
+import json
+from typing import Optional, Dict, Any, List, Tuple, Callable
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from models import QAEntity
+from crud import (
+    update_conversation, persist_qa_turn, extract_and_save_entities, update_record_annotation,
+    claim_stale_pending_records, renew_entity_leases
+)
+from db import SessionLocal
+from config import (
+    DEADLINE_MIN_MERMAID, DEADLINE_MIN_ANNOTATE, ENTITY_RECOVER_AFTER, ENTITY_RECOVER_INTERVAL, ENTITY_RECOVER_BATCH
+)
+from flowise_client import acall_flowise_full, aextract_entities_with_model
+from ollama_client import chatflow_for_intent, INTENT_DESCRIPTIONS
+from intent_resolver import resolve_intent
+from mermaid_client import areplace_mermaid
+from executors import run_background, run_qa
+from entity_worker import get_pool, WORKER_ID
+import entity_annotator
+import conversation_state
+import deadline
+import metrics
+import tracing
+import logging
+from conversation_state import ConversationState
+
+logger = logging.getLogger(__name__)
+
+# /qa 异步流水线：各阶段的上游调用均走共享的异步HTTP客户端，
+# 数据库操作（同步SQLAlchemy）放入独立的QA线程池执行，避免阻塞事件循环，也不占用其他接口的线程
+
+@dataclass
+class RouteDecision:
+    conversation: Optional[ConversationState]
+    intent_id: int
+    chatflow_id: str
+    first_turn: bool
+
+async def load_conversation(db: Session, conversation_id: Optional[str], username: str) -> Optional[ConversationState]:
+    """
+    加载对话状态并校验权限（优先使用进程内的对话状态缓存）
+    """
+    if not conversation_id:
+        return None
+    state = await conversation_state.get_state(db, conversation_id)
+    if not state:
+        raise HTTPException(status_code=404, detail="对话页面不存在")
+    if state.username != username:
+        raise HTTPException(status_code=403, detail="无权限访问此对话页面")
+    return state
+
+async def resolve_route(db: Session, conversation: Optional[ConversationState], question: str) -> RouteDecision:
+    """
+    确定本轮使用的意图与chatflow：会话已固定则直接复用，否则调用意图识别并写回conversation.extra
+    """
+    # 是否是本会话第一条QA（轮数由对话状态维护，不再单独COUNT）
+    first_turn = conversation is None or conversation.first_turn
+
+    if conversation and conversation.intent_id and conversation.chatflow_id:
+        metrics.set_route(conversation.chatflow_id, conversation.intent_id)
+        tracing.debug(logger, "已存在intent_id=%s，跳过意图识别，使用固定chatflow_id=%s", conversation.intent_id, conversation.chatflow_id)
+        return RouteDecision(conversation, conversation.intent_id, conversation.chatflow_id, first_turn)
+
+    with metrics.stage("intent"):
+        intent_id, intent_source = await resolve_intent(question)
+        chatflow_id = chatflow_for_intent(intent_id)
+        metrics.set_route(chatflow_id, intent_id)
+    tracing.debug(logger, "根据意图映射选择Flowise Chatflow ID: %s", chatflow_id)
+
+    # 首次识别后存入conversation.extra（同时记录意图来源，本地分类器只用可信来源的首轮问题训练）
+    if conversation:
+        conv_extra = {"intent_id": intent_id, "chatflow_id": chatflow_id, "intent_source": intent_source}
+        await run_qa(update_conversation, db, conversation.conversation_id, extra=conv_extra)
+        conversation = conversation_state.pin_route(conversation, intent_id, chatflow_id)
+        tracing.debug(logger, "已将intent_id=%s写入conversation.extra", intent_id)
+
+    return RouteDecision(conversation, intent_id, chatflow_id, first_turn)
+
+async def generate_answer(question: str, override_config: Dict[str, Any], chatflow_id: str) -> Dict[str, Any]:
+    """
+    调用Flowise生成答案
+    """
+    with metrics.stage("flowise"):
+        return await acall_flowise_full(
+            question=question,
+            override_config=override_config,
+            chatflow_id=chatflow_id
+        )
+
+async def replace_mermaid(answer_raw: str) -> Tuple[str, bool]:
+    """
+    调用mermaid服务替换图表，返回(答案, 是否替换成功)；剩余时间预算不足时跳过
+    """
+    if not deadline.has_time_for(DEADLINE_MIN_MERMAID, "mermaid"):
+        logger.info("剩余时间预算不足，跳过mermaid替换")
+        return answer_raw, False
+    with metrics.stage("mermaid"):
+        replaced = await areplace_mermaid(answer_raw)
+    if replaced is None:
+        return answer_raw, False
+    return replaced, True
+
+async def annotate_answer(answer_raw: str) -> str:
+    """
+    实体抽取：返回带 <class> 标注的答案，失败时返回原始答案
+
+    默认使用本地词典标注（毫秒级）；ENTITY_ANNOTATOR_MODE=llm 或词典未就绪时回退到Flowise重新生成（剩余时间预算不足时跳过）
+    """
+    if entity_annotator.use_local():
+        answer_annotated, _ = entity_annotator.annotate(answer_raw)
+        return answer_annotated
+
+    if not deadline.has_time_for(DEADLINE_MIN_ANNOTATE, "annotate"):
+        logger.info("剩余时间预算不足，跳过模型实体标注")
+        return answer_raw
+
+    try:
+        with metrics.stage("annotate"):
+            answer_annotated = await aextract_entities_with_model(answer_raw)
+        if not answer_annotated.strip():
+            return answer_raw
+        return answer_annotated
+    except Exception as e:
+        logger.warning("实体抽取失败: %s，使用原始答案", e)
+        return answer_raw
+
+def add_intent_banner(answer_annotated: str, intent_id: int, first_turn: bool) -> str:
+    """
+    仅在首次对话时添加“匹配说明”
+    """
+    if not first_turn:
+        tracing.debug(logger, "非首次对话，跳过意图描述添加")
+        return answer_annotated
+    intent_description = INTENT_DESCRIPTIONS.get(intent_id, "后装保障智能体")
+    return f"本次对话已为您匹配【{intent_description}】进行处理，以下是具体回答：\n\n{answer_annotated}"
+
+async def persist_turn(
+    db: Session,
+    *,
+    username: str,
+    conversation_id: Optional[str],
+    question: str,
+    answer_raw: str,
+    answer_annotated: str,
+    chatflow_id: str,
+    source_documents: List[Dict[str, Any]],
+    save_entities: bool,
+    entity_status: Optional[str] = None
+) -> Tuple[int, List[QAEntity]]:
+    """
+    入库问答记录并提取实体（同一事务、一次提交），返回(记录ID, 实体列表)；
+    对话在本轮问答期间被删除（包括被其他进程删除）时返回404。
+    pending 记录的持有者记为本进程，由本进程为其续约
+    """
+    entity_owner = WORKER_ID if entity_status == "pending" else None
+    with metrics.stage("persist"):
+        try:
+            rec_id, entities = await run_qa(
+                lambda: persist_qa_turn(
+                    db,
+                    username=username,
+                    conversation_id=conversation_id,
+                    question=question,
+                    answer_raw=answer_raw,
+                    answer_annotated=answer_annotated,
+                    chatflow_id=chatflow_id,
+                    source_documents=source_documents,
+                    entity_status=entity_status,
+                    entity_owner=entity_owner,
+                    save_entities=save_entities,
+                )
+            )
+        except LookupError:
+            conversation_state.invalidate(conversation_id)
+            raise HTTPException(status_code=404, detail="对话页面不存在")
+    if conversation_id:
+        conversation_state.record_turn(conversation_id)
+    return rec_id, entities
+
+async def annotate_record(
+    rec_id: int,
+    answer_raw: str,
+    intent_id: int,
+    first_turn: bool,
+    on_annotated: Optional[Callable[[str], None]] = None
+) -> Tuple[str, List[QAEntity]]:
+    """
+    对已入库的记录执行实体标注与实体入库（后台模式），使用独立的数据库会话
+
+    on_annotated: 标注完成后的回调（参数为不含意图说明的标注答案），用于写入答案缓存
+    """
+    metrics.set_route(None, intent_id)
+    return await _annotate_saved(
+        rec_id, answer_raw, lambda annotated: add_intent_banner(annotated, intent_id, first_turn), on_annotated
+    )
+
+async def _annotate_saved(
+    rec_id: int,
+    answer_raw: str,
+    decorate: Callable[[str], str],
+    on_annotated: Optional[Callable[[str], None]] = None
+) -> Tuple[str, List[QAEntity]]:
+    db = SessionLocal()
+    try:
+        try:
+            answer_annotated = await annotate_answer(answer_raw)
+            if on_annotated is not None:
+                on_annotated(answer_annotated)
+            answer_annotated = decorate(answer_annotated)
+            with metrics.stage("entities"):
+                entities = await run_qa(extract_and_save_entities, db, rec_id, answer_annotated)
+        except Exception:
+            await run_qa(update_record_annotation, db, rec_id, None, "failed")
+            raise
+        await run_qa(update_record_annotation, db, rec_id, answer_annotated, "done")
+        return answer_annotated, entities
+    finally:
+        await run_qa(db.close)
+
+async def recover_pending(session_factory) -> int:
+    """
+    为本进程仍在处理的 pending 记录续约，并把租约已过期（持有进程已退出或重启）的 pending 记录
+    认领后重新提交给后台工作池，返回提交数
+    """
+    pool = get_pool()
+    if pool is None:
+        return 0
+    db = session_factory()
+    try:
+        await run_background(renew_entity_leases, db, WORKER_ID, pool.held())
+        # 只认领队列放得下的数量，认领后提交不了的记录要等租约再次过期
+        limit = min(ENTITY_RECOVER_BATCH, pool.free_slots())
+        claimed = []
+        if limit > 0:
+            older_than = datetime.utcnow() - timedelta(seconds=ENTITY_RECOVER_AFTER)
+            claimed = await run_background(claim_stale_pending_records, db, WORKER_ID, older_than, limit)
+    finally:
+        await run_background(db.close)
+
+    submitted = 0
+    for rec_id, answer_raw, pending_annotated in claimed:
+        if pool.holds(rec_id):
+            # 本进程的任务仍在队列中或正在执行
+            continue
+        # pending 时入库的是（可能带意图说明的）原始答案，补做标注后保留原有的前缀
+        prefix = pending_annotated[:len(pending_annotated) - len(answer_raw)] if pending_annotated.endswith(answer_raw) else ""
+        job = lambda rec_id=rec_id, answer_raw=answer_raw, prefix=prefix: _annotate_saved(
+            rec_id, answer_raw, lambda annotated: prefix + annotated
+        )
+        if not pool.submit(rec_id, job):
+            # 队列已满，剩余记录留到之后的扫描
+            break
+        submitted += 1
+    if submitted:
+        logger.info("重新提交遗留的后台实体抽取任务: %d 条", submitted)
+    return submitted
+
+async def recover_periodically(session_factory) -> None:
+    """
+    后台任务：启动时及之后每 ENTITY_RECOVER_INTERVAL 秒续约并重新提交遗留的 pending 记录
+    """
+    while True:
+        try:
+            await recover_pending(session_factory)
+        except Exception as e:
+            logger.warning("重新提交遗留的实体抽取任务失败: %s", e)
+        await asyncio.sleep(ENTITY_RECOVER_INTERVAL)
+
+def sse_event(event: str, data: Any) -> str:
+    """
+    编码一条 Server-Sent Events 消息
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
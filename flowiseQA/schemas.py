@@ -20,12 +20,15 @@ class ConversationInfo(BaseModel):
     username: str
     description: Optional[str] = None
     is_active: int
+    turn_count: Optional[int] = None  # 问答轮数，升级前的对话回填完成前为空
+    last_qa_at: Optional[datetime] = None
     created_at: datetime
     updated_at: datetime
 
 class ConversationsResponse(BaseModel):
-    total: int
+    total: Optional[int] = None  # with_total=false 时为空
     items: List[ConversationInfo]
+    next_cursor: Optional[str] = None  # 下一页游标，没有下一页时为空
 
 # 修改QA请求模型，支持对话页面
 class QARequest(BaseModel):
@@ -33,6 +36,7 @@ class QARequest(BaseModel):
     question: str = Field(..., min_length=1)
     conversation_id: Optional[str] = None  # 可选的对话页面ID
     chatflow_id: Optional[str] = None
+    background_entities: Optional[bool] = None  # 是否后台抽取实体，None 时使用服务端默认配置
 
 
 class SourceDocument(BaseModel):
@@ -57,6 +61,14 @@ class QAResponse(BaseModel):
     answer_annotated: str
     source_documents: List[SourceDocument] = []
     entities: List[EntityInfo] = []
+    entity_status: str = "done"  # done | pending | failed，pending 时通过 /qa/{id}/entities 获取
+
+# 后台实体抽取结果
+class EntityStatusResponse(BaseModel):
+    id: int
+    status: str
+    answer_annotated: str
+    entities: List[EntityInfo] = []
 
 # 修改历史记录项模型
 class HistoryItem(BaseModel):
@@ -70,15 +82,17 @@ class HistoryItem(BaseModel):
     created_at: datetime
 
 class HistoryResponse(BaseModel):
-    total: int
+    total: Optional[int] = None
     items: List[HistoryItem]
+    next_cursor: Optional[str] = None
 
 # 对话页面的QA记录响应
 class ConversationQAResponse(BaseModel):
     conversation_id: str
     conversation_title: str
-    total: int
+    total: Optional[int] = None
     items: List[HistoryItem]
+    next_cursor: Optional[str] = None
 
 class FeedbackRequest(BaseModel):
     id: int
@@ -107,6 +121,14 @@ class EntityQueryResponse(BaseModel):
     relations: List[GStoreRelation] = []
     cached: bool = False  # 是否来自缓存
 
+class EntityBatchQueryRequest(BaseModel):
+    qa_record_id: Optional[int] = None  # 查询该问答记录的全部实体
+    entity_ids: Optional[List[int]] = Field(default=None, max_length=200)  # 或指定实体ID列表（与qa_record_id同时给出时取交集）
+
+class EntityBatchQueryResponse(BaseModel):
+    items: List[EntityQueryResponse] = []
+    failed: List[int] = []  # gStore查询失败的实体ID，可稍后重试
+
 # 知识库相关模型
 class KnowledgeBaseFile(BaseModel):
     id: str
@@ -0,0 +1,50 @@
+from typing import Any, Dict, Iterable, List, Optional
+from models import QAEntity, QARecord
+
+# 列表接口的批量序列化：直接生成与响应模型字段一致的字典，由 response_model 统一校验一次，
+# 避免逐条构造 Pydantic 模型后再被 FastAPI 重复校验
+
+def entity_infos(entities: Iterable[QAEntity]) -> List[Dict[str, Any]]:
+    """
+    实体列表 -> EntityInfo 字典列表
+    """
+    return [
+        {
+            "id": entity.id,
+            "entity_text": entity.entity_text,
+            "entity_type": entity.entity_type,
+            "start_position": entity.start_position,
+            "end_position": entity.end_position,
+            "click_count": entity.click_count,
+        }
+        for entity in entities
+    ]
+
+def source_documents(extra: Optional[Dict[str, Any]], chunks: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    还原记录的来源文档：新记录通过 source_hashes 引用 source_chunks，旧记录仍内联在 extra.source_documents
+    """
+    if not extra:
+        return []
+    if "source_hashes" in extra:
+        return [chunks[h] for h in extra["source_hashes"] if h in chunks]
+    return list(extra.get("source_documents") or [])
+
+def history_items(records: Iterable[QARecord], chunks: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    问答记录列表 -> HistoryItem 字典列表
+    （记录的 entities 需已通过 selectinload 预加载，chunks 为 crud.load_source_chunks 批量取回的来源片段）
+    """
+    return [
+        {
+            "id": r.id,
+            "username": r.username,
+            "conversation_id": r.conversation_id,
+            "question": r.question,
+            "answer_annotated": r.answer_annotated,
+            "source_documents": source_documents(r.extra, chunks),
+            "entities": entity_infos(r.entities),
+            "created_at": r.created_at,
+        }
+        for r in records
+    ]
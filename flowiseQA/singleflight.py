@@ -0,0 +1,74 @@
+import asyncio
+import json
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+# 请求合并（single-flight）：同一时刻键相同的上游调用只真正发出一次，其余调用等待并共享同一结果（或同一异常）。
+# 调用完成后立即移除，不缓存结果。共享的结果对象可能被多个请求同时持有，调用方不应原地修改
+
+def key(*parts: Any) -> str:
+    """
+    把调用参数规范化为合并键（字典按键排序，保证相同载荷得到相同的键）
+    """
+    return json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+
+def _consume_exception(task: asyncio.Task) -> None:
+    # 所有等待者都已取消时，避免 "exception was never retrieved" 警告
+    if not task.cancelled():
+        task.exception()
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        _groups[name] = self
+
+    async def do(self, call_key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        执行或加入一次调用
+
+        Returns:
+            (结果, 是否与其他请求共享)；第二项为 False 表示本调用是真正发出请求的一方
+        """
+        with self._lock:
+            task = self._inflight.get(call_key)
+            shared = task is not None
+            if shared:
+                self.coalesced += 1
+            else:
+                self.calls += 1
+                # 放入独立任务执行：发起方被取消时不影响其他等待者
+                task = asyncio.ensure_future(fn())
+                self._inflight[call_key] = task
+                task.add_done_callback(lambda t: self._forget(call_key, t))
+                task.add_done_callback(_consume_exception)
+        return await asyncio.shield(task), shared
+
+    def _forget(self, call_key: Hashable, task: asyncio.Task) -> None:
+        with self._lock:
+            if self._inflight.get(call_key) is task:
+                del self._inflight[call_key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.calls + self.coalesced
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._inflight),
+                "coalesced_ratio": round(self.coalesced / total, 4) if total else 0.0,
+            }
+
+_groups: Dict[str, SingleFlight] = {}
+
+def group(name: str) -> SingleFlight:
+    """
+    获取具名的合并组（不存在时创建）
+    """
+    return _groups.get(name) or SingleFlight(name)
+
+def singleflight_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: flight.stats() for name, flight in _groups.items()}
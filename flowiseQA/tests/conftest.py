@@ -0,0 +1,51 @@
+import os
+import sys
+import tempfile
+
+# 测试使用临时 SQLite 数据库（须在导入 config/db 之前设置），不访问任何外部服务
+_db_dir = tempfile.mkdtemp(prefix="flowiseqa-test-")
+os.environ["DB_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ["LABEL_INDEX_ENABLED"] = "false"
+os.environ["HEDGE_ENABLED"] = "false"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from db import Base, SessionLocal, engine, sync_schema
+import conversation_state
+import graph_cache
+import upstream
+
+def _no_upstream(request: httpx.Request) -> httpx.Response:
+    raise httpx.ConnectError(f"测试中不允许访问上游: {request.url}")
+
+@pytest.fixture(autouse=True)
+def _isolated_state():
+    """
+    每个用例使用空的数据库与进程内缓存，上游请求一律失败
+    """
+    Base.metadata.drop_all(bind=engine)
+    sync_schema()
+    conversation_state._states.clear()
+    graph_cache._memory.clear()
+    graph_cache._version_checked_at = None
+    transport = httpx.MockTransport(_no_upstream)
+    for name in upstream.UPSTREAMS:
+        upstream._async_clients[name] = httpx.AsyncClient(transport=transport)
+    yield
+    upstream._async_clients.clear()
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@pytest.fixture
+def client():
+    # 不进入 lifespan：不启动后台任务
+    import main
+    return TestClient(main.app)
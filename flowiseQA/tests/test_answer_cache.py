@@ -0,0 +1,66 @@
+import asyncio
+import pytest
+import answer_cache
+from answer_cache import CachedAnswer
+from cache import TTLCache
+
+def _kb(kb_id: str, updated: str, *chatflows: str):
+    return {"id": kb_id, "updatedDate": updated, "whereUsed": [{"id": cf} for cf in chatflows]}
+
+@pytest.fixture
+def cache(monkeypatch):
+    """
+    启用答案缓存并使用空的缓存与知识库版本
+    """
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE_ENABLED", True)
+    monkeypatch.setattr(answer_cache, "_answers", TTLCache(100, 3600, name="answer", on_evict=answer_cache._on_evict))
+    monkeypatch.setattr(answer_cache, "_embedding_index", {})
+    monkeypatch.setattr(answer_cache, "_kb_versions", {})
+    monkeypatch.setattr(answer_cache, "_kb_versions_loaded", False)
+    return answer_cache
+
+def _store(chatflow_id: str, question: str, answer: str = "答案") -> None:
+    _, probe = asyncio.run(answer_cache.lookup(chatflow_id, question))
+    answer_cache.store(probe, CachedAnswer(answer, answer, [], False))
+
+def _lookup(chatflow_id: str, question: str):
+    return asyncio.run(answer_cache.lookup(chatflow_id, question))[0]
+
+def test_normalized_question_hits_the_same_entry(cache):
+    _store("cf", "T-72坦克怎么修？")
+    assert _lookup("cf", "t72 坦克怎么修").answer_raw == "答案"
+    # 按chatflow分区
+    assert _lookup("other", "T-72坦克怎么修？") is None
+
+def test_knowledge_base_update_invalidates_only_its_chatflows(cache):
+    cache.apply_kb_versions([_kb("kb1", "d1", "cf1"), _kb("kb2", "d1", "cf2")])
+    _store("cf1", "问题")
+    _store("cf2", "问题")
+
+    assert cache.apply_kb_versions([_kb("kb1", "d2", "cf1"), _kb("kb2", "d1", "cf2")]) == ["cf1"]
+    assert _lookup("cf1", "问题") is None
+    assert _lookup("cf2", "问题") is not None
+
+def test_first_version_load_does_not_report_changes(cache):
+    assert cache.apply_kb_versions([_kb("kb1", "d1", "cf1")]) == []
+    _store("cf1", "问题")
+    assert _lookup("cf1", "问题").kb_version == "kb1@d1"
+
+def test_semantic_tier_matches_similar_questions(cache, monkeypatch):
+    vectors = {"坦克怎么修": [1.0, 0.0], "坦克如何维修": [0.99, 0.1], "天气": [0.0, 1.0]}
+
+    async def embed(question):
+        return vectors[question]
+
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE_EMBEDDING_ENABLED", True)
+    monkeypatch.setattr(answer_cache, "aembed", embed)
+    _store("cf", "坦克怎么修")
+    assert _lookup("cf", "坦克如何维修").answer_raw == "答案"
+    assert _lookup("cf", "天气") is None
+    assert cache.answer_cache_stats()["tier_hits"]["semantic"] >= 1
+
+def test_disabled_cache_never_stores(cache, monkeypatch):
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE_ENABLED", False)
+    _store("cf", "问题")
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE_ENABLED", True)
+    assert _lookup("cf", "问题") is None
@@ -0,0 +1,78 @@
+import asyncio
+import httpx
+import pytest
+import cassette
+import upstream
+
+SSE = b"event: token\ndata: a\n\nevent: end\ndata: \n\n"
+
+def _upstream(request: httpx.Request) -> httpx.Response:
+    if request.url.path.endswith("/stream"):
+        return httpx.Response(200, content=SSE, headers={"content-type": "text/event-stream"})
+    if request.url.path.endswith("/broken"):
+        return httpx.Response(503, json={"error": "busy"})
+    return httpx.Response(200, json={"text": "答案", "question": request.read().decode()})
+
+@pytest.fixture
+def tape(tmp_path, monkeypatch):
+    monkeypatch.setattr(cassette, "UPSTREAM_CASSETTE_LATENCY_SCALE", 0)
+    monkeypatch.setattr(cassette, "_stats", cassette._Stats())
+    return str(tmp_path / "upstream.jsonl.gz")
+
+async def _record(path: str):
+    writer = cassette._Writer(path)
+    transport = cassette.RecordingTransport("flowise", httpx.MockTransport(_upstream), writer)
+    async with httpx.AsyncClient(transport=transport, base_url="http://flowise") as client:
+        answer = await client.post("/predict", json={"question": "坦克", "sessionId": "s1", "password": "p"})
+        async with client.stream("POST", "/stream", json={"question": "坦克"}) as response:
+            streamed = b"".join([chunk async for chunk in response.aiter_bytes()])
+        broken = await client.post("/broken", json={"question": "q"})
+    writer.close()
+    return answer.json(), streamed, broken.status_code
+
+async def _replay(path: str, stats):
+    transport = cassette.ReplayTransport("flowise", cassette._Cassette(path), stats)
+    # 回放时上游地址与会话ID都可以不同
+    async with httpx.AsyncClient(transport=transport, base_url="http://other-host") as client:
+        answer = await client.post("/predict", json={"question": "坦克", "sessionId": "s2"})
+        async with client.stream("POST", "/stream", json={"question": "坦克"}) as response:
+            chunks = [chunk async for chunk in response.aiter_bytes()]
+        broken = await client.post("/broken", json={"question": "q"})
+        with pytest.raises(httpx.ConnectError):
+            await client.get("/unknown")
+    return answer.json(), chunks, broken.status_code
+
+def test_recorded_interactions_replay_without_network(tape):
+    recorded = asyncio.run(_record(tape))
+    stats = upstream._UpstreamStats()
+    answer, chunks, broken_status = asyncio.run(_replay(tape, stats))
+
+    assert answer == recorded[0]
+    assert b"".join(chunks) == recorded[1]
+    # 流式响应按SSE事件分段输出
+    assert len(chunks) == 2
+    assert broken_status == recorded[2] == 503
+    assert stats.snapshot()["server_errors"] == 1
+    assert stats.snapshot()["errors"] == 1
+    assert cassette._stats.snapshot()["recorded"] == 3
+
+def test_secrets_are_redacted_on_disk(tape):
+    asyncio.run(_record(tape))
+    requests = [record["request"] for record in cassette.read_records(tape)]
+    assert requests[0]["password"] == "***"
+
+def test_similar_requests_match_by_prompt_template(tape, monkeypatch):
+    asyncio.run(_record(tape))
+    monkeypatch.setattr(cassette, "UPSTREAM_CASSETTE_MATCH", "similar")
+    loaded = cassette._Cassette(tape)
+    assert loaded.match("flowise", "POST", "/predict", {"question": "另一个问题"})["status"] == 200
+    monkeypatch.setattr(cassette, "UPSTREAM_CASSETTE_MATCH", "exact")
+    assert loaded.match("flowise", "POST", "/predict", {"question": "另一个问题"}) is None
+
+def test_truncated_tape_is_read_up_to_the_last_complete_record(tape):
+    asyncio.run(_record(tape))
+    with open(tape, "rb") as f:
+        data = f.read()
+    with open(tape, "wb") as f:
+        f.write(data[:-10])
+    assert len(list(cassette.read_records(tape))) >= 1
@@ -0,0 +1,38 @@
+import asyncio
+import crud
+import conversation_state
+
+def _get(db, conversation_id: str):
+    return asyncio.run(conversation_state.get_state(db, conversation_id))
+
+def _pin_elsewhere(db, conversation_id: str, intent_id: int) -> None:
+    # 模拟其他进程固定了路由（不经过本进程的缓存）
+    crud.update_conversation(db, conversation_id, extra={"intent_id": intent_id, "chatflow_id": f"cf{intent_id}"})
+
+def test_unsettled_state_is_reloaded_from_the_database(db):
+    conversation = crud.create_conversation(db, username="u")
+    state = _get(db, conversation.conversation_id)
+    assert state.first_turn and state.intent_id is None
+
+    _pin_elsewhere(db, conversation.conversation_id, 3)
+    assert _get(db, conversation.conversation_id).intent_id == 3
+
+def test_settled_state_is_served_from_cache(db, monkeypatch):
+    conversation = crud.create_conversation(db, username="u")
+    conversation_state.pin_route(_get(db, conversation.conversation_id), 2, "cf2")
+    conversation_state.record_turn(conversation.conversation_id)
+
+    def fail(*args):
+        raise AssertionError("已定型的状态不应查询数据库")
+
+    monkeypatch.setattr(conversation_state, "get_conversation_state", fail)
+    state = _get(db, conversation.conversation_id)
+    assert (state.intent_id, state.chatflow_id, state.turn_count) == (2, "cf2", 1)
+    assert state.settled
+
+def test_deleted_conversation_is_dropped_from_cache(db):
+    conversation = crud.create_conversation(db, username="u")
+    assert _get(db, conversation.conversation_id) is not None
+    crud.delete_conversation(db, conversation.conversation_id)
+    assert _get(db, conversation.conversation_id) is None
+    assert conversation_state._states.get(conversation.conversation_id) is None
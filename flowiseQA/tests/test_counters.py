@@ -0,0 +1,57 @@
+import pytest
+import crud
+from counters import CounterBuffer
+from db import SessionLocal
+from models import QARecord
+
+def _record(db) -> int:
+    return crud.create_record(
+        db, username="u", question="q", answer_raw="a", answer_annotated="a", chatflow_id="cf"
+    ).id
+
+def _counts(db, rec_id: int):
+    db.expire_all()
+    record = db.get(QARecord, rec_id)
+    return record.likes, record.dislikes
+
+def test_flush_merges_increments_into_one_update_per_row(db):
+    first, second = _record(db), _record(db)
+    buffer = CounterBuffer()
+    for _ in range(3):
+        buffer.add("like", first)
+    buffer.add("like", second)
+    buffer.add("dislike", second, 2)
+
+    assert buffer.flush(SessionLocal) == 3
+    assert _counts(db, first) == (3, 0)
+    assert _counts(db, second) == (1, 2)
+    assert buffer.stats()["pending_rows"] == 0
+    assert buffer.stats()["flushed_increments"] == 6
+    assert buffer.flush(SessionLocal) == 0
+
+def test_failed_flush_restores_increments(db):
+    rec_id = _record(db)
+    buffer = CounterBuffer()
+    buffer.add("like", rec_id, 2)
+
+    def fail():
+        raise RuntimeError("数据库不可用")
+
+    def broken_session():
+        session = SessionLocal()
+        session.commit = fail
+        return session
+
+    with pytest.raises(RuntimeError):
+        buffer.flush(broken_session)
+    # 失败期间新增的增量与放回的增量合并
+    buffer.add("like", rec_id)
+    assert buffer.stats()["pending_increments"] == 3
+    assert buffer.stats()["failed_flushes"] == 1
+
+    assert buffer.flush(SessionLocal) == 1
+    assert _counts(db, rec_id) == (3, 0)
+
+def test_unknown_counter_kind_is_rejected():
+    with pytest.raises(ValueError):
+        CounterBuffer().add("views", 1)
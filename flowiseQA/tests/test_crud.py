@@ -0,0 +1,86 @@
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import SQLAlchemyError
+import crud
+from models import Conversation, QAEntity, QARecord
+
+ANSWER = "<class>坦克</class>和<class>步兵</class>"
+
+def _persist(db, conversation_id=None, answer=ANSWER):
+    return crud.persist_qa_turn(
+        db,
+        username="u",
+        question="q",
+        answer_raw="坦克和步兵",
+        answer_annotated=answer,
+        chatflow_id="cf",
+        conversation_id=conversation_id,
+    )
+
+def _count(db, model) -> int:
+    return db.scalar(select(func.count()).select_from(model))
+
+def _turn_count(db, conversation_id: str) -> int:
+    db.expire_all()
+    return db.scalar(select(Conversation.turn_count).where(Conversation.conversation_id == conversation_id))
+
+def test_persist_qa_turn_writes_record_entities_and_turn(db):
+    conversation = crud.create_conversation(db, username="u")
+    rec_id, entities = _persist(db, conversation.conversation_id)
+    assert [e.entity_text for e in entities] == ["坦克", "步兵"]
+    assert all(e.qa_record_id == rec_id for e in entities)
+    assert _turn_count(db, conversation.conversation_id) == 1
+
+def test_persist_qa_turn_rolls_back_and_falls_back_to_record_only(db, monkeypatch):
+    conversation = crud.create_conversation(db, username="u")
+
+    def fail(*args, **kwargs):
+        raise SQLAlchemyError("实体写入失败")
+
+    monkeypatch.setattr(crud, "_insert_entities", fail)
+    rec_id, entities = _persist(db, conversation.conversation_id)
+    assert entities == []
+    # 第一次事务整体回滚：只留下退回路径写入的一条记录，轮数只加一次
+    assert _count(db, QARecord) == 1
+    assert _count(db, QAEntity) == 0
+    assert db.get(QARecord, rec_id).answer_annotated == ANSWER
+    assert _turn_count(db, conversation.conversation_id) == 1
+
+def test_persist_qa_turn_without_entities_reraises(db, monkeypatch):
+    def fail(*args, **kwargs):
+        raise SQLAlchemyError("写入失败")
+
+    monkeypatch.setattr(crud, "_record_extra", fail)
+    with pytest.raises(SQLAlchemyError):
+        _persist(db, answer="没有实体")
+    assert _count(db, QARecord) == 0
+
+def test_persist_qa_turn_rejects_deleted_conversation(db):
+    conversation = crud.create_conversation(db, username="u")
+    assert crud.delete_conversation(db, conversation.conversation_id)
+    with pytest.raises(LookupError):
+        _persist(db, conversation.conversation_id)
+    assert _count(db, QARecord) == 0
+    assert _count(db, QAEntity) == 0
+
+def test_soft_delete_decrements_turn_count_once(db):
+    conversation = crud.create_conversation(db, username="u")
+    first, _ = _persist(db, conversation.conversation_id)
+    _persist(db, conversation.conversation_id)
+    assert _turn_count(db, conversation.conversation_id) == 2
+
+    assert crud.logical_delete(db, first) == (True, conversation.conversation_id)
+    assert _turn_count(db, conversation.conversation_id) == 1
+    # 重复删除不再扣减
+    assert crud.logical_delete(db, first) == (False, None)
+    assert _turn_count(db, conversation.conversation_id) == 1
+
+def test_soft_delete_api_keeps_conversation_total_in_sync(db, client):
+    conversation = crud.create_conversation(db, username="u")
+    rec_id, _ = _persist(db, conversation.conversation_id)
+    _persist(db, conversation.conversation_id)
+
+    assert client.delete(f"/qa/{rec_id}").status_code == 200
+    body = client.get(f"/conversations/{conversation.conversation_id}/qa").json()
+    assert body["total"] == 1
+    assert len(body["items"]) == 1
@@ -0,0 +1,43 @@
+from sqlalchemy import Column, Integer, MetaData, String, Table, inspect, text
+from db import _add_column_ddl, _apply, _create_index, engine, sync_schema
+from models import QAEntity, QARecord
+
+def _columns(table_name: str):
+    return {c["name"] for c in inspect(engine).get_columns(table_name)}
+
+def _indexes(table_name: str):
+    return {i["name"] for i in inspect(engine).get_indexes(table_name)}
+
+def test_sync_schema_adds_missing_columns_and_indexes():
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_qa_history_conv_created"))
+        conn.execute(text("ALTER TABLE conversations DROP COLUMN description"))
+    sync_schema()
+    assert "description" in _columns("conversations")
+    assert "ix_qa_history_conv_created" in _indexes("qa_history")
+
+def test_sync_schema_dedupes_rows_before_creating_unique_index(db):
+    record = QARecord(username="u", question="q", answer_raw="a", answer_annotated="a", chatflow_id="cf")
+    db.add(record)
+    db.commit()
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX uq_qa_entities_record_text"))
+    for text_ in ("坦克", "坦克", "步兵"):
+        db.add(QAEntity(qa_record_id=record.id, entity_text=text_, start_position=0, end_position=1))
+    db.commit()
+
+    sync_schema()
+    assert "uq_qa_entities_record_text" in _indexes("qa_entities")
+    db.expire_all()
+    assert sorted(e.entity_text for e in db.get(QARecord, record.id).entities) == ["坦克", "步兵"]
+
+def test_ddl_already_applied_by_another_worker_is_skipped():
+    # 模拟另一个进程在本进程检查之后、执行之前已经创建了索引
+    index = next(i for i in QARecord.__table__.indexes if i.name == "ix_qa_history_user_created")
+    _apply("index", "qa_history", index.name, _create_index(index))
+    assert index.name in _indexes("qa_history")
+
+def test_string_server_default_is_quoted_for_the_dialect():
+    table = Table("t", MetaData(), Column("id", Integer, primary_key=True), Column("note", String(20), server_default="it's"))
+    ddl = _add_column_ddl(table, table.c.note)
+    assert ddl.endswith("NOT NULL DEFAULT 'it''s'")
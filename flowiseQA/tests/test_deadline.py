@@ -0,0 +1,87 @@
+import asyncio
+from collections import defaultdict
+import pytest
+import deadline
+from deadline import DeadlineExceeded
+
+def test_timeouts_are_capped_by_the_remaining_budget():
+    async def scenario():
+        assert deadline.timeout_for(30) == 30
+        deadline.start(5)
+        assert deadline.timeout_for(30) <= 5
+        assert deadline.timeout_for(1) == 1
+        assert deadline.has_time_for(1)
+        assert not deadline.has_time_for(10, "test_stage")
+
+    asyncio.run(scenario())
+    assert deadline.deadline_stats()["counters"]["skipped_test_stage"] >= 1
+
+def test_exhausted_budget_raises():
+    async def scenario():
+        deadline.start(0)
+        with pytest.raises(DeadlineExceeded):
+            deadline.timeout_for(30)
+
+    asyncio.run(scenario())
+
+def test_budget_does_not_leak_between_requests():
+    async def request():
+        deadline.start(0.1)
+
+    async def scenario():
+        await asyncio.create_task(request())
+        return deadline.remaining()
+
+    assert asyncio.run(scenario()) is None
+
+@pytest.fixture
+def hedging(monkeypatch):
+    """
+    开启对冲并预置耗时样本：p95 约 0.01 秒
+    """
+    monkeypatch.setattr(deadline, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(deadline, "HEDGE_MIN_DELAY", 0.01)
+    monkeypatch.setattr(deadline, "_windows", defaultdict(deadline._LatencyWindow))
+    window = deadline._windows["test"]
+    for _ in range(deadline.HEDGE_MIN_SAMPLES):
+        window.observe(0.01)
+    return window
+
+def test_slow_primary_is_hedged_and_the_faster_call_wins(hedging):
+    delays = [1.0, 0.0]
+    started = []
+
+    async def call():
+        delay = delays[len(started)]
+        started.append(delay)
+        await asyncio.sleep(delay)
+        return delay
+
+    assert asyncio.run(deadline.hedged("test", call)) == 0.0
+    assert started == [1.0, 0.0]
+    assert hedging.hedged == 1
+    assert hedging.hedge_wins == 1
+
+def test_hedge_falls_back_to_the_other_call_on_error(hedging):
+    started = []
+
+    async def call():
+        started.append(1)
+        if len(started) == 2:
+            raise RuntimeError("对冲请求失败")
+        await asyncio.sleep(0.05)
+        return "primary"
+
+    assert asyncio.run(deadline.hedged("test", call)) == "primary"
+    assert hedging.hedge_wins == 0
+
+def test_fast_calls_are_not_hedged(hedging):
+    calls = []
+
+    async def call():
+        calls.append(1)
+        return "ok"
+
+    assert asyncio.run(deadline.hedged("test", call)) == "ok"
+    assert calls == [1]
+    assert hedging.hedged == 0
@@ -0,0 +1,42 @@
+import pytest
+import entity_annotator
+from entity_annotator import AhoCorasick
+
+@pytest.fixture
+def dictionary(monkeypatch):
+    monkeypatch.setattr(entity_annotator, "_automaton", None)
+
+    def build(*terms):
+        entity_annotator.build_dictionary(terms)
+
+    return build
+
+def _matched(automaton: AhoCorasick, text: str):
+    return [text[start:end] for start, end in automaton.find(text)]
+
+def test_matches_are_leftmost_longest_and_non_overlapping():
+    automaton = AhoCorasick(["坦克", "坦克营", "营部", "装甲"])
+    assert _matched(automaton, "坦克营部与装甲") == ["坦克营", "装甲"]
+
+def test_latin_terms_only_match_whole_words():
+    automaton = AhoCorasick(["cot", "t-72"])
+    assert _matched(automaton, "cotton cot t-72a t-72") == ["cot", "t-72"]
+    # 与中文相邻时不需要词边界
+    assert _matched(automaton, "使用cot装备") == ["cot"]
+
+def test_annotate_tags_entities_with_positions_in_tagged_text(dictionary):
+    dictionary("T-72", "坦克")
+    annotated, spans = entity_annotator.annotate("T-72坦克和t-72")
+    assert annotated == "<class>T-72</class><class>坦克</class>和<class>t-72</class>"
+    assert [s.text for s in spans] == ["T-72", "坦克", "t-72"]
+    for span in spans:
+        assert annotated[span.start:span.end] == f"<class>{span.text}</class>"
+
+def test_dictionary_drops_short_numeric_and_markup_terms(dictionary):
+    dictionary("坦", "12345", "<b>", "  步兵  ", "步兵")
+    assert entity_annotator.is_ready()
+    assert entity_annotator.annotate("坦克与步兵")[0] == "坦克与<class>步兵</class>"
+
+def test_annotate_without_dictionary_returns_text_unchanged(dictionary):
+    assert not entity_annotator.is_ready()
+    assert entity_annotator.annotate("坦克") == ("坦克", [])
@@ -0,0 +1,110 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import func, select, update
+import crud
+import entity_worker
+import qa_pipeline
+from db import SessionLocal
+from entity_worker import EntityWorkerPool, WORKER_ID
+from models import QAEntity, QARecord
+
+def _pending(db, owner: str, age: float = 0) -> int:
+    rec = crud.create_record(
+        db, username="u", question="q", answer_raw="坦克", answer_annotated="坦克",
+        chatflow_id="cf", entity_status="pending", entity_owner=owner,
+    )
+    if age:
+        db.execute(update(QARecord).where(QARecord.id == rec.id).values(updated_at=datetime.utcnow() - timedelta(seconds=age)))
+        db.commit()
+    return rec.id
+
+def _updated_at(db, rec_id: int) -> datetime:
+    db.expire_all()
+    return db.get(QARecord, rec_id).updated_at
+
+@pytest.fixture
+def pool(monkeypatch):
+    # 不启动worker：提交的任务留在队列中
+    pool = EntityWorkerPool(workers=0, queue_size=10)
+    monkeypatch.setattr(qa_pipeline, "get_pool", lambda: pool)
+    return pool
+
+def _noop():
+    async def job():
+        pass
+    return job
+
+def test_submit_does_not_queue_the_same_record_twice():
+    async def scenario():
+        pool = EntityWorkerPool(workers=0, queue_size=10)
+        assert pool.submit(1, _noop())
+        assert pool.submit(1, _noop())
+        return pool
+
+    pool = asyncio.run(scenario())
+    assert pool.queue.qsize() == 1
+    assert pool.holds(1) and pool.held() == [1]
+
+def test_recover_claims_only_records_whose_lease_expired(db, pool):
+    expired = _pending(db, "other:1:dead", age=3600)
+    live = _pending(db, "other:2:live", age=10)
+
+    assert asyncio.run(qa_pipeline.recover_pending(SessionLocal)) == 1
+    assert pool.held() == [expired]
+    db.expire_all()
+    assert db.get(QARecord, expired).extra["entity_owner"] == WORKER_ID
+    assert db.get(QARecord, live).extra["entity_owner"] == "other:2:live"
+
+def test_recover_renews_records_held_by_this_process(db, pool):
+    rec_id = _pending(db, WORKER_ID, age=3600)
+    # 任务仍在本进程的队列中：续约而不是重新认领
+    assert asyncio.run(_submit_and_recover(pool, rec_id)) == 0
+    assert pool.queue.qsize() == 1
+    assert _updated_at(db, rec_id) > datetime.utcnow() - timedelta(seconds=60)
+
+async def _submit_and_recover(pool, rec_id):
+    pool.submit(rec_id, _noop())
+    return await qa_pipeline.recover_pending(SessionLocal)
+
+def test_annotation_result_clears_the_owner(db):
+    rec_id = _pending(db, WORKER_ID)
+    assert crud.update_record_annotation(db, rec_id, "<class>坦克</class>", "done")
+    db.expire_all()
+    assert db.get(QARecord, rec_id).extra == {"entity_status": "done"}
+
+def test_repeated_extraction_does_not_duplicate_entities(db):
+    rec_id = _pending(db, WORKER_ID)
+    first = crud.extract_and_save_entities(db, rec_id, "<class>坦克</class>和<class>步兵</class>")
+    second = crud.extract_and_save_entities(db, rec_id, "<class>坦克</class>和<class>步兵</class>")
+    assert [e.id for e in first] == [e.id for e in second]
+    assert db.scalar(select(func.count()).select_from(QAEntity)) == 2
+
+def test_worker_pool_runs_jobs_and_wakes_waiters():
+    async def scenario():
+        pool = EntityWorkerPool(workers=1, queue_size=10)
+        pool.start()
+        done = []
+
+        async def job():
+            done.append(1)
+
+        pool.submit(1, job)
+        assert await pool.wait(1, 1.0)
+        await pool.stop(timeout=1)
+        return pool, done
+
+    pool, done = asyncio.run(scenario())
+    assert done == [1]
+    assert pool.stats()["completed"] == 1
+    assert not pool.holds(1)
+
+def test_pool_singleton_is_started_on_demand():
+    async def scenario():
+        pool = entity_worker.start_pool(1, 1)
+        try:
+            assert entity_worker.get_pool() is pool
+        finally:
+            await pool.stop(timeout=1)
+
+    asyncio.run(scenario())
@@ -0,0 +1,90 @@
+import asyncio
+import anyio.to_thread
+import pytest
+import executors
+import main
+import purge
+from db import SessionLocal
+from executors import AdmissionGate, LaneFull
+
+def test_gate_rejects_when_queue_full_and_times_out_waiters():
+    async def scenario():
+        gate = AdmissionGate("llm", slots=1, queue_size=1, queue_timeout=0.05, retry_after=3)
+        lease = await gate.acquire()
+        waiter = asyncio.ensure_future(gate.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(LaneFull) as rejected:
+            await gate.acquire()
+        assert rejected.value.retry_after == 3
+        with pytest.raises(LaneFull):
+            await waiter
+        lease.release()
+        return gate.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["rejected"] == 1
+    assert stats["timed_out"] == 1
+    assert stats["active"] == 0
+
+def test_gate_hands_released_slot_to_waiter():
+    async def scenario():
+        gate = AdmissionGate("llm", slots=1, queue_size=1, queue_timeout=1, retry_after=3)
+        lease = await gate.acquire()
+        waiter = asyncio.ensure_future(gate.acquire())
+        await asyncio.sleep(0)
+        lease.release()
+        second = await waiter
+        assert gate.active == 1
+        second.release()
+        second.release()
+        return gate.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["admitted"] == 2
+    assert stats["active"] == 0
+
+@pytest.fixture
+def full_gate(monkeypatch):
+    gate = AdmissionGate("llm", slots=0, queue_size=0, queue_timeout=1, retry_after=7)
+    monkeypatch.setattr(executors, "llm_gate", gate)
+    monkeypatch.setattr(main, "llm_gate", gate)
+    return gate
+
+@pytest.mark.parametrize("path", ["/qa", "/qa/stream"])
+def test_full_llm_lane_returns_503_with_retry_after(client, full_gate, path):
+    resp = client.post(path, json={"username": "u", "question": "坦克怎么修"})
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == "7"
+    assert full_gate.rejected == 1
+
+def test_health_is_served_while_llm_lane_is_full(client, full_gate):
+    assert client.get("/health").status_code == 200
+
+def test_lanes_run_on_their_own_limiters():
+    async def scenario():
+        executors.configure()
+        lanes = {"qa": executors.run_qa, "db": executors.run_db, "background": executors.run_background}
+        busy = {}
+        for lane, run in lanes.items():
+            busy[lane] = await run(lambda: {name: stats["busy"] for name, stats in executors.executor_stats()["threads"].items()})
+        return busy
+
+    busy = asyncio.run(scenario())
+    for lane, snapshot in busy.items():
+        # 执行期间只占用本通道的线程
+        assert snapshot[lane] == 1
+        assert sum(snapshot.values()) - snapshot["default"] == 1
+    assert executors.executor_stats()["threads"]["background"]["threads"] == executors.BACKGROUND_THREADS
+
+def test_background_jobs_do_not_use_the_default_thread_pool(monkeypatch):
+    limiters = []
+    original = anyio.to_thread.run_sync
+
+    async def run_sync(fn, *args, limiter=None, **kwargs):
+        limiters.append(limiter)
+        return await original(fn, *args, limiter=limiter, **kwargs)
+
+    monkeypatch.setattr(anyio.to_thread, "run_sync", run_sync)
+    monkeypatch.setattr(purge, "PURGE_CHUNK_PAUSE", 0)
+    asyncio.run(purge.purge_once(SessionLocal))
+    assert limiters and all(limiter is executors._background_limiter for limiter in limiters)
@@ -0,0 +1,46 @@
+import asyncio
+from typing import Any, Dict, List
+import pytest
+import crud
+import graph_cache
+
+@pytest.fixture
+def gstore(monkeypatch):
+    """
+    模拟gStore单实体查询，记录查询的实体
+    """
+    calls: List[str] = []
+
+    async def query(entity_text: str, raise_errors: bool = False) -> Dict[str, Any]:
+        calls.append(entity_text)
+        return {"nodes": [entity_text], "relations": []}
+
+    monkeypatch.setattr(graph_cache, "aquery_entity_nodes", query)
+    monkeypatch.setattr(graph_cache, "_graph_version", graph_cache.GSTORE_GRAPH_VERSION)
+    return calls
+
+def test_entities_share_cache_after_normalization(db, gstore):
+    assert asyncio.run(graph_cache.get_or_query(db, "Ｔ-72  坦克")) == ({"nodes": ["Ｔ-72  坦克"], "relations": []}, False)
+    assert asyncio.run(graph_cache.get_or_query(db, "t-72 坦克"))[1]
+    # 清空进程内缓存后命中数据库缓存
+    graph_cache._memory.clear()
+    assert asyncio.run(graph_cache.get_or_query(db, "T-72 坦克"))[1]
+    assert gstore == ["Ｔ-72  坦克"]
+
+def test_invalidate_switches_version_and_drops_old_entries(db, gstore):
+    asyncio.run(graph_cache.get_or_query(db, "坦克"))
+    result = asyncio.run(graph_cache.invalidate(db, "v2"))
+    assert result == {"graph_version": "v2", "deleted": 1}
+    assert graph_cache.graph_version() == "v2"
+    assert crud.get_graph_version(db) == "v2"
+
+    assert not asyncio.run(graph_cache.get_or_query(db, "坦克"))[1]
+    assert gstore == ["坦克", "坦克"]
+
+def test_other_process_version_change_is_picked_up(db, gstore):
+    asyncio.run(graph_cache.get_or_query(db, "坦克"))
+    # 其他进程切换了版本：到期重新读取后旧缓存视为未命中
+    crud.set_graph_version(db, "v3")
+    graph_cache._version_checked_at = None
+    assert not asyncio.run(graph_cache.get_or_query(db, "坦克"))[1]
+    assert graph_cache.graph_version() == "v3"
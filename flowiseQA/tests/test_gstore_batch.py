@@ -0,0 +1,62 @@
+import asyncio
+import re
+from typing import Any, Dict, List
+import pytest
+import gstore_client
+import graph_cache
+from crud import get_graph_caches
+
+def _binding(needle: str, i: int) -> Dict[str, Any]:
+    return {
+        "needle": {"type": "literal", "value": needle},
+        "subject": {"type": "uri", "value": f"http://x/{needle}{i}"},
+        "predicate": {"type": "uri", "value": "http://x/p"},
+        "object": {"type": "literal", "value": f"{needle}{i}"},
+    }
+
+def _response(bindings: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {"results": {"bindings": bindings}}
+
+@pytest.fixture
+def gstore(monkeypatch):
+    """
+    模拟gStore：批量查询时排在前面的实体占满全局 LIMIT，单实体查询按 fail 集合决定是否失败
+    """
+    calls: List[str] = []
+    fail: set = set()
+
+    async def execute(sparql: str) -> Dict[str, Any]:
+        calls.append(sparql)
+        if "?needle" in sparql:
+            limit = int(re.search(r"LIMIT (\d+)", sparql).group(1))
+            return _response([_binding("a", i) for i in range(limit)])
+        needle = "b" if '"b"' in sparql else "a"
+        if needle in fail:
+            raise RuntimeError("gStore不可用")
+        return _response([_binding(needle, 0)])
+
+    monkeypatch.setattr(gstore_client, "_aexecute_gstore_query", execute)
+    return calls, fail
+
+def test_batch_requeries_entities_starved_by_global_limit(gstore):
+    calls, _ = gstore
+    result = asyncio.run(gstore_client.aquery_entities_batch(["a", "b"]))
+    assert len(result["a"]["relations"]) == gstore_client._ENTITY_ROW_LIMIT
+    # b 被 a 挤出批量结果，补查后得到自己的结果而不是空结果
+    assert len(result["b"]["relations"]) == 1
+    assert len(calls) == 2
+
+def test_batch_omits_entities_whose_requery_fails(gstore):
+    _, fail = gstore
+    fail.add("b")
+    result = asyncio.run(gstore_client.aquery_entities_batch(["a", "b"]))
+    assert "a" in result
+    assert "b" not in result
+
+def test_graph_cache_does_not_cache_starved_entities(db, gstore):
+    _, fail = gstore
+    fail.add("b")
+    results = asyncio.run(graph_cache.get_or_query_many(db, ["a", "b"]))
+    assert results["a"][0] is not None
+    assert results["b"] == (None, False)
+    assert [row.entity_key for row in get_graph_caches(db, ["a", "b"])] == ["a"]
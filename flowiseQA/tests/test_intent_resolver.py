@@ -0,0 +1,87 @@
+import asyncio
+import pytest
+import crud
+import intent_resolver
+from intent_resolver import CentroidClassifier, normalize_question
+
+@pytest.fixture
+def ollama(monkeypatch):
+    """
+    模拟Ollama意图识别：返回 intent_id，或在 fail 为 True 时抛出异常；记录调用的问题
+    """
+    calls = []
+    state = {"intent_id": 2, "fail": False}
+
+    async def request(question, *args, **kwargs):
+        calls.append(question)
+        if state["fail"]:
+            raise RuntimeError("Ollama不可用")
+        return state["intent_id"]
+
+    monkeypatch.setattr(intent_resolver, "arequest_intent", request)
+    monkeypatch.setattr(intent_resolver, "_classifier", CentroidClassifier())
+    intent_resolver._intent_cache.clear()
+    return calls, state
+
+def test_normalize_question_ignores_width_case_and_punctuation():
+    assert normalize_question("Ｔ-72 坦克，怎么修？") == normalize_question("t72坦克怎么修")
+
+def test_keyword_rules_only_apply_to_a_single_intent(ollama):
+    assert intent_resolver.classify_locally("坦克怎么修") == (4, "rules")
+    # 同时命中“维修”与“方案”两个意图时不采用规则
+    assert intent_resolver.classify_locally("维修方案") == (None, "none")
+
+def test_centroid_classifier_predicts_nearest_intent():
+    classifier = CentroidClassifier()
+    classifier.fit([
+        (normalize_question("坦克与步兵如何搭配"), 1),
+        (normalize_question("装甲车和火炮怎么组合"), 1),
+        (normalize_question("发动机坏了如何修理"), 4),
+        (normalize_question("履带断了怎么修理"), 4),
+    ])
+    intent_id, score, margin = classifier.predict(normalize_question("履带坏了如何修理"))
+    assert intent_id == 4
+    assert score > 0 and margin > 0
+
+def test_resolve_intent_prefers_rules_over_ollama(ollama):
+    calls, _ = ollama
+    assert asyncio.run(intent_resolver.resolve_intent("坦克怎么修")) == (4, "rules")
+    assert calls == []
+
+def test_resolve_intent_falls_back_to_ollama_and_caches_the_source(ollama):
+    calls, state = ollama
+    assert asyncio.run(intent_resolver.resolve_intent("这个问题没有关键词")) == (2, "ollama")
+    state["intent_id"] = 3
+    # 归一化后相同的问题命中缓存，返回首次解析时的来源
+    assert asyncio.run(intent_resolver.resolve_intent("这个问题，没有关键词？")) == (2, "ollama")
+    assert calls == ["这个问题没有关键词"]
+
+def test_resolve_intent_defaults_without_caching_on_failure(ollama):
+    calls, state = ollama
+    state["fail"] = True
+    assert asyncio.run(intent_resolver.resolve_intent("这个问题没有关键词")) == (intent_resolver.DEFAULT_INTENT_ID, "default")
+    state["fail"] = False
+    assert asyncio.run(intent_resolver.resolve_intent("这个问题没有关键词")) == (2, "ollama")
+    assert len(calls) == 2
+
+def _conversation(db, intent_id, source, questions):
+    conversation = crud.create_conversation(db, username="u")
+    crud.update_conversation(
+        db, conversation.conversation_id, extra={"intent_id": intent_id, "chatflow_id": "cf", "intent_source": source}
+    )
+    for question in questions:
+        crud.create_record(
+            db, username="u", question=question, answer_raw="a", answer_annotated="a",
+            chatflow_id="cf", conversation_id=conversation.conversation_id,
+        )
+
+def test_training_uses_only_trusted_first_turns(db):
+    _conversation(db, 4, "ollama", ["发动机坏了如何修理", "那第二步呢"])
+    _conversation(db, 1, "rules", ["坦克与步兵如何搭配"])
+    # 本地分类器自己的预测不作为训练样本
+    _conversation(db, 2, "centroid", ["发动机坏了怎么办"])
+    assert crud.get_first_turn_intents(db, intent_resolver.TRAINING_SOURCES, 100) == [
+        ("坦克与步兵如何搭配", 1),
+        ("发动机坏了如何修理", 4),
+    ]
+    assert intent_resolver.train_from_history(db) == 2
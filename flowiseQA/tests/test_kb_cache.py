@@ -0,0 +1,82 @@
+import asyncio
+import time
+import pytest
+import kb_cache
+
+def _kb(kb_id: str, *files: str):
+    return {"id": kb_id, "name": kb_id, "loaders": [{"id": "l", "files": [{"id": f, "name": f} for f in files]}]}
+
+@pytest.fixture
+def flowise(monkeypatch):
+    """
+    模拟Flowise知识库列表接口：每次调用返回 state["kbs"]，fail 为 True 时抛出异常；调用前先等待 gate
+    """
+    state = {"kbs": [_kb("kb1", "a.pdf")], "fail": False, "calls": 0, "gate": None}
+
+    async def fetch_all():
+        state["calls"] += 1
+        if state["gate"] is not None:
+            await state["gate"].wait()
+        if state["fail"]:
+            raise RuntimeError("Flowise不可用")
+        return state["kbs"]
+
+    monkeypatch.setattr(kb_cache, "aget_all_knowledge_bases", fetch_all)
+    monkeypatch.setattr(kb_cache, "_snapshot", None)
+    monkeypatch.setattr(kb_cache, "_refresh_task", None)
+    return state
+
+def _age_snapshot(seconds: float) -> None:
+    kb_cache._snapshot.loaded_at = time.monotonic() - seconds
+
+def test_concurrent_misses_share_one_refresh(flowise):
+    async def scenario():
+        flowise["gate"] = asyncio.Event()
+        waiters = [asyncio.create_task(kb_cache.get_snapshot()) for _ in range(5)]
+        await asyncio.sleep(0)
+        flowise["gate"].set()
+        return await asyncio.gather(*waiters)
+
+    snapshots = asyncio.run(scenario())
+    assert flowise["calls"] == 1
+    assert all(s is snapshots[0] for s in snapshots)
+    assert [f.name for f in snapshots[0].files["kb1"]] == ["a.pdf"]
+
+def test_stale_snapshot_is_served_while_refreshing_in_background(flowise):
+    async def scenario():
+        first = await kb_cache.get_snapshot()
+        _age_snapshot(kb_cache.KB_CACHE_TTL + 1)
+        flowise["kbs"] = [_kb("kb1", "a.pdf", "b.pdf")]
+        stale = await kb_cache.get_snapshot()
+        await kb_cache._refresh_task
+        return first, stale, await kb_cache.get_snapshot()
+
+    first, stale, fresh = asyncio.run(scenario())
+    assert stale is first
+    assert [f.name for f in fresh.files["kb1"]] == ["a.pdf", "b.pdf"]
+    assert flowise["calls"] == 2
+
+def test_expired_snapshot_is_returned_when_refresh_fails(flowise):
+    async def scenario():
+        first = await kb_cache.get_snapshot()
+        _age_snapshot(kb_cache.KB_CACHE_STALE_TTL + 1)
+        flowise["fail"] = True
+        return first, await kb_cache.get_snapshot()
+
+    first, fallback = asyncio.run(scenario())
+    assert fallback is first
+
+def test_refresh_failure_without_snapshot_raises(flowise):
+    flowise["fail"] = True
+    with pytest.raises(RuntimeError):
+        asyncio.run(kb_cache.get_snapshot())
+
+def test_unknown_knowledge_base_falls_back_to_detail_query(flowise, monkeypatch):
+    async def fetch_one(kb_id):
+        return _kb(kb_id, "new.pdf") if kb_id == "kb2" else None
+
+    monkeypatch.setattr(kb_cache, "aget_knowledge_base_by_id", fetch_one)
+    info, files = asyncio.run(kb_cache.get_knowledge_base_files("kb2"))
+    assert info.id == "kb2"
+    assert [f.name for f in files] == ["new.pdf"]
+    assert asyncio.run(kb_cache.get_knowledge_base_files("missing")) is None
@@ -0,0 +1,51 @@
+import asyncio
+import pytest
+import label_index
+from label_index import LabelIndex
+
+ROWS = [
+    ("http://x/tank", "主战坦克"),
+    ("http://x/t72", "T-72坦克"),
+    ("http://x/t72", "T-72"),
+    ("http://x/ifv", "步兵战车"),
+    ("http://x/exact", "坦克"),
+]
+
+def test_search_returns_substring_matches_exact_first_then_shortest():
+    index = LabelIndex(ROWS)
+    assert index.search("坦克", 10) == ["http://x/exact", "http://x/tank", "http://x/t72"]
+    assert index.search("坦克", 2) == ["http://x/exact", "http://x/tank"]
+
+def test_search_is_case_insensitive_and_deduplicates_uris():
+    index = LabelIndex(ROWS)
+    # T-72 与 T-72坦克 属于同一URI，只返回一次
+    assert index.search("t-72", 10) == ["http://x/t72"]
+
+def test_bigrams_present_out_of_order_are_not_matches():
+    index = LabelIndex(ROWS)
+    # “战车步兵”的二元组都出现在倒排表中，但不是任何文本的子串
+    assert index.search("兵战步兵", 10) == []
+    assert index.search("不存在", 10) == []
+
+def test_uri_local_names_are_indexed():
+    index = LabelIndex(ROWS)
+    assert index.search("ifv", 10) == ["http://x/ifv"]
+
+def test_single_character_queries_cannot_use_the_index():
+    assert LabelIndex(ROWS).search("坦", 10) is None
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(label_index, "LABEL_INDEX_ENABLED", True)
+    monkeypatch.setattr(label_index, "_index", None)
+
+def test_resolve_falls_back_when_index_misses(enabled, monkeypatch):
+    async def fetch(page_size, max_rows):
+        return ROWS, True
+
+    monkeypatch.setattr(label_index, "afetch_literals", fetch)
+    assert label_index.resolve("坦克") is None
+    assert asyncio.run(label_index.refresh_index()) == len(label_index._index)
+    assert label_index.resolve("主战坦克") == ["http://x/tank"]
+    # 未命中时返回None（回退CONTAINS查询），不返回空列表
+    assert label_index.resolve("不存在") is None
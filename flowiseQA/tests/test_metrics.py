@@ -0,0 +1,47 @@
+import pytest
+import metrics
+import upstream
+from metrics import Histogram
+
+@pytest.fixture
+def histogram(monkeypatch):
+    # 不注册到全局指标列表
+    monkeypatch.setattr(metrics, "_histograms", [])
+    return Histogram("test_seconds", "Test histogram", ("stage",), buckets=(0.1, 1))
+
+def test_histogram_renders_cumulative_buckets(histogram):
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value, stage='a"b')
+    assert histogram.render() == [
+        "# HELP test_seconds Test histogram",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{stage="a\\"b",le="0.1"} 1',
+        'test_seconds_bucket{stage="a\\"b",le="1"} 3',
+        'test_seconds_bucket{stage="a\\"b",le="+Inf"} 4',
+        'test_seconds_sum{stage="a\\"b"} 6.05',
+        'test_seconds_count{stage="a\\"b"} 4',
+    ]
+
+def test_stage_is_labelled_with_the_current_route(monkeypatch):
+    observed = []
+    monkeypatch.setattr(metrics.STAGE_SECONDS, "observe", lambda value, **labels: observed.append(labels))
+    metrics.set_route("cf1", 3)
+    with metrics.stage("flowise"):
+        pass
+    metrics.set_route(None, None)
+    assert observed == [{"stage": "flowise", "chatflow_id": "cf1", "intent_id": "3"}]
+
+def test_upstream_error_responses_are_exported_by_status_class(client, monkeypatch):
+    stats = upstream._UpstreamStats()
+    monkeypatch.setitem(upstream._async_stats, "flowise", stats)
+    for status_code in (200, 503, 502, 404):
+        stats.started()
+        stats.finished(status_code=status_code)
+
+    client.get("/health")
+    body = client.get("/metrics").text
+    assert 'qa_upstream_requests_total{upstream="flowise",mode="async"} 4' in body
+    assert 'qa_upstream_error_responses_total{upstream="flowise",mode="async",class="5xx"} 2' in body
+    assert 'qa_upstream_error_responses_total{upstream="flowise",mode="async",class="4xx"} 1' in body
+    assert 'qa_upstream_errors_total{upstream="flowise",mode="async"} 0' in body
+    assert 'qa_http_request_duration_seconds_count{method="GET",route="/health",status="200"}' in body
@@ -0,0 +1,65 @@
+from datetime import datetime
+import pytest
+import crud
+from pagination import decode_cursor, encode_cursor
+
+def _seed(db, count: int, conversation_id=None):
+    return [
+        crud.persist_qa_turn(
+            db, username="u", question=f"q{i}", answer_raw="a", answer_annotated="a",
+            chatflow_id="cf", conversation_id=conversation_id,
+        )[0]
+        for i in range(count)
+    ]
+
+def test_cursor_encoding_round_trip():
+    ts = datetime(2024, 1, 2, 3, 4, 5, 678)
+    assert decode_cursor(encode_cursor(ts, 42)) == (ts, 42)
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "W10", "WyJ4IiwxXQ"])
+def test_decode_rejects_malformed_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+def test_history_cursor_walks_every_record_once(db):
+    ids = _seed(db, 5)
+    seen, cursor = [], None
+    while True:
+        total, records, cursor = crud.get_history_by_username(db, "u", 1, 2, cursor=cursor, with_total=True)
+        assert total == 5
+        seen += [r.id for r in records]
+        if cursor is None:
+            break
+    # 按时间倒序，同一时间戳按ID倒序
+    assert seen == sorted(ids, reverse=True)
+
+def test_conversation_cursor_walks_in_ascending_order(db):
+    conversation = crud.create_conversation(db, username="u")
+    ids = _seed(db, 5, conversation.conversation_id)
+    seen, cursor = [], None
+    while True:
+        _, records, cursor = crud.get_qa_records_by_conversation(
+            db, conversation.conversation_id, 1, 2, cursor=cursor, with_total=False
+        )
+        seen += [r.id for r in records]
+        if cursor is None:
+            break
+    assert seen == ids
+
+def test_history_api_pages_with_next_cursor(db, client):
+    ids = _seed(db, 3)
+    first = client.get("/history", params={"username": "u", "size": 2}).json()
+    assert [item["id"] for item in first["items"]] == sorted(ids, reverse=True)[:2]
+    second = client.get("/history", params={"username": "u", "size": 2, "cursor": first["next_cursor"], "with_total": False}).json()
+    assert [item["id"] for item in second["items"]] == sorted(ids, reverse=True)[2:]
+    assert second["next_cursor"] is None
+
+@pytest.mark.parametrize("path", ["/history", "/conversations"])
+def test_bad_cursor_returns_400(client, path):
+    resp = client.get(path, params={"username": "u", "cursor": "garbage"})
+    assert resp.status_code == 400
+
+def test_bad_cursor_on_conversation_qa_returns_400(db, client):
+    conversation = crud.create_conversation(db, username="u")
+    resp = client.get(f"/conversations/{conversation.conversation_id}/qa", params={"cursor": "garbage"})
+    assert resp.status_code == 400
@@ -0,0 +1,121 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, select, update
+import crud
+import purge
+from db import SessionLocal
+from models import Conversation, QAEntity, QARecord, QASourceRef, SourceChunk
+
+@pytest.fixture(autouse=True)
+def _no_pause(monkeypatch):
+    monkeypatch.setattr(purge, "PURGE_CHUNK_PAUSE", 0)
+
+def _persist(db, conversation_id=None):
+    rec_id, _ = crud.persist_qa_turn(
+        db, username="u", question="q", answer_raw="坦克", answer_annotated="<class>坦克</class>",
+        chatflow_id="cf", conversation_id=conversation_id,
+    )
+    return rec_id
+
+def _age(db, model, row_id: int, days: float) -> None:
+    # 把软删除时间前移，模拟已超过保留期
+    db.execute(update(model).where(model.id == row_id).values(deleted_at=datetime.utcnow() - timedelta(days=days)))
+    db.commit()
+
+def _count(db, model) -> int:
+    return db.scalar(select(func.count()).select_from(model))
+
+def test_purge_removes_expired_records_entities_and_empty_conversations(db):
+    conversation = crud.create_conversation(db, username="u")
+    expired = _persist(db, conversation.conversation_id)
+    kept = _persist(db)
+    crud.logical_delete(db, expired)
+    crud.logical_delete(db, kept)
+    crud.delete_conversation(db, conversation.conversation_id)
+    _age(db, QARecord, expired, purge.PURGE_RETENTION_DAYS + 1)
+    _age(db, Conversation, conversation.id, purge.PURGE_RETENTION_DAYS + 1)
+
+    summary = asyncio.run(purge.purge_once(SessionLocal))
+    assert summary["records"] == 1
+    assert summary["entities"] == 1
+    assert summary["conversations"] == 1
+    # 仍在保留期内的软删除记录保留
+    assert [r.id for r in db.scalars(select(QARecord))] == [kept]
+    assert _count(db, QAEntity) == 1
+    assert _count(db, Conversation) == 0
+
+def test_conversation_with_remaining_records_is_kept(db):
+    conversation = crud.create_conversation(db, username="u")
+    _persist(db, conversation.conversation_id)
+    crud.delete_conversation(db, conversation.conversation_id)
+    _age(db, Conversation, conversation.id, purge.PURGE_RETENTION_DAYS + 1)
+
+    assert asyncio.run(purge.purge_once(SessionLocal))["conversations"] == 0
+    assert _count(db, Conversation) == 1
+
+def test_rows_deleted_before_upgrade_start_their_retention_now(db):
+    rec_id = _persist(db)
+    db.execute(update(QARecord).where(QARecord.id == rec_id).values(is_deleted=1, deleted_at=None))
+    db.commit()
+
+    summary = asyncio.run(purge.purge_once(SessionLocal))
+    assert summary["backfilled"] == 1
+    assert summary["records"] == 0
+    db.expire_all()
+    assert db.get(QARecord, rec_id).deleted_at is not None
+
+DOC_SHARED = {"pageContent": "共享片段", "metadata": {}}
+DOC_OWN = {"pageContent": "独占片段", "metadata": {}}
+
+def _persist_with_sources(db, *documents) -> int:
+    rec_id, _ = crud.persist_qa_turn(
+        db, username="u", question="q", answer_raw="a", answer_annotated="a",
+        chatflow_id="cf", source_documents=list(documents),
+    )
+    return rec_id
+
+def _age_chunks(db, days: float) -> None:
+    db.execute(update(SourceChunk).values(last_referenced_at=datetime.utcnow() - timedelta(days=days)))
+    db.commit()
+
+def _chunks(db):
+    db.expire_all()
+    return {chunk.document["pageContent"] for chunk in db.scalars(select(SourceChunk))}
+
+def test_sweep_deletes_chunks_only_referenced_by_purged_records(db):
+    purged = _persist_with_sources(db, DOC_SHARED, DOC_OWN)
+    _persist_with_sources(db, DOC_SHARED)
+    crud.logical_delete(db, purged)
+    _age(db, QARecord, purged, purge.PURGE_RETENTION_DAYS + 1)
+    _age_chunks(db, 1)
+
+    summary = asyncio.run(purge.purge_once(SessionLocal))
+    assert summary["source_chunks"] == 1
+    assert _chunks(db) == {"共享片段"}
+    assert _count(db, QASourceRef) == 1
+
+def test_sweep_keeps_unreferenced_chunks_inside_the_grace_window(db):
+    # 片段已写入、引用所在的事务尚未提交
+    crud.save_source_chunks(db, [DOC_OWN])
+    db.commit()
+    assert asyncio.run(purge.sweep_source_chunks(SessionLocal, datetime.utcnow())) == 0
+    assert _chunks(db) == {"独占片段"}
+
+    _age_chunks(db, 1)
+    assert asyncio.run(purge.sweep_source_chunks(SessionLocal, datetime.utcnow())) == 1
+    assert _chunks(db) == set()
+
+def test_reusing_a_stale_chunk_renews_it_and_recreates_a_swept_one(db):
+    _persist_with_sources(db, DOC_OWN)
+    _age_chunks(db, 1)
+    _persist_with_sources(db, DOC_OWN)
+    db.expire_all()
+    assert db.scalar(select(SourceChunk.last_referenced_at)) > datetime.utcnow() - timedelta(minutes=1)
+
+    # 片段在检查之后被清理：重新引用时随记录一起写回
+    db.execute(delete(SourceChunk))
+    db.commit()
+    rec_id = _persist_with_sources(db, DOC_OWN)
+    assert _chunks(db) == {"独占片段"}
+    assert crud.load_source_chunks(db, [db.get(QARecord, rec_id)])
@@ -0,0 +1,56 @@
+import asyncio
+import singleflight
+from singleflight import SingleFlight
+
+async def _gated(gate: asyncio.Event, calls: list, value):
+    calls.append(value)
+    await gate.wait()
+    if isinstance(value, Exception):
+        raise value
+    return value
+
+def test_concurrent_calls_with_the_same_key_share_one_result():
+    async def scenario():
+        flight, gate, calls = SingleFlight("test_share"), asyncio.Event(), []
+        waiters = [asyncio.ensure_future(flight.do("k", lambda: _gated(gate, calls, "r"))) for _ in range(3)]
+        await asyncio.sleep(0)
+        gate.set()
+        return flight, calls, await asyncio.gather(*waiters)
+
+    flight, calls, results = asyncio.run(scenario())
+    assert calls == ["r"]
+    assert results == [("r", False), ("r", True), ("r", True)]
+    assert flight.stats()["coalesced"] == 2
+    assert flight.stats()["in_flight"] == 0
+
+def test_errors_are_shared_and_not_cached():
+    async def scenario():
+        flight, gate, calls = SingleFlight("test_error"), asyncio.Event(), []
+        waiters = [asyncio.ensure_future(flight.do("k", lambda: _gated(gate, calls, RuntimeError("失败")))) for _ in range(2)]
+        await asyncio.sleep(0)
+        gate.set()
+        outcomes = await asyncio.gather(*waiters, return_exceptions=True)
+        # 调用结束后不保留结果，下一次调用重新执行
+        retry = await flight.do("k", lambda: _gated(gate, calls, "ok"))
+        return calls, outcomes, retry
+
+    calls, outcomes, retry = asyncio.run(scenario())
+    assert all(isinstance(o, RuntimeError) for o in outcomes)
+    assert retry == ("ok", False)
+    assert len(calls) == 2
+
+def test_cancelled_caller_does_not_cancel_other_waiters():
+    async def scenario():
+        flight, gate, calls = SingleFlight("test_cancel"), asyncio.Event(), []
+        leader = asyncio.ensure_future(flight.do("k", lambda: _gated(gate, calls, "r")))
+        follower = asyncio.ensure_future(flight.do("k", lambda: _gated(gate, calls, "r")))
+        await asyncio.sleep(0)
+        leader.cancel()
+        gate.set()
+        return await follower
+
+    assert asyncio.run(scenario()) == ("r", True)
+
+def test_key_ignores_dict_ordering():
+    assert singleflight.key("q", {"x": 1, "y": 2}) == singleflight.key("q", {"y": 2, "x": 1})
+    assert singleflight.key("q", {"x": 1}) != singleflight.key("other", {"x": 1})
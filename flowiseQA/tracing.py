@@ -0,0 +1,144 @@
+import json
+import logging
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, List, Optional, Tuple
+from config import LOG_LEVEL, LOG_FORMAT, TRACE_SLOW_SECONDS, TRACE_DEBUG_TOKEN
+
+# 请求级追踪：每个请求分配 trace id（写入所有日志与响应头 X-Trace-Id），记录各阶段耗时（span）。
+# 日志一律使用 %s 惰性格式化并受级别控制；大对象用 LazyJson 包装，只有真正输出时才序列化。
+# 请求头 X-Debug-Trace 携带正确的令牌时，仅对该请求输出DEBUG日志，不影响全局日志级别
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = "x-request-id"
+DEBUG_HEADER = "x-debug-trace"
+_SAFE_TRACE_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+_trace_id: ContextVar[str] = ContextVar("trace_id", default="-")
+_debug: ContextVar[bool] = ContextVar("trace_debug", default=False)
+_spans: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("trace_spans", default=None)
+
+class TraceFilter(logging.Filter):
+    """
+    为每条日志附加当前请求的 trace id
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = _trace_id.get()
+        return True
+
+def configure_logging() -> None:
+    """
+    初始化根日志：级别由 LOG_LEVEL 控制，格式中包含 trace id
+    """
+    logging.basicConfig(level=getattr(logging, LOG_LEVEL.upper(), logging.INFO), format=LOG_FORMAT)
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(f, TraceFilter) for f in handler.filters):
+            handler.addFilter(TraceFilter())
+
+class LazyJson:
+    """
+    延迟到日志真正输出时才执行 json.dumps
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __str__(self) -> str:
+        return json.dumps(self.value, ensure_ascii=False, default=str)
+
+def trace_id() -> str:
+    return _trace_id.get()
+
+def debug_enabled(log: logging.Logger) -> bool:
+    """
+    当前请求是否需要输出DEBUG日志（全局DEBUG级别或本请求开启了调试）
+    """
+    return _debug.get() or log.isEnabledFor(logging.DEBUG)
+
+def debug(log: logging.Logger, msg: str, *args: Any) -> None:
+    """
+    输出DEBUG日志；本请求开启调试时绕过 logger 的级别检查
+    """
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(msg, *args, stacklevel=2)
+    elif _debug.get():
+        log.handle(log.makeRecord(log.name, logging.DEBUG, "(trace)", 0, msg, args, None))
+
+def record_span(name: str, seconds: float) -> None:
+    spans = _spans.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """
+    记录一段操作的耗时到当前请求的追踪中
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        record_span(name, elapsed)
+        debug(logger, "span %s %.1fms", name, elapsed * 1000)
+
+class _SpanSummary:
+    __slots__ = ("spans",)
+
+    def __init__(self, spans: List[Tuple[str, float]]):
+        self.spans = spans
+
+    def __str__(self) -> str:
+        return " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in self.spans)
+
+def _header(scope, name: str) -> Optional[str]:
+    target = name.encode("latin-1")
+    for key, value in scope.get("headers") or []:
+        if key.lower() == target:
+            return value.decode("latin-1")
+    return None
+
+class TraceMiddleware:
+    """
+    ASGI中间件：设置 trace id 与本请求的调试开关，请求结束时输出耗时概要
+    （超过 TRACE_SLOW_SECONDS 或开启调试时为INFO，否则为DEBUG）
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = _header(scope, TRACE_HEADER)
+        current = incoming if incoming and _SAFE_TRACE_ID.match(incoming) else uuid.uuid4().hex[:16]
+        debug_on = bool(TRACE_DEBUG_TOKEN) and _header(scope, DEBUG_HEADER) == TRACE_DEBUG_TOKEN
+        _trace_id.set(current)
+        _debug.set(debug_on)
+        spans: List[Tuple[str, float]] = []
+        _spans.set(spans)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-trace-id", current.encode("latin-1"))]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            args = (scope.get("method", ""), scope.get("path", ""), status["code"], elapsed * 1000, _SpanSummary(spans))
+            if debug_on or elapsed >= TRACE_SLOW_SECONDS:
+                logger.info("%s %s %s %.1fms %s", *args)
+            else:
+                debug(logger, "%s %s %s %.1fms %s", *args)
@@ -0,0 +1,174 @@
+import threading
+import httpx
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional
+import cassette
+from config import (
+    UPSTREAM_KEEPALIVE_EXPIRY,
+    FLOWISE_POOL_SIZE, OLLAMA_POOL_SIZE, MERMAID_POOL_SIZE, GSTORE_POOL_SIZE,
+    FLOWISE_TIMEOUT, OLLAMA_TIMEOUT, MERMAID_TIMEOUT, GSTORE_TIMEOUT
+)
+
+# 统一管理所有上游（Flowise / Ollama / mermaid / gStore）的HTTP连接：
+# 每个上游一个异步httpx长连接池，连接在请求之间复用。
+# 开启上游流量录制/回放时，客户端的传输层由 cassette 包装或替换
+
+@dataclass
+class UpstreamConfig:
+    pool_size: int
+    timeout: float
+
+UPSTREAMS: Dict[str, UpstreamConfig] = {
+    "flowise": UpstreamConfig(FLOWISE_POOL_SIZE, FLOWISE_TIMEOUT),
+    "ollama": UpstreamConfig(OLLAMA_POOL_SIZE, OLLAMA_TIMEOUT),
+    "mermaid": UpstreamConfig(MERMAID_POOL_SIZE, MERMAID_TIMEOUT),
+    "gstore": UpstreamConfig(GSTORE_POOL_SIZE, GSTORE_TIMEOUT),
+}
+
+class _UpstreamStats:
+    """
+    单个上游的调用统计
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.server_errors = 0
+        self.client_errors = 0
+        self.in_flight = 0
+        self.connections_opened = 0
+        self._seen_connections: set = set()
+
+    def started(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+
+    def finished(self, error: Optional[BaseException] = None, status_code: Optional[int] = None):
+        """
+        请求结束：error 为传输层异常（连接失败、超时等）；上游返回的 5xx/4xx 响应按状态码单独计数
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if isinstance(error, httpx.TimeoutException):
+                self.timeouts += 1
+            elif error is not None:
+                self.errors += 1
+            elif status_code is not None and status_code >= 500:
+                self.server_errors += 1
+            elif status_code is not None and status_code >= 400:
+                self.client_errors += 1
+
+    def track_connections(self, connection_ids):
+        with self._lock:
+            for conn_id in connection_ids:
+                if conn_id not in self._seen_connections:
+                    self._seen_connections.add(conn_id)
+                    self.connections_opened += 1
+            # 只保留当前存活的连接，避免集合无限增长
+            self._seen_connections &= set(connection_ids)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "timeouts": self.timeouts,
+                "server_errors": self.server_errors,
+                "client_errors": self.client_errors,
+                "in_flight": self.in_flight,
+                "connections_opened": self.connections_opened,
+            }
+
+class _CountingAsyncTransport(httpx.AsyncHTTPTransport):
+    """
+    带统计的异步传输层：记录请求数、传输层错误、超时、5xx/4xx 响应与新建连接数
+    """
+    def __init__(self, stats: _UpstreamStats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats.started()
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException as e:
+            self.stats.finished(e)
+            raise
+        self.stats.finished(status_code=response.status_code)
+        connections = self._connections()
+        if connections is not None:
+            self.stats.track_connections([id(conn) for conn in connections])
+        return response
+
+    def _connections(self) -> Optional[List[Any]]:
+        # httpcore 连接池的内部属性，版本变化后不存在时放弃连接统计
+        connections = getattr(getattr(self, "_pool", None), "connections", None)
+        return list(connections) if connections is not None else None
+
+    def pool_info(self) -> Optional[Dict[str, int]]:
+        connections = self._connections()
+        if connections is None:
+            return None
+        idle = sum(1 for conn in connections if conn.is_idle())
+        return {"connections": len(connections), "idle": idle, "active": len(connections) - idle}
+
+_async_clients: Dict[str, httpx.AsyncClient] = {}
+_async_transports: Dict[str, _CountingAsyncTransport] = {}
+_async_stats: Dict[str, _UpstreamStats] = {name: _UpstreamStats() for name in UPSTREAMS}
+
+def get_async_client(upstream: str) -> httpx.AsyncClient:
+    """
+    获取指定上游的共享异步客户端，首次调用时创建
+    """
+    client = _async_clients.get(upstream)
+    if client is not None and not client.is_closed:
+        return client
+
+    cfg = UPSTREAMS[upstream]
+    transport = _CountingAsyncTransport(
+        _async_stats[upstream],
+        limits=httpx.Limits(
+            max_connections=cfg.pool_size,
+            max_keepalive_connections=cfg.pool_size,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+    )
+    client = httpx.AsyncClient(
+        transport=cassette.wrap_transport(upstream, transport, _async_stats[upstream]),
+        timeout=httpx.Timeout(cfg.timeout),
+    )
+    _async_transports[upstream] = transport
+    _async_clients[upstream] = client
+    return client
+
+def pool_stats() -> Dict[str, Any]:
+    """
+    汇总各上游连接池状态
+    """
+    stats = {}
+    for name, cfg in UPSTREAMS.items():
+        entry = {
+            "pool_size": cfg.pool_size,
+            "timeout": cfg.timeout,
+            "async": _async_stats[name].snapshot(),
+        }
+        transport = _async_transports.get(name)
+        if transport is not None and not _async_clients[name].is_closed:
+            pool = transport.pool_info()
+            if pool is not None:
+                entry["async"]["pool"] = pool
+        stats[name] = entry
+    return stats
+
+async def close_clients() -> None:
+    """
+    关闭所有上游连接池（应用关闭时调用）
+    """
+    for client in list(_async_clients.values()):
+        if not client.is_closed:
+            await client.aclose()
+    _async_clients.clear()
+    _async_transports.clear()
+    cassette.close()